@@ -0,0 +1,91 @@
+# Columnar analytics for the Library Statistics view
+#
+# The library is turned into one typed pandas frame (categorical genre and
+# author, int16 year, int32 pages, bool read status, datetime date_added) and
+# every statistic is a vectorized groupby/value_counts on it. The frame is only
+# rebuilt when the data version (the storage fingerprint) changes.
+import threading
+
+import numpy as np
+import pandas as pd
+
+from records import DATE_FORMAT, Book, added_epoch
+from storage import to_bool
+
+
+# Build the typed frame from a list of books (dicts or compact records).
+# Missing years/pages become 0 and are left out of the year based statistics.
+def build_frame(books):
+    if all(isinstance(book, Book) for book in books):
+        # Read the record slots directly; dates are already epoch seconds
+        return pd.DataFrame({
+            "genre": pd.Categorical([book.genre for book in books]),
+            "author": pd.Categorical([book.author for book in books]),
+            "publication_year": np.array([book.publication_year or 0 for book in books], dtype=np.int16),
+            "pages": np.array([book.pages or 0 for book in books], dtype=np.int32),
+            "read_status": np.array([book.state & 1 for book in books], dtype=bool),
+            "date_added": pd.to_datetime(pd.array([added_epoch(book) for book in books], dtype="Int64"), unit="s"),
+        })
+    return pd.DataFrame({
+        "genre": pd.Categorical([book.get("genre") for book in books]),
+        "author": pd.Categorical([book.get("author") for book in books]),
+        "publication_year": np.array([book.get("publication_year") or 0 for book in books], dtype=np.int16),
+        "pages": np.array([book.get("pages") or 0 for book in books], dtype=np.int32),
+        "read_status": np.array([to_bool(book.get("read_status", False)) for book in books], dtype=bool),
+        # Older records call this field "addad_data"
+        "date_added": pd.to_datetime(
+            [book.get("date_added", book.get("addad_data")) for book in books],
+            format=DATE_FORMAT, errors="coerce",
+        ),
+    })
+
+
+# All statistics for the view, computed on the frame
+def frame_stats(frame, top_n=10):
+    total_books = len(frame)
+    read_books = int(frame["read_status"].sum())
+    years = frame["publication_year"]
+    decades = (years[years > 0] // 10 * 10).value_counts().sort_index(ascending=False)
+    genres = frame["genre"].value_counts()
+    authors = frame["author"].value_counts().head(top_n)
+    pages_per_genre = frame.groupby("genre", observed=True)["pages"].sum().sort_values(ascending=False)
+    added = frame["date_added"].dropna()
+    added_per_month = added.dt.to_period("M").value_counts().sort_index()
+
+    return {
+        "total_books": total_books,
+        "read_books": read_books,
+        "percentage": float(frame["read_status"].mean() * 100) if total_books else 0,
+        "total_pages": int(frame["pages"].sum()),
+        "genres": {genre: int(count) for genre, count in genres.items() if count},
+        "top_authors": {author: int(count) for author, count in authors.items() if count},
+        "decades": {int(decade): int(count) for decade, count in decades.items()},
+        "pages_per_genre": {genre: int(pages) for genre, pages in pages_per_genre.items()},
+        "added_per_month": {str(month): int(count) for month, count in added_per_month.items()},
+    }
+
+
+# Frames and their statistics per data file, shared by all sessions and
+# rebuilt only when the version passed in differs from the cached one
+class FrameCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}  # key -> (version, frame, {top_n: stats})
+
+    def stats(self, key, version, load_books, top_n=10):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                entry = (version, build_frame(load_books()), {})
+                self.entries[key] = entry
+            results = entry[2]
+            if top_n not in results:
+                results[top_n] = frame_stats(entry[1], top_n)
+            return results[top_n]
+
+    def forget(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+shared_frames = FrameCache()
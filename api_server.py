@@ -0,0 +1,496 @@
+# Headless JSON API over library_core.py, for other services
+#
+# Other services used to scrape the Streamlit page or read library.json
+# directly, racing with its writes. This process serves the same operations
+# over HTTP (stdlib http.server, a thread per connection, keep-alive):
+#
+#   GET    /status                         get_library_status()
+#   GET    /books?limit=&cursor=&author=   a page of books in id order, filtered by author, genre,
+#                                          read_status, year_min, year_max, title_contains,
+#                                          author_contains or genre_contains
+#   GET    /books/<id>                     one book
+#   POST   /books                          add_book(): {"title", "author", "publication_year",
+#                                          "genre", "read_status", "pages"}
+#   PATCH  /books/<id>                     set_read_status(): {"read_status": true, "version": 3}
+#   DELETE /books/<id>?version=3           remove_book()
+#   GET    /search?q=&by=title&typos=0     search_books(), best matches first (limit, cursor)
+#   POST   /books/batch                    {"books": [...]}: add them all with one write
+#   POST   /batch                          {"operations": [{"op": "add", "book": {...}},
+#                                          {"op": "remove", "id": ..., "version": ...},
+#                                          {"op": "set_read_status", "id": ..., "read_status": ...,
+#                                          "version": ...}]}: applied in order
+#   POST   /search/batch                   {"queries": [{"q", "by", "typos", "limit"}]}
+#
+# Bodies are JSON. Books are checked like bulk imports (bulk_io.validate_row).
+# Errors are {"error": "..."} with 400 (invalid request), 404, 409 (the book
+# changed since `version` or is gone) or 413 (body too large).
+#
+# Pages carry "next_cursor" (null on the last one): pass it back as `cursor`
+# with the same filters. Book pages are keyset pages by id, so books added or
+# removed in between never make a page repeat or skip one; search cursors are
+# positions in the ranked results.
+#
+# GET responses have an ETag of the library version (the data files'
+# fingerprint and the number of changes this process made). A request with a
+# matching If-None-Match gets 304 Not Modified without the body being computed.
+#
+# Every change goes through one writer thread (SingleWriter), in the order
+# they arrive, however many clients are connected. Adds waiting in its queue
+# are written together with one add_many(). Reads run in the request threads
+# on the shared, cached library, like Streamlit sessions.
+#
+# The library is configured like the app (LIBRARY_STORAGE, LIBRARY_FORMAT,
+# LIBRARY_WRITE_DELAY, ...); with LIBRARY_TENANTS_DIR set, ?library=<name>
+# picks one (default "default").
+#
+#   python api_server.py [--host 127.0.0.1] [--port 8600] [--library library.json]
+#   python benchmarks/bench_api.py    (load test)
+import base64
+import gc
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import library_core as core
+from bulk_io import validate_row
+from storage import LIBRARY_FILE, json_default, to_bool
+
+DEFAULT_PORT = 8600
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+MAX_BATCH = 1000
+MAX_BODY = 16 * 2**20
+WRITE_OPS = ("add", "remove", "set_read_status")
+FILTERS = {
+    "author": str, "genre": str, "read_status": to_bool, "year_min": int, "year_max": int,
+    "title_contains": str, "author_contains": str, "genre_contains": str,
+}
+
+logger = logging.getLogger(__name__)
+
+
+# Answered with {"error": message} and `status`
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# -------------------- SINGLE WRITER --------------------
+# One thread applies every change, in arrival order. Each request queues its
+# operations and waits for their results; whatever queued meanwhile is applied
+# in the next round, with runs of adds to one library written by one add_many().
+class SingleWriter:
+    def __init__(self, open_library, max_round=MAX_BATCH):
+        self.open_library = open_library
+        self.max_round = max_round
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.counts = {}  # library -> changes applied, part of the ETag
+        self.rounds = 0
+        self.written = 0
+        self.worker = threading.Thread(target=self._run, name="api-writer", daemon=True)
+        self.worker.start()
+
+    # Apply `operations` (validated, see WRITE_OPS) to `library` and return
+    # their results: {"status": ..., "book": ...} or {"status": ..., "error": ...}
+    def submit(self, library, operations):
+        future = Future()
+        self.jobs.put((library, operations, future))
+        return future.result()
+
+    def changes(self, library):
+        with self.lock:
+            return self.counts.get(library, 0)
+
+    def _run(self):
+        while True:
+            jobs = [self.jobs.get()]
+            operations = len(jobs[0][1])
+            while operations < self.max_round:
+                try:
+                    jobs.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+                operations += len(jobs[-1][1])
+            by_library = OrderedDict()
+            for job in jobs:
+                by_library.setdefault(job[0], []).append(job)
+            for library, library_jobs in by_library.items():
+                try:
+                    self._apply(library, library_jobs)
+                except Exception as e:
+                    logger.error("Writing to library %s failed: %s", library, e)
+                    for _, _, future in library_jobs:
+                        if not future.done():
+                            future.set_exception(e)
+            self.rounds += 1
+
+    def _apply(self, library, jobs):
+        repo = self.open_library(library)
+        results = [[None] * len(operations) for _, operations, _ in jobs]
+        steps = [(j, i, op) for j, (_, operations, _) in enumerate(jobs) for i, op in enumerate(operations)]
+        try:
+            self._steps(repo, steps, results)
+        finally:
+            # After the changes are visible, so an ETag never names data older than it
+            with self.lock:
+                self.counts[library] = self.counts.get(library, 0) + 1
+                self.written += len(steps)
+        for (_, _, future), job_results in zip(jobs, results):
+            future.set_result(job_results)
+
+    def _steps(self, repo, steps, results):
+        start = 0
+        while start < len(steps):
+            j, i, op = steps[start]
+            if op["op"] == "add":
+                end = start + 1
+                while end < len(steps) and steps[end][2]["op"] == "add":
+                    end += 1
+                books = core.add_books(repo, [step[2]["book"] for step in steps[start:end]])
+                for (j, i, _), book in zip(steps[start:end], books):
+                    results[j][i] = {"status": 201, "book": book}
+                start = end
+                continue
+            if op["op"] == "remove":
+                done = core.remove_book(repo, op["id"], op["version"])
+                results[j][i] = {"status": 204} if done else conflict(op["id"])
+            else:
+                done = core.set_read_status(repo, op["id"], op["read_status"], op["version"])
+                results[j][i] = {"status": 200, "book": core.get_book(repo, op["id"])} if done else conflict(op["id"])
+            start += 1
+
+    def stats(self):
+        with self.lock:
+            return {"queued": self.jobs.qsize(), "rounds": self.rounds, "written": self.written}
+
+
+def conflict(book_id):
+    return {"status": 409, "error": f"Book {book_id} was changed or removed since that version"}
+
+
+# -------------------- REQUEST HELPERS --------------------
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise ApiError(400, "invalid cursor")
+
+
+def to_int(name, value, low=None, high=None):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{name} must be an integer")
+    if (low is not None and number < low) or (high is not None and number > high):
+        raise ApiError(400, f"{name} must be between {low} and {high}")
+    return number
+
+
+# The operation of a POST /batch entry, checked before it is queued
+def write_operation(entry):
+    if not isinstance(entry, dict) or entry.get("op") not in WRITE_OPS:
+        raise ApiError(400, f"each operation needs an \"op\" of {', '.join(WRITE_OPS)}")
+    if entry["op"] == "add":
+        return {"op": "add", "book": book_fields(entry.get("book"))}
+    if not isinstance(entry.get("id"), str):
+        raise ApiError(400, "\"id\" is required")
+    version = entry.get("version")
+    operation = {"op": entry["op"], "id": entry["id"],
+                 "version": None if version is None else to_int("version", version, 1)}
+    if entry["op"] == "set_read_status":
+        if not isinstance(entry.get("read_status"), bool):
+            raise ApiError(400, "\"read_status\" must be true or false")
+        operation["read_status"] = entry["read_status"]
+    return operation
+
+
+def book_fields(data):
+    if not isinstance(data, dict):
+        raise ApiError(400, "a book must be a JSON object")
+    try:
+        return validate_row(data)
+    except ValueError as e:
+        raise ApiError(400, str(e))
+
+
+def search_query(params):
+    term = params.get("q")
+    if not term:
+        raise ApiError(400, "\"q\" is required")
+    by = str(params.get("by", "title")).capitalize()
+    if by not in core.SEARCH_FIELDS:
+        raise ApiError(400, f"\"by\" must be one of {', '.join(core.SEARCH_FIELDS)}")
+    typos = to_int("typos", params.get("typos", 0), 0, 2)
+    limit = to_int("limit", params.get("limit", DEFAULT_PAGE_SIZE), 1, MAX_PAGE_SIZE)
+    return str(term), by, typos, limit
+
+
+# -------------------- API --------------------
+# The operations behind the routes, on the library of each request
+class LibraryApi:
+    def __init__(self, path=LIBRARY_FILE, environ=os.environ):
+        self.path = path
+        self.environ = environ
+        self.pool = core.open_libraries(environ) if environ.get("LIBRARY_TENANTS_DIR") else None
+        self.writer = SingleWriter(self.open)
+
+    # A repository on `library` (None without LIBRARY_TENANTS_DIR), loaded
+    def open(self, library):
+        repo = core.open_library(self.path, self.environ, pool=self.pool, name=library)
+        core.load_library(repo)
+        return repo
+
+    def etag(self, library, repo):
+        version = repr((library, repo.version(), self.writer.changes(library)))
+        return '"' + hashlib.blake2b(version.encode(), digest_size=12).hexdigest() + '"'
+
+    def status(self, repo, params):
+        return core.get_library_status(repo)
+
+    def list_books(self, repo, params):
+        limit = to_int("limit", params.get("limit", DEFAULT_PAGE_SIZE), 1, MAX_PAGE_SIZE)
+        after = decode_cursor(params["cursor"]) if params.get("cursor") else None
+        if after is not None and not isinstance(after, str):
+            raise ApiError(400, "invalid cursor")
+        filters = {}
+        for name, convert in FILTERS.items():
+            if name in params:
+                filters[name] = to_int(name, params[name]) if convert is int else convert(params[name])
+        books, last = core.get_books_page(repo, limit, after, filters)
+        return {"books": books, "next_cursor": encode_cursor(last) if last is not None else None}
+
+    def get_book(self, repo, params, book_id):
+        book = core.get_book(repo, book_id)
+        if book is None:
+            raise ApiError(404, f"No book {book_id}")
+        return book
+
+    def search(self, repo, params):
+        term, by, typos, limit = search_query(params)
+        offset = decode_cursor(params["cursor"]) if params.get("cursor") else 0
+        if not isinstance(offset, int) or offset < 0:
+            raise ApiError(400, "invalid cursor")
+        books = core.search_books(repo, term, by, typos, limit=offset + limit + 1)
+        more = len(books) > offset + limit
+        return {"books": books[offset:offset + limit],
+                "next_cursor": encode_cursor(offset + limit) if more else None}
+
+    def search_batch(self, repo, body):
+        queries = body.get("queries") if isinstance(body, dict) else None
+        if not isinstance(queries, list) or len(queries) > MAX_BATCH:
+            raise ApiError(400, f"\"queries\" must be a list of at most {MAX_BATCH} searches")
+        checked = [search_query(entry if isinstance(entry, dict) else {}) for entry in queries]
+        return {"results": [core.search_books(repo, term, by, typos, limit=limit)
+                            for term, by, typos, limit in checked]}
+
+    # -------------------- WRITES --------------------
+    def add_book(self, library, body):
+        return self._write(library, [{"op": "add", "book": book_fields(body)}])[0]
+
+    def add_books(self, library, body):
+        books = body.get("books") if isinstance(body, dict) else None
+        if not isinstance(books, list) or not 0 < len(books) <= MAX_BATCH:
+            raise ApiError(400, f"\"books\" must be a list of 1 to {MAX_BATCH} books")
+        operations = []
+        for n, book in enumerate(books):
+            try:
+                operations.append({"op": "add", "book": book_fields(book)})
+            except ApiError as e:
+                raise ApiError(400, f"book {n}: {e}")
+        results = self._write(library, operations)
+        return {"status": 201, "books": [result["book"] for result in results]}
+
+    def set_read_status(self, library, body, book_id):
+        if not isinstance(body, dict):
+            raise ApiError(400, "the body must be a JSON object")
+        return self._write(library, [write_operation(dict(body, op="set_read_status", id=book_id))])[0]
+
+    def remove_book(self, library, params, book_id):
+        version = params.get("version")
+        return self._write(library, [write_operation({"op": "remove", "id": book_id, "version": version})])[0]
+
+    def batch(self, library, body):
+        operations = body.get("operations") if isinstance(body, dict) else None
+        if not isinstance(operations, list) or not 0 < len(operations) <= MAX_BATCH:
+            raise ApiError(400, f"\"operations\" must be a list of 1 to {MAX_BATCH} operations")
+        checked = []
+        for n, entry in enumerate(operations):
+            try:
+                checked.append(write_operation(entry))
+            except ApiError as e:
+                raise ApiError(400, f"operation {n}: {e}")
+        return {"status": 200, "results": self._write(library, checked)}
+
+    def _write(self, library, operations):
+        if self.pool is not None:
+            self.pool.path(library)  # a valid name, before anything is queued
+        return self.writer.submit(library, operations)
+
+
+# (method, path pattern, LibraryApi method, kind): "read" handlers get a
+# repository and the query parameters, and their GET responses an ETag;
+# "write" handlers get the library name and the JSON body (or the query
+# parameters for DELETE) and return a result with its "status"
+ROUTES = [
+    ("GET", re.compile(r"/status"), "status", "read"),
+    ("GET", re.compile(r"/books"), "list_books", "read"),
+    ("POST", re.compile(r"/books"), "add_book", "write"),
+    ("POST", re.compile(r"/books/batch"), "add_books", "write"),
+    ("GET", re.compile(r"/books/([^/]+)"), "get_book", "read"),
+    ("PATCH", re.compile(r"/books/([^/]+)"), "set_read_status", "write"),
+    ("DELETE", re.compile(r"/books/([^/]+)"), "remove_book", "write"),
+    ("GET", re.compile(r"/search"), "search", "read"),
+    ("POST", re.compile(r"/search/batch"), "search_batch", "read"),
+    ("POST", re.compile(r"/batch"), "batch", "write"),
+]
+
+
+# -------------------- HTTP --------------------
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive: every response has a Content-Length
+    server_version = "LibraryAPI/1.0"
+    # Headers and body are two writes; with Nagle's algorithm the body would
+    # wait for the client's delayed ACK (40 ms)
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def do_PATCH(self):
+        self._handle()
+
+    def do_DELETE(self):
+        self._handle()
+
+    def _handle(self):
+        api = self.server.api
+        try:
+            url = urlsplit(self.path)
+            params = {name: values[0] for name, values in parse_qs(url.query).items()}
+            handler, kind, args = self._route(url.path)
+            library = params.get("library", "default") if api.pool is not None else None
+            if kind == "read":
+                repo = api.open(library)
+                etag = api.etag(library, repo) if self.command == "GET" else None
+                if etag is not None and self._not_modified(etag):
+                    return self._send(304, None, etag)
+                data = params if self.command == "GET" else self._body()
+                return self._send(200, handler(repo, data, *args), etag)
+            data = params if self.command == "DELETE" else self._body()
+            result = handler(library, data, *args)
+            status = result.pop("status")
+            if status == 204:
+                return self._send(204, None)
+            return self._send(status, result.get("book", result))
+        except ApiError as e:
+            self._send(e.status, {"error": str(e)})
+        except ValueError as e:  # e.g. an invalid library name
+            self._send(400, {"error": str(e)})
+        except Exception as e:
+            logger.exception("%s %s failed", self.command, self.path)
+            self._send(500, {"error": str(e)})
+
+    def _route(self, path):
+        allowed = False
+        for method, pattern, name, kind in ROUTES:
+            match = pattern.fullmatch(path)
+            if match:
+                if method == self.command:
+                    return getattr(self.server.api, name), kind, match.groups()
+                allowed = True
+        raise ApiError(405 if allowed else 404, f"{self.command} {path} is not supported" if allowed
+                       else f"No such endpoint: {path}")
+
+    def _not_modified(self, etag):
+        header = self.headers.get("If-None-Match")
+        if not header:
+            return False
+        tags = [tag.strip() for tag in header.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+    def _body(self):
+        length = to_int("Content-Length", self.headers.get("Content-Length", 0), 0)
+        if length > MAX_BODY:
+            self.close_connection = True  # the unread body would be taken for the next request
+            raise ApiError(413, f"the body is limited to {MAX_BODY} bytes")
+        data = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(data) if data else {}
+        except ValueError:
+            raise ApiError(400, "the body is not valid JSON")
+
+    def _send(self, status, body, etag=None):
+        data = b"" if body is None else json.dumps(body, default=json_default, separators=(",", ":")).encode()
+        self.send_response(status)
+        if body is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+    # One line per request only with --verbose
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, api, verbose=False):
+        super().__init__(address, ApiHandler)
+        self.api = api
+        self.verbose = verbose
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve the library as a JSON API")
+    parser.add_argument("--host", default=os.environ.get("LIBRARY_API_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("LIBRARY_API_PORT", DEFAULT_PORT)))
+    parser.add_argument("--library", default=LIBRARY_FILE, help="library file (without LIBRARY_TENANTS_DIR)")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = ApiServer((args.host, args.port), LibraryApi(args.library), args.verbose)
+    # Load the library and build its search index before the first request,
+    # then freeze them once: full passes of the cyclic garbage collector walked
+    # every book and index entry (about 0.5 s at 100,000 books) while no request
+    # thread ran. Books added later, and other libraries, are not frozen.
+    if not os.environ.get("LIBRARY_TENANTS_DIR"):
+        repo = core.open_library(args.library)
+        if core.load_library(repo):
+            core.search_books(repo, "a", "Title", limit=1)
+            gc.collect()
+            gc.freeze()
+    print(f"Serving {args.library if not os.environ.get('LIBRARY_TENANTS_DIR') else 'the libraries'} "
+          f"on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
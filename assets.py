@@ -0,0 +1,151 @@
+# Local cache for remote assets (images, Lottie animations)
+#
+# Nothing here blocks the render thread on the network:
+#   * a remote asset is downloaded once, in a background thread, with a pooled
+#     requests session and timeouts, into static/cache/
+#   * until it is there (or when offline) the bundled file from static/ is used
+#   * files older than the TTL are still served while a refresh runs in the
+#     background; the cache directory is kept under a size limit by evicting
+#     the least recently used files
+#   * parsed Lottie JSON is kept in memory after the first read
+#
+# Images are served by Streamlit's static file server (see
+# .streamlit/config.toml), so the browser fetches them from this app and can
+# cache them instead of hot-linking the original host on every render.
+# Set LIBRARY_OFFLINE=1 to never touch the network.
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATIC_URL = "app/static"
+
+logger = logging.getLogger(__name__)
+
+
+class AssetCache:
+    def __init__(self, cache_dir=os.path.join(STATIC_DIR, "cache"), ttl=7 * 24 * 3600,
+                 max_bytes=50 * 1024 * 1024, max_memory_items=32, timeout=(3.05, 10), offline=False):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_memory_items = max_memory_items
+        self.timeout = timeout
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()  # url -> parsed JSON
+        self.pending = set()         # urls being downloaded
+        self.executor = None
+        self.session = None
+
+    # Path of the cached copy of `url`
+    def path_for(self, url, ext):
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode()).hexdigest()[:20] + ext)
+
+    # Cached file for `url` or None. Missing or stale files are (re)fetched in the background.
+    def cached_file(self, url, ext):
+        path = self.path_for(url, ext)
+        try:
+            modified = os.path.getmtime(path)
+        except OSError:
+            self.fetch_async(url, path)
+            return None
+        if time.time() - modified > self.ttl:
+            self.fetch_async(url, path)
+        # Record the use for LRU eviction (atime), keep mtime for the TTL
+        os.utime(path, (time.time(), modified))
+        return path
+
+    def fetch_async(self, url, path):
+        if self.offline:
+            return
+        with self.lock:
+            if url in self.pending:
+                return
+            self.pending.add(url)
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="asset-fetch")
+        self.executor.submit(self._fetch, url, path)
+
+    def _fetch(self, url, path):
+        try:
+            if self.session is None:
+                import requests
+
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=1)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self.session = session
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as file:
+                file.write(response.content)
+            os.replace(tmp_path, path)
+            with self.lock:
+                self.memory.pop(url, None)
+            self.evict()
+        except Exception as e:
+            logger.warning("Could not fetch asset %s: %s", url, e)
+        finally:
+            with self.lock:
+                self.pending.discard(url)
+
+    # Remove least recently used files until the cache fits in max_bytes
+    def evict(self):
+        try:
+            entries = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                       if not name.startswith(".tmp-")]
+        except OSError:
+            return
+        files = sorted(((os.stat(path), path) for path in entries), key=lambda item: item[0].st_atime)
+        total = sum(info.st_size for info, _ in files)
+        for info, path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= info.st_size
+            except OSError:
+                pass
+
+    # URL the browser should use for a remote image; `bundled` is a file in static/
+    def image_url(self, url, bundled, ext=".jpg"):
+        path = self.cached_file(url, ext)
+        if path is not None:
+            return f"{STATIC_URL}/{os.path.relpath(path, STATIC_DIR).replace(os.sep, '/')}"
+        return f"{STATIC_URL}/{bundled}"
+
+    # Parsed Lottie animation JSON for `url`, the bundled copy, or None
+    def lottie(self, url, bundled=None):
+        with self.lock:
+            if url in self.memory:
+                self.memory.move_to_end(url)
+                return self.memory[url]
+        path = self.cached_file(url, ".json")
+        if path is None and bundled is not None:
+            path = os.path.join(STATIC_DIR, bundled)
+        if path is None:
+            return None
+        try:
+            with open(path, "r") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return None
+        with self.lock:
+            self.memory[url] = data
+            while len(self.memory) > self.max_memory_items:
+                self.memory.popitem(last=False)
+        return data
+
+
+# Shared by every session
+shared_assets = AssetCache(offline=os.environ.get("LIBRARY_OFFLINE") == "1")
@@ -0,0 +1,73 @@
+# Statistics benchmark: per-record dict loops vs the pandas columnar path
+#
+#   python benchmarks/bench_analytics.py [--sizes 10000 100000 1000000]
+#
+# "dict loops" is the original get_library_status() loop extended with the
+# same extra aggregates (pages per genre, books added per month, top authors).
+# For the frame path the one-off frame build and the statistics on an already
+# built frame (what a rerun pays while the data version is unchanged) are
+# timed separately.
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics import build_frame, frame_stats  # noqa: E402
+from fake_library import make_library  # noqa: E402
+
+
+def dict_stats(books, top_n=10):
+    total_books = len(books)
+    read_books = sum(1 for book in books if book["read_status"])
+    genres, authors, decades, pages_per_genre, per_month = {}, {}, {}, {}, {}
+    total_pages = 0
+    for book in books:
+        genres[book["genre"]] = genres.get(book["genre"], 0) + 1
+        authors[book["author"]] = authors.get(book["author"], 0) + 1
+        decade = (book["publication_year"] // 10) * 10
+        decades[decade] = decades.get(decade, 0) + 1
+        pages_per_genre[book["genre"]] = pages_per_genre.get(book["genre"], 0) + book["pages"]
+        month = book["date_added"][:7]
+        per_month[month] = per_month.get(month, 0) + 1
+        total_pages += book["pages"]
+    return {
+        "total_books": total_books,
+        "read_books": read_books,
+        "percentage": (read_books / total_books) * 100 if total_books > 0 else 0,
+        "total_pages": total_pages,
+        "genres": dict(sorted(genres.items(), key=lambda x: x[1], reverse=True)),
+        "top_authors": dict(sorted(authors.items(), key=lambda x: x[1], reverse=True)[:top_n]),
+        "decades": dict(sorted(decades.items(), key=lambda x: x[0], reverse=True)),
+        "pages_per_genre": dict(sorted(pages_per_genre.items(), key=lambda x: x[1], reverse=True)),
+        "added_per_month": dict(sorted(per_month.items())),
+    }
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return (time.perf_counter() - start) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'books':>10} {'dict loops ms':>14} {'frame build ms':>15} {'frame stats ms':>15}")
+    for size in args.sizes:
+        books = make_library(size)
+        dict_ms, expected = timed(lambda: dict_stats(books))
+        build_ms, frame = timed(lambda: build_frame(books))
+        stats_ms, actual = timed(lambda: frame_stats(frame))
+        for key in ("total_books", "read_books", "total_pages", "genres", "decades", "pages_per_genre",
+                    "added_per_month"):
+            if expected[key] != actual[key]:
+                raise SystemExit(f"{key} differs between the two paths at {size} books")
+        print(f"{size:>10,} {dict_ms:>14.1f} {build_ms:>15.1f} {stats_ms:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# Load test of the JSON API (api_server.py)
+#
+#   python benchmarks/bench_api.py [--books 100000] [--clients 16] [--seconds 10] [--write-share 0.2]
+#                                  [--storage log] [--write-delay 0] [--url http://host:port]
+#
+# Starts api_server.py in its own process on a synthetic library
+# (fake_library.py) in a temporary directory, unless --url points at a
+# running server. Each client is a thread with one keep-alive connection
+# that sends requests back to back until time is up:
+#   reads   GET /status (with the ETag of its last answer, so mostly 304s
+#           when nothing changed), GET /books following next_cursor, and
+#           GET /search for a random title word
+#   writes  POST /books, PATCH /books/<id> (read status of a book it saw,
+#           with the version it saw: 409 when another client got there
+#           first) and POST /books/batch of 10 books
+# --write-share sets the share of writes. Reported per endpoint and in
+# total: requests/s and latency percentiles; 409s are counted apart, and any
+# other error fails the run. All writes go through the server's single writer
+# thread, so the write rows show what one writer sustains.
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import quote, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_library import make_library  # noqa: E402
+from storage import GENRES, LogStorage  # noqa: E402
+
+WORDS = ["shadow", "night", "river", "secret", "king", "garden", "house", "lost", "star", "war"]
+READS = ("GET /status", "GET /books", "GET /search")
+WRITES = ("POST /books", "PATCH /books/<id>", "POST /books/batch")
+
+
+def new_book(rng):
+    return {"title": f"Load Test {rng.choice(WORDS).title()} {rng.randrange(10**6)}",
+            "author": f"Author {rng.randrange(1000)}", "publication_year": rng.randrange(1950, 2024),
+            "genre": rng.choice(GENRES), "read_status": False, "pages": rng.randrange(50, 900)}
+
+
+class Client:
+    def __init__(self, host, port, seed, write_share):
+        self.conn = http.client.HTTPConnection(host, port, timeout=60)
+        self.rng = random.Random(seed)
+        self.write_share = write_share
+        self.etag = None
+        self.cursor = None
+        self.seen = []  # (id, version) of books in recent answers
+        self.timings = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def call(self, name, method, path, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else None
+        headers = dict(headers or {}, **({"Content-Type": "application/json"} if data else {}))
+        start = time.perf_counter()
+        self.conn.request(method, path, data, headers)
+        response = self.conn.getresponse()
+        raw = response.read()
+        self.timings[name].append(time.perf_counter() - start)
+        self.statuses[name][response.status] += 1
+        return response, (json.loads(raw) if raw else None)
+
+    def remember(self, books):
+        self.seen = [(book["id"], book["version"]) for book in books[:20]] or self.seen
+
+    def step(self):
+        if self.rng.random() < self.write_share:
+            name = self.rng.choice(WRITES) if self.seen else "POST /books"
+            if name == "POST /books":
+                self.call(name, "POST", "/books", new_book(self.rng))
+            elif name == "POST /books/batch":
+                self.call(name, "POST", "/books/batch", {"books": [new_book(self.rng) for _ in range(10)]})
+            else:
+                book_id, version = self.rng.choice(self.seen)
+                response, book = self.call(name, "PATCH", f"/books/{book_id}",
+                                           {"read_status": self.rng.random() < 0.5, "version": version})
+                if response.status == 200:
+                    self.seen = [(book_id, book["version"]) if seen_id == book_id else (seen_id, seen_version)
+                                 for seen_id, seen_version in self.seen]
+            return
+        name = self.rng.choice(READS)
+        if name == "GET /status":
+            response, _ = self.call(name, "GET", "/status", headers={"If-None-Match": self.etag} if self.etag else None)
+            self.etag = response.getheader("ETag")
+        elif name == "GET /books":
+            path = "/books?limit=50" + (f"&cursor={quote(self.cursor)}" if self.cursor else "")
+            _, page = self.call(name, "GET", path)
+            self.cursor = page["next_cursor"]
+            self.remember(page["books"])
+        else:
+            _, page = self.call(name, "GET", f"/search?q={self.rng.choice(WORDS)}&limit=20")
+            self.remember(page["books"])
+
+    def run(self, deadline):
+        while time.perf_counter() < deadline:
+            self.step()
+
+
+# Start api_server.py on a new library of `books` books; returns the process and its URL
+def start_server(folder, books, storage, write_delay):
+    path = os.path.join(folder, "library.json")
+    snapshot = LogStorage(path)
+    snapshot.seq = 0
+    snapshot.compact(make_library(books))
+    env = dict(os.environ, LIBRARY_STORAGE=storage, LIBRARY_WRITE_DELAY=str(write_delay))
+    env.pop("LIBRARY_TENANTS_DIR", None)
+    server = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api_server.py")
+    process = subprocess.Popen([sys.executable, server, "--port", "0", "--library", path],
+                               env=env, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    match = re.search(r"http://\S+", line)
+    if not match:
+        process.kill()
+        raise SystemExit(f"The server did not start: {line!r}")
+    return process, match.group(0)
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def report(clients, seconds):
+    timings, statuses = defaultdict(list), defaultdict(lambda: defaultdict(int))
+    for client in clients:
+        for name, values in client.timings.items():
+            timings[name] += values
+        for name, counts in client.statuses.items():
+            for status, count in counts.items():
+                statuses[name][status] += count
+    print(f"{'endpoint':<20} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'max ms':>8}  statuses")
+    rows = [name for name in READS + WRITES if name in timings] + ["total"]
+    timings["total"] = [value for name in rows[:-1] for value in timings[name]]
+    failed = 0
+    for name in rows:
+        values = sorted(timings[name])
+        if name != "total":
+            failed += sum(count for status, count in statuses[name].items() if status >= 400 and status != 409)
+        codes = " ".join(f"{status}:{count}" for status, count in sorted(statuses[name].items()))
+        print(f"{name:<20} {len(values):>9,} {len(values) / seconds:>8,.0f} {percentile(values, 0.5) * 1000:>8.2f} "
+              f"{percentile(values, 0.95) * 1000:>8.2f} {percentile(values, 0.99) * 1000:>8.2f} "
+              f"{values[-1] * 1000:>8.2f}  {codes}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--books", type=int, default=100_000)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--write-share", type=float, default=0.2)
+    parser.add_argument("--storage", choices=["log", "json", "sqlite"], default="log")
+    parser.add_argument("--write-delay", type=float, default=0)
+    parser.add_argument("--url", help="test a running server instead of starting one")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        process = None
+        url = args.url
+        if url is None:
+            process, url = start_server(folder, args.books, args.storage, args.write_delay)
+            print(f"{args.books:,} books, {args.storage} backend, write delay {args.write_delay:g} s")
+        try:
+            address = urlsplit(url)
+            clients = [Client(address.hostname, address.port, seed, args.write_share) for seed in range(args.clients)]
+            clients[0].call("warm-up", "GET", "/search?q=shadow")  # load the library and build the index
+            for client in clients:
+                client.timings.clear()
+                client.statuses.clear()
+            start = time.perf_counter()
+            threads = [threading.Thread(target=client.run, args=(start + args.seconds,)) for client in clients]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            seconds = time.perf_counter() - start
+            print(f"{args.clients} clients, {seconds:.1f} s, {args.write_share:.0%} writes")
+            failed = report(clients, seconds)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+    if failed:
+        raise SystemExit(f"{failed} request(s) failed")
+
+
+if __name__ == "__main__":
+    main()
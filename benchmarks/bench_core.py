@@ -0,0 +1,141 @@
+# Benchmark suite for the headless core (library_core.py), run by pytest-benchmark
+#
+#   pip install pytest-benchmark
+#   python -m pytest benchmarks/bench_core.py --benchmark-autosave
+#   python -m pytest benchmarks/bench_core.py --benchmark-compare --benchmark-compare-fail=mean:20%
+#
+# Every hot path (cold load, full save, add, remove, read status toggle,
+# search, statistics) is timed on deterministic synthetic libraries
+# (fake_library.py) of each size in BENCH_SIZES (default 1000,100000,1000000;
+# the 1M libraries take a few minutes to build and load). Saved runs can be
+# compared with --benchmark-compare to catch regressions.
+#
+# The repository uses the default log backend writing straight to disk (no
+# write-behind queue), with log compaction turned off so that a snapshot write
+# never lands inside an add/remove timing; test_save measures it instead.
+import os
+import random
+import sys
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import library_core as core  # noqa: E402
+from analytics import build_frame, frame_stats  # noqa: E402
+from fake_library import make_library  # noqa: E402
+from library_cache import LibraryCache  # noqa: E402
+from library_stats import LibraryStats  # noqa: E402
+from repository import LibraryRepository  # noqa: E402
+from search_index import SearchIndex  # noqa: E402
+from storage import LogStorage  # noqa: E402
+
+SIZES = [int(size) for size in os.environ.get("BENCH_SIZES", "1000,100000,1000000").split(",")]
+CHANGES = 200  # books removed/toggled per size
+
+
+# Rounds for the operations that read or write the whole library
+def rounds(size):
+    return 3 if size >= 1_000_000 else 10
+
+
+def open_repo(path):
+    repo = LibraryRepository(LogStorage(path, compact_every=sys.maxsize), LibraryCache())
+    repo.load()
+    return repo
+
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda size: f"{size}books")
+def library_path(request, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp(f"library-{request.param}") / "library.json")
+    storage = LogStorage(path)
+    storage.seq = 0
+    storage.compact(make_library(request.param))
+    return path
+
+
+@pytest.fixture(scope="module")
+def repo(library_path):
+    return open_repo(library_path)
+
+
+# Books to change, the same ones on every run
+def sample(repo, seed):
+    return random.Random(seed).sample(repo.books, min(CHANGES, len(repo.books)))
+
+
+def test_load(benchmark, library_path, repo):
+    loaded = benchmark.pedantic(open_repo, args=(library_path,), rounds=rounds(len(repo.books)))
+    assert loaded.count() == repo.count()
+
+
+def test_save(benchmark, repo):
+    benchmark.pedantic(core.save_library, args=(repo,), rounds=rounds(len(repo.books)))
+
+
+def test_add(benchmark, repo):
+    book = benchmark(core.add_book, repo, "Benchmark Book", "Bench Author", 2001, "Fiction", False, 320,
+                     "2025-01-01 00:00:00")
+    assert book["id"]
+
+
+def test_remove(benchmark, repo):
+    books = iter(sample(repo, 1))
+
+    def next_book():
+        book = next(books)
+        return (repo, book["id"], book["version"]), {}
+
+    assert benchmark.pedantic(core.remove_book, setup=next_book, rounds=min(CHANGES, len(repo.books) // 2))
+
+
+def test_set_read_status(benchmark, repo):
+    books = iter(sample(repo, 2))
+
+    def next_book():
+        book = next(books)
+        return (repo, book["id"], not book["read_status"], book["version"]), {}
+
+    assert benchmark.pedantic(core.set_read_status, setup=next_book, rounds=min(CHANGES, len(repo.books) // 2))
+
+
+def test_search(benchmark, repo):
+    core.search_books(repo, "shadow", "Title")  # build the index first
+    assert benchmark(core.search_books, repo, "shadow", "Title")
+
+
+# The duplicate check run before a book is added, for a copy of one already there
+def test_find_similar_books(benchmark, repo):
+    book = sample(repo, 5)[0]
+    title = book["title"].upper() + "!"
+    core.find_similar_books(repo, title, book["author"], book["publication_year"])  # build the index first
+    matches = benchmark(core.find_similar_books, repo, title, book["author"], book["publication_year"])
+    assert any(match["id"] == book["id"] for match, _ in matches)
+
+
+def test_search_index_build(benchmark, repo):
+    benchmark.pedantic(SearchIndex, args=(repo.books,), rounds=rounds(len(repo.books)))
+
+
+# Trend series and pace from the rollups (the changes timed above logged events)
+def test_reading_trends(benchmark, repo):
+    core.get_reading_trends(repo, "day", 90)  # load the rollups first
+    benchmark(lambda: (core.get_reading_trends(repo, "day", 90), core.get_reading_pace(repo)))
+
+
+def test_stats(benchmark, repo):
+    core.get_library_status(repo)  # load or build the aggregates first
+    status = benchmark(core.get_library_status, repo)
+    assert status["total_books"] == repo.count()
+
+
+def test_stats_rebuild(benchmark, repo):
+    stats = benchmark.pedantic(LibraryStats.from_books, args=(repo.books,), rounds=rounds(len(repo.books)))
+    assert stats.total_books == repo.count()
+
+
+def test_analytics(benchmark, repo):
+    analytics = benchmark.pedantic(lambda: frame_stats(build_frame(repo.books)), rounds=rounds(len(repo.books)))
+    assert analytics["total_books"] == repo.count()
@@ -0,0 +1,70 @@
+# Duplicate detection benchmark: the batch job (duplicates.find_groups)
+#
+#   python benchmarks/bench_duplicates.py [--sizes 10000 100000 1000000] [--threshold 0.6]
+#
+# Every synthetic library (fake_library.py) gets 1% more books copied from its
+# own, changed the way duplicates from repeated imports usually are: a title in
+# capitals with punctuation added, a title with a mistyped word and the next
+# year, or an author written with a dot after the first name. The job should
+# find them all but the few whose titles changed too much (a mistyped short
+# word in a short title), in seconds at 1M books. "other" counts groups without
+# any of the added books: similar books the generator made by chance.
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from duplicates import find_groups  # noqa: E402
+from fake_library import make_library  # noqa: E402
+
+DUPLICATE_SHARE = 0.01
+
+
+# Changed copies of random books of the library, the same ones on every run
+def make_duplicates(books, seed):
+    rng = random.Random(seed)
+    copies = []
+    for i in range(int(len(books) * DUPLICATE_SHARE)):
+        book = dict(rng.choice(books), id=f"duplicate{i}")
+        kind = i % 3
+        if kind == 0:
+            book["title"] = book["title"].upper() + "!"
+        elif kind == 1:
+            words = book["title"].split()
+            j = rng.randrange(len(words))
+            words[j] = words[j][:-1] if len(words[j]) > 2 else words[j] + "x"
+            book["title"] = " ".join(words)
+            book["publication_year"] += 1
+        else:
+            book["author"] = book["author"].replace(" ", ". ", 1)
+        copies.append(book)
+    return copies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--threshold", type=float, default=0.6)
+    args = parser.parse_args()
+
+    print(f"{'books':>10} {'added':>7} {'seconds':>8} {'exact':>7} {'near':>7} {'recall':>7} {'other':>6}")
+    for size in args.sizes:
+        books = make_library(size)
+        copies = make_duplicates(books, size)
+        books += copies
+        start = time.perf_counter()
+        groups = find_groups(books, args.threshold)
+        seconds = time.perf_counter() - start
+        grouped = {book["id"] for group in groups for book in group["books"]}
+        recall = sum(copy["id"] in grouped for copy in copies) / len(copies) if copies else 1.0
+        other = sum(not any(book["id"].startswith("duplicate") for book in group["books"]) for group in groups)
+        print(f"{len(books):>10,} {len(copies):>7,} {seconds:>8.2f} "
+              f"{sum(group['kind'] == 'exact' for group in groups):>7,} "
+              f"{sum(group['kind'] == 'near' for group in groups):>7,} {recall:>7.1%} {other:>6,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# Snapshot format benchmark: JSON vs binary record files (record_file.py)
+#
+#   python benchmarks/bench_format.py [--sizes 10000 100000 1000000]
+#
+# For each format the synthetic library is written as a LogStorage snapshot
+# and then opened the way the app does on a cold start: load through a fresh
+# cache into a repository and fetch the first View Library page (sorted by
+# date added, every field of the 20 books read). The statistics time is
+# LibraryStats.from_books() on the loaded books, which for binary snapshots
+# only reads the columns.
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_library import make_library  # noqa: E402
+from library_cache import LibraryCache  # noqa: E402
+from library_stats import LibraryStats  # noqa: E402
+from records import compact_books  # noqa: E402
+from repository import LibraryRepository  # noqa: E402
+from storage import LogStorage  # noqa: E402
+
+PAGE_SIZE = 20
+
+
+def timed(run):
+    start = time.perf_counter()
+    result = run()
+    return result, time.perf_counter() - start
+
+
+def measure(folder, books, snapshot_format):
+    path = os.path.join(folder, f"library-{snapshot_format}.json")
+    storage = LogStorage(path, snapshot_format=snapshot_format)
+    storage.seq = 0
+    _, write_seconds = timed(lambda: storage.compact(books))
+
+    repo = LibraryRepository(LogStorage(path, snapshot_format=snapshot_format), LibraryCache())
+
+    def first_page():
+        repo.load()
+        return [book.to_dict() for book in repo.query(order_by="date_added", limit=PAGE_SIZE)]
+
+    page, load_seconds = timed(first_page)
+    stats, stats_seconds = timed(lambda: LibraryStats.from_books(repo.books))
+    if stats.total_books != len(books) or len(page) != min(PAGE_SIZE, len(books)):
+        raise SystemExit(f"{snapshot_format}: wrong result")
+    return os.path.getsize(path), write_seconds, load_seconds, stats_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON vs binary library snapshots")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'books':>10} {'format':>7} {'file MB':>8} {'write s':>8} {'first page s':>13} {'stats s':>8}")
+    for size in args.sizes:
+        books = compact_books(make_library(size))
+        with tempfile.TemporaryDirectory() as folder:
+            for snapshot_format in ("json", "binary"):
+                file_bytes, write_seconds, load_seconds, stats_seconds = measure(folder, books, snapshot_format)
+                print(f"{size:>10,} {snapshot_format:>7} {file_bytes / 1024 / 1024:>8.1f} {write_seconds:>8.2f} "
+                      f"{load_seconds:>13.2f} {stats_seconds:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
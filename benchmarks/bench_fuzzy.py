@@ -0,0 +1,107 @@
+# Fuzzy search benchmark: deletion dictionary (fuzzy.py) vs an edit distance scan
+#
+#   python benchmarks/bench_fuzzy.py [--sizes 10000 100000 1000000] [--distance 2]
+#
+# For every size the index is built once, then queries with typos (made by
+# changing, swapping or dropping a letter of words from the library) are
+# timed through SearchIndex(fuzzy=...). The baseline compares each query word
+# with every distinct word of the field, which is what a fuzzy search without
+# the dictionary has to do at the least; its results are checked against the
+# dictionary's. The dictionary lookup ("lookup ms") should stay about flat as
+# the library grows while the scan grows with the vocabulary; the rest of a
+# search is ranking the matching books, which grows with their number ("hits").
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_library import make_library  # noqa: E402
+from fuzzy import allowed_distance, edit_distance, stored  # noqa: E402
+from search_index import SearchIndex  # noqa: E402
+
+QUERY_COUNT = 20
+
+
+# Words of `field` with one typo each, the same ones on every run
+def typo_queries(books, field, seed):
+    rng = random.Random(seed)
+    queries = []
+    while len(queries) < QUERY_COUNT:
+        words = [word for word in re.findall(r"\w+", str(rng.choice(books)[field]).lower()) if len(word) >= 6]
+        if not words:
+            continue
+        word = list(rng.choice(words))
+        i = rng.randrange(len(word) - 1)
+        kind = rng.choice(("change", "swap", "drop"))
+        if kind == "change":
+            word[i] = rng.choice("abcdefghijklmnopqrstuvwxyz")
+        elif kind == "swap":
+            word[i], word[i + 1] = word[i + 1], word[i]
+        else:
+            del word[i]
+        queries.append("".join(word))
+    return queries
+
+
+# Distinct words of the field within the allowed distance of `term` (one word)
+def scan_words(vocabulary, term, max_distance):
+    distance = allowed_distance(term, max_distance)
+    return {word for word in vocabulary
+            if (edit_distance(term, word, distance) if stored(word) else (word != term) * (distance + 1)) <= distance}
+
+
+def time_call(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--distance", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'books':>10} {'field':<7} {'words':>9} {'dict s':>7} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'max ms':>8} {'lookup ms':>10} {'scan ms':>9} {'hits':>7}")
+    for size in args.sizes:
+        books = make_library(size)
+        index = SearchIndex(books)
+        for field in ("title", "author"):
+            field_index = index.fields[field]
+            start = time.perf_counter()
+            index.search(**{field: "warmup"}, fuzzy=args.distance)  # builds the dictionary
+            build_s = time.perf_counter() - start
+            vocabulary = list(field_index.tokens)
+            latencies, lookup_latencies, scan_latencies, hits = [], [], [], 0
+            for term in typo_queries(books, field, size):
+                ms, found = time_call(lambda: index.search(**{field: term}, fuzzy=args.distance), args.repeat)
+                latencies.append(ms)
+                hits += len(found)
+                scan_ms, words = time_call(lambda: scan_words(vocabulary, term, args.distance), 1)
+                scan_latencies.append(scan_ms)
+                distance = allowed_distance(term, args.distance)
+                lookup_ms, expected = time_call(lambda: set(field_index.fuzzy.lookup(term, distance)), args.repeat)
+                lookup_latencies.append(lookup_ms)
+                if term in field_index.tokens:
+                    expected.add(term)
+                if words != expected:
+                    raise SystemExit(f"Word mismatch for {term!r} in {field}")
+            latencies.sort()
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            print(f"{size:>10,} {field:<7} {len(vocabulary):>9,} {build_s:>7.2f} "
+                  f"{statistics.median(latencies):>8.3f} {p95:>8.3f} {latencies[-1]:>8.3f} "
+                  f"{statistics.median(lookup_latencies):>10.3f} {statistics.median(scan_latencies):>9.1f} {hits:>7,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# Memory benchmark: the library as a list of dicts vs compact records
+#
+#   python benchmarks/bench_memory.py [--sizes 10000 100000 1000000]
+#
+# Both layouts are built the way the app builds them, by parsing the JSON
+# text of a synthetic library (so every dict has its own strings, as after
+# json.load), and measured with tracemalloc once the parse is done. For the
+# compact layout the peak while converting (dicts and records alive at the
+# same time) and the load time without tracemalloc are shown as well.
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_library import make_library  # noqa: E402
+from records import compact_books  # noqa: E402
+
+
+def traced(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak
+
+
+def timed(build):
+    start = time.perf_counter()
+    result = build()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory of the in-memory library layouts")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    mb = 1024 * 1024
+    print(f"{'books':>10} {'dicts MB':>9} {'B/book':>7} {'records MB':>11} {'B/book':>7} {'saved':>6} "
+          f"{'peak MB':>8} {'load dicts s':>13} {'load records s':>15}")
+    for size in args.sizes:
+        text = json.dumps(make_library(size))
+
+        books, dict_bytes, _ = traced(lambda: json.loads(text))
+        del books
+        books, record_bytes, peak = traced(lambda: compact_books(json.loads(text)))
+        if books[0].to_dict() != json.loads(text[:text.index("}") + 1] + "]")[0]:
+            raise SystemExit("records do not round-trip")
+        del books
+
+        _, dict_seconds = timed(lambda: json.loads(text))
+        _, record_seconds = timed(lambda: compact_books(json.loads(text)))
+        print(f"{size:>10,} {dict_bytes / mb:>9.1f} {dict_bytes / size:>7.0f} {record_bytes / mb:>11.1f} "
+              f"{record_bytes / size:>7.0f} {1 - record_bytes / dict_bytes:>6.0%} {peak / mb:>8.1f} "
+              f"{dict_seconds:>13.2f} {record_seconds:>15.2f}")
+
+
+if __name__ == "__main__":
+    main()
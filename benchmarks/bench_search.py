@@ -0,0 +1,80 @@
+# Search benchmark: SearchIndex vs the original linear substring scan
+#
+#   python benchmarks/bench_search.py [--sizes 10000 100000 1000000]
+#
+# For every size the index is built once, then each query is timed with both
+# paths and the result sets are compared, so a wrong answer fails the run.
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_library import make_library  # noqa: E402
+from search_index import SearchIndex  # noqa: E402
+
+QUERIES = [
+    {"title": "gatsby 12"},
+    {"title": "silent storm"},
+    {"title": "velmor"},
+    {"author": "fitzgerald"},
+    {"author": "ishiguro", "title": "memory"},
+    {"genre": "mystery", "year_min": 1990, "year_max": 1999, "read_status": True},
+    {"title": "xyz-not-there"},
+]
+
+
+# The original search_books() loop, extended to the same multi-field criteria
+def linear_search(books, title=None, author=None, genre=None, year_min=None, year_max=None, read_status=None):
+    results = []
+    for book in books:
+        if title is not None and title.lower() not in book["title"].lower():
+            continue
+        if author is not None and author.lower() not in book["author"].lower():
+            continue
+        if genre is not None and genre.lower() not in book["genre"].lower():
+            continue
+        if year_min is not None and book["publication_year"] < year_min:
+            continue
+        if year_max is not None and book["publication_year"] > year_max:
+            continue
+        if read_status is not None and book["read_status"] != read_status:
+            continue
+        results.append(book)
+    return results
+
+
+def time_call(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        books = make_library(size)
+        start = time.perf_counter()
+        index = SearchIndex(books)
+        build_s = time.perf_counter() - start
+        print(f"\n{size:,} books - index built in {build_s:.2f}s")
+        print(f"{'query':<72} {'hits':>8} {'index ms':>10} {'scan ms':>10}")
+        for query in QUERIES:
+            index_ms, found = time_call(lambda: index.search(**query), args.repeat)
+            scan_ms, expected = time_call(lambda: linear_search(books, **query), 1)
+            if {id(book) for book in found} != {id(book) for book in expected}:
+                raise SystemExit(f"Result mismatch for {query}")
+            print(f"{str(query):<72} {len(found):>8} {index_ms:>10.3f} {scan_ms:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Multi-library benchmark: LRU of open shards and fan-out aggregates (tenants.py)
+#
+#   python benchmarks/bench_tenants.py [--tenants 200] [--books 2000] [--max-open 16] [--threads 1 4 8]
+#
+# Writes `--tenants` synthetic libraries (fake_library.py) into a temporary
+# directory, then:
+#   * opens and reads every library once, with at most --max-open shards open
+#     and with all of them open, and reports the memory the shared caches
+#     still hold afterwards (tracemalloc): the LRU keeps it flat
+#   * gathers the statistics of all libraries from a fresh pool (saved
+#     aggregates, nothing loaded) and searches all of them (every library
+#     loaded), with each thread count
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import library_core as core  # noqa: E402
+from fake_library import make_library  # noqa: E402
+from library_cache import LibraryCache  # noqa: E402
+from storage import LogStorage  # noqa: E402
+from tenants import TenantPool  # noqa: E402
+
+
+def make_tenants(directory, tenants, books):
+    for i in range(tenants):
+        storage = LogStorage(os.path.join(directory, f"tenant{i:04d}.json"))
+        storage.seq = 0
+        storage.compact(make_library(books, seed=i))
+
+
+def pool(directory, max_open, threads):
+    return TenantPool(directory, max_open=max_open, write_delay=0, threads=threads, cache=LibraryCache())
+
+
+def touch_all(directory, max_open):
+    tracemalloc.start()
+    libraries = pool(directory, max_open, 1)
+    start = time.perf_counter()
+    for name in libraries.names():
+        libraries.repository(name).stats()  # also saves the aggregates for the runs below
+    seconds = time.perf_counter() - start
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return seconds, held, libraries.counters()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tenants", type=int, default=200)
+    parser.add_argument("--books", type=int, default=2000)
+    parser.add_argument("--max-open", type=int, default=16)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 8])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_tenants(directory, args.tenants, args.books)
+        print(f"{args.tenants:,} libraries of {args.books:,} books")
+
+        print(f"{'max open':>9} {'seconds':>8} {'held MB':>8} {'opened':>7} {'closed':>7}")
+        for max_open in (args.max_open, args.tenants):
+            seconds, held, counters = touch_all(directory, max_open)
+            print(f"{max_open:>9,} {seconds:>8.2f} {held / 2**20:>8.1f} {counters['opened']:>7,} {counters['closed']:>7,}")
+
+        print(f"{'threads':>9} {'status s':>8} {'search s':>8} {'results':>8}")
+        for threads in args.threads:
+            libraries = pool(directory, args.max_open, threads)
+            start = time.perf_counter()
+            status = core.get_all_libraries_status(libraries)
+            status_seconds = time.perf_counter() - start
+            assert status["total"]["total_books"] == args.tenants * args.books
+            start = time.perf_counter()
+            found, _ = core.search_all_libraries(libraries, "shadow", "Title")
+            search_seconds = time.perf_counter() - start
+            print(f"{threads:>9,} {status_seconds:>8.2f} {search_seconds:>8.2f} {len(found):>8,}")
+
+
+if __name__ == "__main__":
+    main()
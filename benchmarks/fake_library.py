@@ -0,0 +1,66 @@
+# Deterministic synthetic libraries for the benchmarks
+#
+# The same `count` and `seed` always produce the same books, so numbers from
+# different runs and machines are comparable.
+import random
+from datetime import datetime, timedelta
+
+GENRES = [
+    "Fiction", "Non-Fiction", "Science Fiction", "Fantasy", "Mystery", "Thriller", "Romance",
+    "Biography", "Autobiography", "Self-Help", "Historical Fiction", "Young Adult", "Children's",
+    "Poetry", "Graphic Novel", "Others"
+]
+
+WORDS = [
+    "the", "great", "gatsby", "shadow", "river", "night", "garden", "winter", "silent", "house",
+    "empire", "stone", "light", "secret", "journey", "ocean", "crown", "glass", "memory", "storm",
+    "kingdom", "fire", "letters", "lost", "city", "dream", "iron", "song", "forest", "road",
+    "mirror", "star", "wolf", "island", "book", "hidden", "last", "first", "golden", "dark",
+]
+
+SYLLABLES = [
+    "ka", "lo", "ren", "tha", "mi", "sol", "ver", "an", "dor", "el", "fi", "gar", "is", "jun", "mor",
+    "nel", "or", "pra", "qui", "ros", "sen", "tal", "ul", "vin", "wes", "yar", "zen", "bri", "cal", "dru",
+]
+
+FIRST_NAMES = [
+    "Jane", "John", "Mary", "Scott", "Toni", "George", "Agatha", "Ernest", "Virginia", "Leo",
+    "Chinua", "Haruki", "Isabel", "Gabriel", "Ursula", "Octavia", "James", "Zadie", "Kazuo", "Alice",
+]
+
+LAST_NAMES = [
+    "Austen", "Fitzgerald", "Morrison", "Orwell", "Christie", "Hemingway", "Woolf", "Tolstoy",
+    "Achebe", "Murakami", "Allende", "Marquez", "Le Guin", "Butler", "Baldwin", "Smith",
+    "Ishiguro", "Munro", "Eliot", "Bronte", "Dickens", "Twain", "Atwood", "Rushdie", "Pamuk",
+]
+
+
+# Build `count` book dicts shaped like the ones add_book() creates
+def make_library(count, seed=42):
+    rng = random.Random(seed)
+    # A long tail of made-up words next to the common ones, like a real catalog
+    rare_words = [a + b + c for a in SYLLABLES for b in SYLLABLES for c in ("", "a", "on", "is")]
+    rng.shuffle(rare_words)
+    # About five books per author; well-known surnames are a small share of them
+    authors = [f"{first} {last}" for first in FIRST_NAMES for last in LAST_NAMES]
+    while len(authors) < max(1, count // 5):
+        surname = (rng.choice(rare_words) + rng.choice(SYLLABLES)).capitalize()
+        authors.append(f"{rng.choice(FIRST_NAMES)} {surname}")
+    start = datetime(2020, 1, 1)
+    books = []
+    for i in range(count):
+        words = [rng.choice(WORDS) if rng.random() < 0.3 else rng.choice(rare_words)
+                 for _ in range(rng.randint(2, 5))]
+        title = " ".join(words).capitalize()
+        books.append({
+            "id": f"{seed:08x}{i:024x}",
+            "version": 1,
+            "title": f"{title} {i}",
+            "author": rng.choice(authors),
+            "publication_year": rng.randint(1800, 2025),
+            "genre": rng.choice(GENRES),
+            "read_status": rng.random() < 0.4,
+            "pages": rng.randint(50, 1200),
+            "date_added": (start + timedelta(minutes=i)).strftime("%Y-%m-%d %H:%M:%S"),
+        })
+    return books
@@ -0,0 +1,205 @@
+# Concurrency stress test: many sessions adding, removing and toggling books at once
+#
+#   python benchmarks/stress_concurrency.py [--sessions 50] [--ops 100] [--processes 1]
+#                                           [--backends log json sqlite] [--write-delay 0]
+#
+# Each session is a thread with its own LibraryRepository over the shared
+# backend, like Streamlit sessions in one server process; with --processes the
+# sessions are spread over several processes that only share the files. Every
+# step is a "rerun": load, read a page and the statistics, then act on a book
+# from that page with the version that was shown. Removes/toggles of a book
+# someone else changed in the meantime are refused (ConflictError) and counted.
+# --write-delay > 0 puts the file backends behind the write-behind queue
+# (write_behind.py), which is flushed when the sessions are done.
+#
+# Afterwards the library is reloaded from disk with a fresh backend and
+# checked: exactly the books added and not removed are there, every book's
+# version and read status match its successful toggles, and the statistics
+# match a full recompute.
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_cache import LibraryCache  # noqa: E402
+from repository import ConflictError, LibraryRepository  # noqa: E402
+from storage import GENRES, JsonStorage, LogStorage, SqliteStorage  # noqa: E402
+from write_behind import WriteBehind  # noqa: E402
+
+PAGE_SIZE = 20
+
+
+def open_storage(kind, folder):
+    if kind == "sqlite":
+        return SqliteStorage(os.path.join(folder, "library.db"), migrate_from=None)
+    if kind == "json":
+        return JsonStorage(os.path.join(folder, "library.json"))
+    return LogStorage(os.path.join(folder, "library.json"))
+
+
+def run_session(repo, session, ops, result, result_lock):
+    rng = random.Random(session)
+    added, removed, toggles = {}, [], Counter()
+    conflicts = missing = 0
+    latencies = []
+    for n in range(ops):
+        repo.load()
+        repo.stats()
+        total = repo.count()
+        page = [
+            (book["id"], book["version"], book["read_status"])
+            for book in repo.query(limit=PAGE_SIZE, offset=rng.randrange(max(1, total - PAGE_SIZE + 1)))
+        ]
+        if n % 10 == 0:
+            repo.search(title=f"s{rng.randrange(50)}-")
+        action = rng.random()
+        start = time.perf_counter()
+        try:
+            if action < 0.5 or not page:
+                book = {
+                    "title": f"s{session}-{n}", "author": f"Author {rng.randrange(100)}",
+                    "publication_year": rng.randint(1900, 2024), "genre": rng.choice(GENRES),
+                    "read_status": rng.random() < 0.5, "pages": rng.randint(50, 900),
+                    "date_added": "2025-01-01 00:00:00",
+                }
+                repo.add(book)
+                added[book["id"]] = book["read_status"]
+            elif action < 0.7:
+                book_id, version, _ = rng.choice(page)
+                if repo.remove(book_id, expected_version=version):
+                    removed.append(book_id)
+                else:
+                    missing += 1
+            else:
+                book_id, version, read_status = rng.choice(page)
+                if repo.update(book_id, {"read_status": not read_status}, expected_version=version):
+                    toggles[book_id] += 1
+                else:
+                    missing += 1
+        except ConflictError:
+            conflicts += 1
+        latencies.append(time.perf_counter() - start)
+    with result_lock:
+        result["added"].update(added)
+        result["removed"].extend(removed)
+        result["toggles"].update(toggles)
+        result["conflicts"] += conflicts
+        result["missing"] += missing
+        result["latencies"].extend(latencies)
+
+
+# Run `sessions` session threads in this process; returns the merged result
+def run_sessions(kind, folder, sessions, ops, write_delay=0):
+    storage = open_storage(kind, folder)
+    cache = LibraryCache()
+    writer = WriteBehind(storage, cache, max_delay=write_delay) if write_delay > 0 and kind != "sqlite" else None
+    result = {"added": {}, "removed": [], "toggles": Counter(), "conflicts": 0, "missing": 0, "latencies": []}
+    result_lock = threading.Lock()
+    threads = [
+        threading.Thread(target=run_session,
+                         args=(LibraryRepository(storage, cache, writer), session, ops, result, result_lock))
+        for session in sessions
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if writer is not None:
+        writer.close()
+        result["flushes"] = writer.flushes
+    return result
+
+
+def _run_sessions(args):
+    return run_sessions(*args)
+
+
+def check(kind, folder, result):
+    problems = []
+    storage = open_storage(kind, folder)
+    repo = LibraryRepository(storage, LibraryCache())
+    repo.load()
+    books = repo.all_books()
+    ids = [book["id"] for book in books]
+    removed = Counter(result["removed"])
+
+    if len(ids) != len(set(ids)):
+        problems.append("duplicate ids on disk")
+    if any(count > 1 for count in removed.values()):
+        problems.append("a book was removed more than once")
+    expected = set(result["added"]) - set(removed)
+    if set(ids) != expected:
+        problems.append(f"{len(expected - set(ids))} books lost, {len(set(ids) - expected)} unexpected books")
+    for book in books:
+        toggles = result["toggles"][book["id"]]
+        if book["version"] != 1 + toggles:
+            problems.append(f"book {book['id']}: version {book['version']}, expected {1 + toggles}")
+            break
+        if book["read_status"] != (result["added"].get(book["id"]) ^ (toggles % 2 == 1)):
+            problems.append(f"book {book['id']}: read status lost a toggle")
+            break
+    problems += repo.stats().verify(books)
+    return len(books), problems
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000 if values else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent session stress test")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--ops", type=int, default=100, help="operations per session")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--backends", nargs="+", default=["log", "json", "sqlite"], choices=["log", "json", "sqlite"])
+    parser.add_argument("--write-delay", type=float, default=0, help="seconds; 0 writes every change at once")
+    args = parser.parse_args()
+    if args.processes > 1 and args.write_delay > 0:
+        parser.error("queued changes are only checked against other processes when they are written; "
+                     "use --write-delay 0 with several processes")
+
+    failed = False
+    print(f"{args.sessions} sessions x {args.ops} operations, {args.processes} process(es)")
+    print(f"{'backend':>8} {'ops/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'conflicts':>10} {'books':>7}  result")
+    for kind in args.backends:
+        with tempfile.TemporaryDirectory() as folder:
+            groups = [list(range(args.sessions))[i::args.processes] for i in range(args.processes)]
+            start = time.perf_counter()
+            if args.processes == 1:
+                results = [run_sessions(kind, folder, groups[0], args.ops, args.write_delay)]
+            else:
+                with multiprocessing.get_context("spawn").Pool(args.processes) as pool:
+                    results = pool.map(_run_sessions, [(kind, folder, group, args.ops, args.write_delay) for group in groups])
+            seconds = time.perf_counter() - start
+
+            result = {"added": {}, "removed": [], "toggles": Counter(), "conflicts": 0, "missing": 0,
+                      "latencies": []}
+            for part in results:
+                result["added"].update(part["added"])
+                result["removed"].extend(part["removed"])
+                result["toggles"].update(part["toggles"])
+                result["conflicts"] += part["conflicts"]
+                result["missing"] += part["missing"]
+                result["latencies"].extend(part["latencies"])
+
+            count, problems = check(kind, folder, result)
+            failed = failed or bool(problems)
+            ops = len(result["latencies"])
+            print(f"{kind:>8} {ops / seconds:>8,.0f} {percentile(result['latencies'], 0.5):>8.2f} "
+                  f"{percentile(result['latencies'], 0.99):>8.2f} {result['conflicts']:>10,} {count:>7,}  "
+                  f"{'OK' if not problems else 'FAILED'}")
+            for problem in problems:
+                print(f"    {problem}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+# Bulk import/export of books (CSV, JSON Lines, Parquet)
+#
+# Files are parsed as a stream in chunks of `batch_size` rows, so memory does
+# not grow with the file. Every row is checked against the same constraints as
+# the Add Book form (title/author required, year 1000..current year, pages
+# 1..10000, genre from the list), exact duplicates of existing books or of
+# earlier rows (same title, author and year, ignoring case, accents and
+# punctuation - see duplicates.py) are skipped, and each batch is committed
+# with a single storage write.
+#
+#   python bulk_io.py import books.csv [--batch-size 5000]
+#   python bulk_io.py export backup.jsonl
+#
+# Parquet needs pyarrow (pip install pyarrow).
+import csv
+import io
+import json
+import os
+import time
+from datetime import datetime
+
+from duplicates import exact_keys
+from records import DATE_FORMAT
+from storage import BOOK_FIELDS, GENRES, MAX_PAGES, MIN_PAGES, MIN_YEAR, to_bool
+
+FORMATS = ("csv", "jsonl", "parquet")
+DEFAULT_BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 100
+
+
+# Work out the format from a file name
+def detect_format(name):
+    extension = os.path.splitext(name)[1].lower().lstrip(".")
+    if extension in ("jsonl", "ndjson"):
+        return "jsonl"
+    if extension in ("parquet", "pq"):
+        return "parquet"
+    if extension == "csv":
+        return "csv"
+    raise ValueError(f"Cannot tell the format of '{name}'. Use one of: {', '.join(FORMATS)}")
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise RuntimeError("Parquet support needs pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+# -------------------- READING --------------------
+# Yield lists of raw row dicts, `batch_size` at a time. `source` is a binary file object.
+def read_batches(source, fmt, batch_size=DEFAULT_BATCH_SIZE):
+    if fmt == "parquet":
+        pyarrow = _pyarrow()
+        for record_batch in pyarrow.parquet.ParquetFile(source).iter_batches(batch_size=batch_size):
+            yield record_batch.to_pylist()
+        return
+
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError(f"Unknown format '{fmt}'. Use one of: {', '.join(FORMATS)}")
+    text = io.TextIOWrapper(source, encoding="utf-8", newline="")
+    # Detached however reading ends, so the wrapper never closes the caller's file
+    try:
+        if fmt == "csv":
+            rows = csv.DictReader(text)
+        else:
+            rows = (_parse_line(line) for line in text if line.strip())
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        text.detach()
+
+
+# A JSON Lines row, or the ValueError of a line that is not valid JSON (it is
+# counted as an invalid row by validate_row() rather than ending the import)
+def _parse_line(line):
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError as e:
+        return ValueError(f"invalid JSON ({e.msg})")
+
+
+# -------------------- VALIDATION --------------------
+# Turn a raw row into a book dict, or raise ValueError saying what is wrong
+def validate_row(row):
+    if isinstance(row, ValueError):
+        raise row
+    if not isinstance(row, dict):
+        raise ValueError("a row must be an object")
+    title = str(row.get("title") or "").strip()
+    author = str(row.get("author") or "").strip()
+    if not title or not author:
+        raise ValueError("title and author are required")
+    if len(title) > 100 or len(author) > 100:
+        raise ValueError("title and author are limited to 100 characters")
+
+    year = _whole_number(row, "publication_year")
+    if not MIN_YEAR <= year <= datetime.now().year:
+        raise ValueError(f"publication_year {year} outside {MIN_YEAR}-{datetime.now().year}")
+
+    pages = _whole_number(row, "pages")
+    if not MIN_PAGES <= pages <= MAX_PAGES:
+        raise ValueError(f"pages {pages} outside {MIN_PAGES}-{MAX_PAGES}")
+
+    genre = str(row.get("genre") or "").strip()
+    if genre not in GENRES:
+        raise ValueError(f"unknown genre {genre!r}")
+
+    return {
+        "title": title,
+        "author": author,
+        "publication_year": year,
+        "genre": genre,
+        "read_status": to_bool(row.get("read_status", False)),
+        "pages": pages,
+        "date_added": _date_added(row),
+    }
+
+
+# Integer field `name` of a row; 1999 and "1999" but not 1999.7 or "12.9"
+def _whole_number(row, name):
+    value = row.get(name)
+    try:
+        number = float(value.strip()) if isinstance(value, str) else value
+        if isinstance(number, bool) or not float(number).is_integer():
+            raise ValueError
+        return int(number)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"invalid {name} {value!r}")
+
+
+# The date added as the app stores it (DATE_FORMAT), now if the row has none
+def _date_added(row):
+    value = row.get("date_added")
+    if value is None or value == "":
+        return datetime.now().strftime(DATE_FORMAT)
+    if isinstance(value, datetime):  # Parquet timestamp columns
+        return value.strftime(DATE_FORMAT)
+    try:
+        return datetime.strptime(str(value).strip(), DATE_FORMAT).strftime(DATE_FORMAT)
+    except ValueError:
+        raise ValueError(f"invalid date_added {value!r} (expected YYYY-MM-DD HH:MM:SS)")
+
+
+# -------------------- IMPORT --------------------
+# Stream `source` into the repository. Returns a report dict with counts,
+# the first errors (row number and reason) and throughput.
+def import_books(repo, source, fmt, batch_size=DEFAULT_BATCH_SIZE, on_batch=None):
+    start = time.perf_counter()
+    seen = set(exact_keys(repo.all_books()))
+    report = {"rows": 0, "imported": 0, "duplicates": 0, "invalid": 0, "errors": []}
+
+    for rows in read_batches(source, fmt, batch_size):
+        valid = []
+        for row in rows:
+            report["rows"] += 1
+            try:
+                valid.append(validate_row(row))
+            except ValueError as e:
+                report["invalid"] += 1
+                if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                    report["errors"].append(f"row {report['rows']}: {e}")
+        batch = []
+        for book, key in zip(valid, exact_keys(valid)):
+            if key in seen:
+                report["duplicates"] += 1
+                continue
+            seen.add(key)
+            batch.append(book)
+        repo.add_many(batch)
+        report["imported"] += len(batch)
+        if on_batch is not None:
+            on_batch(report)
+
+    report["seconds"] = time.perf_counter() - start
+    report["rows_per_second"] = report["rows"] / report["seconds"] if report["seconds"] else 0
+    return report
+
+
+# -------------------- EXPORT --------------------
+# Write books to the binary file object `target`, `batch_size` rows at a time
+def export_books(books, target, fmt, batch_size=DEFAULT_BATCH_SIZE):
+    start = time.perf_counter()
+    count = 0
+
+    if fmt == "parquet":
+        pyarrow = _pyarrow()
+        writer = None
+        for batch in _chunks(books, batch_size):
+            table = pyarrow.Table.from_pylist([_export_row(book) for book in batch])
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(target, table.schema)
+            writer.write_table(table)
+            count += len(batch)
+        if writer is not None:
+            writer.close()
+    else:
+        if fmt not in ("csv", "jsonl"):
+            raise ValueError(f"Unknown format '{fmt}'. Use one of: {', '.join(FORMATS)}")
+        # Each batch is encoded and written to `target` as bytes: no text
+        # wrapper that could close the caller's file if a write fails
+        text = io.StringIO(newline="")
+        if fmt == "csv":
+            writer = csv.DictWriter(text, fieldnames=BOOK_FIELDS)
+            writer.writeheader()
+            write_rows = writer.writerows
+        else:
+            write_rows = lambda rows: text.write("".join(json.dumps(row) + "\n" for row in rows))  # noqa: E731
+        for batch in _chunks(books, batch_size):
+            write_rows([_export_row(book) for book in batch])
+            target.write(text.getvalue().encode("utf-8"))
+            text.seek(0)
+            text.truncate()
+            count += len(batch)
+
+    seconds = time.perf_counter() - start
+    return {"rows": count, "seconds": seconds, "rows_per_second": count / seconds if seconds else 0}
+
+
+def _export_row(book):
+    row = {field: book.get(field) for field in BOOK_FIELDS}
+    row["read_status"] = to_bool(row["read_status"])
+    if row["date_added"] is None:
+        row["date_added"] = book.get("addad_data")
+    return row
+
+
+def _chunks(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from repository import LibraryRepository
+    from storage import LIBRARY_FILE, get_storage
+
+    parser = argparse.ArgumentParser(description="Bulk import/export for the Personal Library Manager")
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("file")
+    parser.add_argument("--format", choices=FORMATS, help="defaults to the file extension")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--library", default=LIBRARY_FILE)
+    args = parser.parse_args()
+
+    repo = LibraryRepository(get_storage(os.environ.get("LIBRARY_STORAGE", "log"), args.library,
+                                         os.environ.get("LIBRARY_FORMAT", "json")))
+    repo.load()
+    fmt = args.format or detect_format(args.file)
+
+    if args.action == "import":
+        with open(args.file, "rb") as source:
+            result = import_books(
+                repo, source, fmt, args.batch_size,
+                on_batch=lambda r: print(f"  {r['rows']:,} rows read, {r['imported']:,} imported", flush=True),
+            )
+        for error in result["errors"]:
+            print(f"  skipped {error}")
+        print(f"Imported {result['imported']:,} of {result['rows']:,} rows "
+              f"({result['duplicates']:,} duplicates, {result['invalid']:,} invalid) "
+              f"in {result['seconds']:.2f}s - {result['rows_per_second']:,.0f} rows/s")
+    else:
+        with open(args.file, "wb") as target:
+            result = export_books(repo.all_books(), target, fmt, args.batch_size)
+        print(f"Exported {result['rows']:,} books in {result['seconds']:.2f}s - "
+              f"{result['rows_per_second']:,.0f} rows/s")
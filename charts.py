@@ -0,0 +1,107 @@
+# Memoized Plotly figures for the Library Statistics view
+#
+# Each chart is built from a small dict of aggregate inputs. The serialized
+# figure JSON is cached under a hash of those inputs, so a chart is rebuilt
+# only when its own inputs change (toggling a read status rebuilds the pie but
+# not the genre bars). Histograms with many keys are cut down to the top N plus
+# an "Other" bucket to keep the browser payload small.
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+TOP_N = 15
+OTHER_LABEL = "Other"
+
+
+# Keep the `top_n` largest entries of {label: count} and sum the rest into "Other"
+def top_n_with_other(counts, top_n=TOP_N):
+    ranked = sorted(counts.items(), key=lambda x: x[1], reverse=True)
+    result = dict(ranked[:top_n])
+    rest = sum(count for _, count in ranked[top_n:])
+    if rest:
+        result[OTHER_LABEL] = result.get(OTHER_LABEL, 0) + rest
+    return result
+
+
+# Least recently used cache of serialized figures, shared by all sessions
+class FigureCache:
+    def __init__(self, max_entries=64):
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.figures = OrderedDict()  # key -> figure JSON
+        self.hits = 0
+        self.misses = 0
+
+    # Figure JSON for chart `name` built from `inputs` by `build(inputs)`
+    def get(self, name, inputs, build):
+        digest = hashlib.sha1(json.dumps(inputs, default=str).encode()).hexdigest()
+        key = f"{name}:{digest}"
+        with self.lock:
+            if key in self.figures:
+                self.hits += 1
+                self.figures.move_to_end(key)
+                return self.figures[key]
+        # Build outside the lock; two sessions racing just build the same figure twice
+        figure_json = build(inputs).to_json()
+        with self.lock:
+            self.misses += 1
+            self.figures[key] = figure_json
+            while len(self.figures) > self.max_entries:
+                self.figures.popitem(last=False)
+        return figure_json
+
+
+shared_figures = FigureCache()
+
+
+# -------------------- CHART BUILDERS --------------------
+def build_read_status(inputs):
+    fig = go.Figure(data=[go.Pie(
+        labels=["Read", "Not Read"],
+        values=[inputs["read_books"], inputs["total_books"] - inputs["read_books"]],
+        hole=0.3,
+        marker_colors=["#10B981", "#F87171"]
+    )])
+    fig.update_layout(title="Read vs Not Read Books", height=400)
+    return fig
+
+
+def build_counts_bar(inputs):
+    df = pd.DataFrame({inputs["label"]: list(inputs["counts"]), "Count": list(inputs["counts"].values())})
+    fig = px.bar(df, x=inputs["label"], y="Count", color="Count", color_continuous_scale=px.colors.sequential.Blues)
+    fig.update_layout(title=inputs["title"], height=400)
+    return fig
+
+
+def build_decades(inputs):
+    df = pd.DataFrame({"Decade": [f"{dec}s" for dec in inputs["decades"]], "Count": list(inputs["decades"].values())})
+    fig = px.line(df, x="Decade", y="Count", markers=True, line_shape="spline")
+    fig.update_layout(title="Books by Publication Decade", height=400)
+    return fig
+
+
+# -------------------- CHART SPECS --------------------
+# Each returns the cached figure as a plain dict, ready for st.plotly_chart
+def read_status_chart(status, cache=shared_figures):
+    inputs = {"read_books": status["read_books"], "total_books": status["total_books"]}
+    return json.loads(cache.get("read_status", inputs, build_read_status))
+
+
+def genres_chart(status, top_n=TOP_N, cache=shared_figures):
+    inputs = {"label": "Genre", "title": "Books by Genre", "counts": top_n_with_other(status["genres"], top_n)}
+    return json.loads(cache.get("genres", inputs, build_counts_bar))
+
+
+def authors_chart(status, top_n=TOP_N, cache=shared_figures):
+    inputs = {"label": "Author", "title": "Top Authors", "counts": top_n_with_other(status["authors"], top_n)}
+    return json.loads(cache.get("authors", inputs, build_counts_bar))
+
+
+def decades_chart(status, cache=shared_figures):
+    inputs = {"decades": status["decades"]}
+    return json.loads(cache.get("decades", inputs, build_decades))
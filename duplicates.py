@@ -0,0 +1,428 @@
+# Duplicate detection: exact and near-duplicate books
+#
+# Two books are exact duplicates when their normalized title, author and year
+# are equal (normalize() folds case and accents and ignores punctuation), and
+# near duplicates when both their titles and their authors are similar enough:
+# similarity() is the lower of the two Jaccard similarities of the sets of
+# word stems (the first STEM_LENGTH letters, so that "Gatsby" and a mistyped
+# "Gatsbi" still count as one word), and must be at least `threshold`.
+# "The Great Gatsby" by "F. Scott Fitzgerald" (1925) and "Great Gatsby, The"
+# by "F Scott Fitzgerald" (1926) are near duplicates, for example.
+#
+# find_groups() checks a whole library without comparing every pair:
+#   * every title and author is normalized in one pass over all of them, and
+#     their words become ids (pandas.factorize)
+#   * exact duplicates share a group of (title words, author words, year)
+#   * for near duplicates every title and author gets a MinHash signature of
+#     its stems (numpy), cut into BANDS bands; books whose band values are
+#     equal in any band are candidates (locality-sensitive hashing), and only
+#     candidates are compared
+# Similar books are grouped (a group can hold more than two) with the one to
+# keep: the oldest, which gets the read status of the group.
+#
+# similar_books() is the check run when a single book is added; it compares
+# the book with those the search finds by its title and by its author.
+#
+#   python duplicates.py report [--threshold 0.6] [--output report.json]
+#   python duplicates.py merge [--report report.json]
+#
+# A report written with --output can be reviewed (groups that should stay
+# deleted from the file) and then merged as it is.
+import json
+import re
+import time
+import unicodedata
+
+from records import added_epoch
+from storage import ConflictError, to_bool
+
+DEFAULT_THRESHOLD = 0.6
+SIGNATURE_SIZE = 30
+BANDS = 10               # of SIGNATURE_SIZE // BANDS rows each
+MAX_BUCKET = 200         # larger LSH buckets come from very common titles and are skipped
+MAX_INLINE_MATCHES = 5
+STEM_LENGTH = 5
+
+# Combining accents left by NFKD decomposition, and punctuation (anything that
+# is not a letter, digit or space); whitespace is collapsed by str.split()
+ACCENTS = re.compile("[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]")
+PUNCTUATION = re.compile(r"[^\w\s]+|_+")
+ASCII_PUNCTUATION = bytes.maketrans(
+    bytes(c for c in range(128) if not (chr(c).isalnum() or chr(c).isspace())),
+    b" " * sum(1 for c in range(128) if not (chr(c).isalnum() or chr(c).isspace())),
+)
+
+
+# All `texts` casefolded, without accents or punctuation, one per line. They
+# are handled as one string, so a million titles take a few passes over it
+# rather than a million small ones.
+def _normalized_text(texts):
+    texts = list(texts)
+    try:
+        text = "\n".join(texts)
+    except TypeError:
+        text = None
+    if text is None or text.count("\n") != len(texts) - 1:
+        text = "\n".join(str(value).replace("\n", " ") if value is not None else "" for value in texts)
+    text = text.casefold()
+    if text.isascii():
+        return text.encode().translate(ASCII_PUNCTUATION).decode()
+    return PUNCTUATION.sub(" ", ACCENTS.sub("", unicodedata.normalize("NFKD", text)))
+
+
+# Lowercase words of each text without accents or punctuation, space separated
+def normalize_all(texts):
+    texts = list(texts)
+    if not texts:
+        return []
+    return [" ".join(line.split()) for line in _normalized_text(texts).split("\n")]
+
+
+def normalize(text):
+    return normalize_all([text])[0]
+
+
+# Key two books share when they are the same edition
+def exact_key(book):
+    return normalize(book.get("title")), normalize(book.get("author")), book.get("publication_year")
+
+
+# exact_key() of each book, normalizing all titles and all authors at once
+def exact_keys(books):
+    books = list(books)
+    return list(zip(normalize_all(book.get("title") for book in books),
+                    normalize_all(book.get("author") for book in books),
+                    (book.get("publication_year") for book in books)))
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+# How alike two books are, from the word sets of their titles and authors
+def similarity(title_a, author_a, title_b, author_b):
+    return min(jaccard(title_a, title_b), jaccard(author_a, author_b))
+
+
+def stems(text):
+    return {word[:STEM_LENGTH] for word in normalize(text).split()}
+
+
+def _word_sets(book):
+    return stems(book.get("title")), stems(book.get("author"))
+
+
+# -------------------- ONE BOOK --------------------
+# Books of the library that look like the same book as the one described,
+# most similar first: [(book, similarity)]. Similarity 1.0 with the same
+# year is an exact duplicate.
+def similar_books(repo, title, author, publication_year=None, threshold=DEFAULT_THRESHOLD):
+    query = normalize(title)
+    if not query:
+        return []
+    words = (stems(query), stems(author))
+    key = (query, normalize(author), publication_year)
+    # Candidates: books with the longest word of the title (the least common,
+    # usually) and books by the author; one word is also a plain substring,
+    # so this works where the search has no typo tolerance (SQLite)
+    candidates = {book["id"]: book for book in repo.search(title=max(query.split(), key=len), fuzzy=1, limit=50)}
+    author_words = normalize(author).split()
+    if author_words:
+        candidates.update((book["id"], book)
+                          for book in repo.search(author=max(author_words, key=len), fuzzy=1, limit=200))
+    matches = []
+    for book in candidates.values():
+        score = 1.0 if exact_key(book) == key else similarity(*words, *_word_sets(book))
+        if score >= threshold:
+            matches.append((book, score))
+    matches.sort(key=lambda match: match[1], reverse=True)
+    return matches[:MAX_INLINE_MATCHES]
+
+
+# -------------------- WHOLE LIBRARY --------------------
+# Groups of duplicate books, largest first. Each group is a dict:
+#   kind        "exact" if all its books share the normalized key, else "near"
+#   similarity  lowest similarity of the pairs that joined the group
+#   keep        id of the book to keep (the oldest)
+#   remove      ids of the others
+#   books       id, version, title, author, publication_year and read_status of each
+# Apart from reading the fields, the work is done on numpy arrays.
+def find_groups(books, threshold=DEFAULT_THRESHOLD):
+    import numpy as np
+    import pandas as pd  # only the batch job needs them
+
+    books = list(books)
+    if len(books) < 2:
+        return []
+    title_ids, title_stems, title_counts = _words(np, pd, [book.get("title") for book in books])
+    author_codes, authors = pd.factorize(pd.Series([book.get("author") for book in books], dtype=object),
+                                         use_na_sentinel=False)
+    author_ids, author_stems, author_counts = _words(np, pd, authors)
+
+    # Exact duplicates: same title words, author words and year
+    exact = pd.DataFrame({
+        "title": _sequence_hashes(np, title_ids, title_counts),
+        "author": _sequence_hashes(np, author_ids, author_counts)[author_codes],
+        "year": pd.Series([book.get("publication_year") for book in books], dtype=object),
+    }).groupby(["title", "author", "year"], sort=False, dropna=False).ngroup().to_numpy()
+
+    # Near duplicates: candidates by the title stems, checked on both fields
+    title_sets = _sets(np, title_stems, title_counts)
+    author_sets = _sets(np, author_stems, author_counts)
+    first, second = _candidate_pairs(np, _signatures(np, title_sets, author_sets, author_codes),
+                                     np.flatnonzero(title_sets[1]))
+    scores = _pair_jaccard(np, *title_sets, first, second)
+    kept = (scores >= threshold) & (exact[first] != exact[second])
+    first, second, scores = first[kept], second[kept], scores[kept]
+    other_author = author_codes[first] != author_codes[second]
+    scores[other_author] = np.minimum(scores[other_author], _pair_jaccard(
+        np, *author_sets, author_codes[first[other_author]], author_codes[second[other_author]]))
+    similar = scores >= threshold
+
+    # Union-find over the books that have a duplicate
+    parent = {}
+    lowest = {}
+
+    def find(i):
+        parent.setdefault(i, i)
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def join(i, j, score):
+        i, j = find(i), find(j)
+        root, other = min(i, j), max(i, j)
+        lowest[root] = min(score, lowest.get(i, 1.0), lowest.get(j, 1.0))
+        parent[other] = root
+
+    _, first_of_key = np.unique(exact, return_index=True)
+    for i in np.flatnonzero(np.bincount(exact)[exact] > 1).tolist():
+        if first_of_key[exact[i]] != i:
+            join(int(first_of_key[exact[i]]), i, 1.0)
+    for i, j, score in zip(first[similar].tolist(), second[similar].tolist(), scores[similar].tolist()):
+        join(i, j, score)
+
+    members = {}
+    for i in parent:
+        members.setdefault(find(i), []).append(i)
+    groups = [_group(books, sorted(indexes), exact, lowest.get(root, 1.0))
+              for root, indexes in members.items() if len(indexes) > 1]
+    groups.sort(key=lambda group: (-len(group["books"]), -group["similarity"]))
+    return groups
+
+
+# Word ids and word stem ids of all `texts` (as normalize() splits them) one
+# text after the other, and the number of words of each text
+def _words(np, pd, texts):
+    # A NUL (removed from the texts as punctuation) stands for each line break
+    words = _normalized_text(texts).replace("\n", " \0 ").split()
+    ids, vocabulary = pd.factorize(pd.Series(words, dtype=object))
+    breaks = ids == vocabulary.get_loc("\0") if "\0" in vocabulary else np.zeros(len(ids), dtype=bool)
+    ids = ids[~breaks]
+    stem_of_word, _ = pd.factorize(pd.Series([word[:STEM_LENGTH] for word in vocabulary], dtype=object))
+    counts = np.bincount(np.cumsum(breaks)[~breaks], minlength=len(texts)).astype(np.int64)
+    return ids, stem_of_word[ids], counts
+
+
+# A 64-bit hash of each run of word ids (word order counts); texts with the
+# same words in the same order get the same hash
+def _sequence_hashes(np, ids, counts):
+    starts = np.cumsum(counts) - counts
+    positions = np.arange(len(ids), dtype=np.uint64) - np.repeat(starts, counts).astype(np.uint64)
+    with np.errstate(over="ignore"):
+        mixed = (ids.astype(np.uint64) + np.uint64(1)) * np.uint64(0x9E3779B97F4A7C15)
+        mixed ^= (positions + np.uint64(1)) * np.uint64(0xC2B2AE3D27D4EB4F)
+        mixed *= np.uint64(0x165667B19E3779F9)
+        hashes = np.zeros(len(counts), dtype=np.uint64)
+        present = counts > 0
+        if present.any():
+            hashes[present] = np.add.reduceat(mixed, starts[present])
+    return hashes
+
+
+# The distinct ids of each run (sorted), and how many there are in each
+def _sets(np, ids, counts):
+    size = int(ids.max()) + 1 if len(ids) else 1
+    keys = np.unique(np.repeat(np.arange(len(counts)), counts) * size + ids)
+    return keys % size, np.bincount(keys // size, minlength=len(counts))
+
+
+# Jaccard similarity of the sets `left` and `right` (positions in `counts`)
+# pair by pair. Both sets of every pair are sorted together: an id that
+# appears twice is in both.
+def _pair_jaccard(np, ids, counts, left, right, chunk=500_000):
+    size = int(ids.max()) + 1 if len(ids) else 1
+    starts = np.cumsum(counts) - counts
+    result = np.ones(len(left))
+    for offset in range(0, len(left), chunk):
+        pairs = (left[offset:offset + chunk], right[offset:offset + chunk])
+        numbers = np.arange(len(pairs[0]))
+        keys = []
+        for sets in pairs:
+            lengths = counts[sets]
+            positions = np.repeat(starts[sets] - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+            keys.append(np.repeat(numbers, lengths) * size + ids[positions])
+        keys = np.sort(np.concatenate(keys))
+        shared = np.bincount(keys[1:][keys[1:] == keys[:-1]] // size, minlength=len(numbers))
+        union = counts[pairs[0]] + counts[pairs[1]] - shared
+        result[offset:offset + chunk] = np.where(union > 0, shared / np.maximum(union, 1), 1.0)
+    return result
+
+
+# 32-bit MinHash signatures (SIGNATURE_SIZE x len(counts)) of consecutive runs of
+# word ids, `counts` long each; empty runs get the largest value
+def _minhashes(np, ids, counts):
+    # Multiply-shift hashing, one odd multiplier per row of the signature
+    rng = np.random.default_rng(20240613)
+    multipliers = rng.integers(1, 1 << 63, SIGNATURE_SIZE, dtype=np.uint64) | np.uint64(1)
+    increments = rng.integers(0, 1 << 63, SIGNATURE_SIZE, dtype=np.uint64)
+    signatures = np.full((SIGNATURE_SIZE, len(counts)), np.iinfo(np.uint32).max, dtype=np.uint32)
+    present = counts > 0
+    if not present.any():
+        return signatures
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[present]
+    ids = ids.astype(np.uint64)
+    with np.errstate(over="ignore"):
+        for row in range(SIGNATURE_SIZE):
+            hashes = ((ids * multipliers[row] + increments[row]) >> np.uint64(32)).astype(np.uint32)
+            signatures[row, present] = np.minimum.reduceat(hashes, starts)
+    return signatures
+
+
+# Signatures for the LSH bands: SIGNATURE_SIZE // BANDS rows of the title
+# MinHash plus one of the author MinHash per band. Books by the same author
+# share the author row, so the author only keeps books by other authors apart.
+def _signatures(np, title_sets, author_sets, author_codes):
+    titles = _minhashes(np, *title_sets).reshape(BANDS, SIGNATURE_SIZE // BANDS, -1)
+    authors = _minhashes(np, *author_sets)[:BANDS, author_codes]
+    return np.concatenate((titles, authors[:, None, :]), axis=1).reshape(-1, len(author_codes))
+
+
+# Pairs (two arrays of positions) of the `eligible` books whose signatures
+# share all rows of at least one of the BANDS bands; books whose words are at
+# least as similar as the threshold almost always are
+def _candidate_pairs(np, signatures, eligible):
+    nothing = np.zeros(0, dtype=np.int64)
+    if len(eligible) < 2:
+        return nothing, nothing
+    signatures = signatures[:, eligible]
+    rows = len(signatures) // BANDS
+    found = []
+    with np.errstate(over="ignore"):
+        for band in range(BANDS):
+            band_keys = signatures[band * rows].astype(np.uint64)
+            for row in range(band * rows + 1, (band + 1) * rows):
+                band_keys = band_keys * np.uint64(0x9E3779B97F4A7C15) ^ signatures[row]
+            order = np.argsort(band_keys)
+            sorted_keys = band_keys[order]
+            # Every pair of the buckets of 2..MAX_BUCKET books: each position
+            # with each later position of its bucket
+            bounds = np.concatenate(([0], np.flatnonzero(np.diff(sorted_keys)) + 1, [len(sorted_keys)]))
+            sizes = np.diff(bounds)
+            usable = np.repeat((sizes > 1) & (sizes <= MAX_BUCKET), sizes)
+            later = (np.repeat(bounds[1:], sizes) - np.arange(len(sorted_keys)) - 1) * usable
+            first = np.repeat(np.arange(len(sorted_keys)), later)
+            second = first + np.arange(len(first)) - np.repeat(np.cumsum(later) - later, later) + 1
+            found.append(np.stack((order[first], order[second])))
+
+    if not found:
+        return nothing, nothing
+    pairs = np.sort(np.concatenate(found, axis=1), axis=0)
+    pairs = np.unique(pairs[0] * len(eligible) + pairs[1])  # the same pair may come from several bands
+    return eligible[pairs // len(eligible)], eligible[pairs % len(eligible)]
+
+
+def _group(books, indexes, exact, similarity):
+    # Keep the oldest book (the first one in the library if the dates tie)
+    keep = min(indexes, key=lambda i: (added_epoch(books[i]) is None, added_epoch(books[i]) or 0, i))
+    same_key = all(exact[i] == exact[keep] for i in indexes)
+    return {
+        "kind": "exact" if same_key else "near",
+        "similarity": 1.0 if same_key else round(similarity, 3),
+        "keep": books[keep]["id"],
+        "remove": [books[i]["id"] for i in indexes if i != keep],
+        "books": [
+            {field: books[i].get(field) for field in
+             ("id", "version", "title", "author", "publication_year", "read_status")}
+            for i in [keep] + [i for i in indexes if i != keep]
+        ],
+    }
+
+
+# Report on the whole library: the groups plus how many books would go
+def report(repo, threshold=DEFAULT_THRESHOLD):
+    start = time.perf_counter()
+    groups = find_groups(repo.all_books(), threshold)
+    return {
+        "books": repo.count(),
+        "groups": groups,
+        "exact_groups": sum(1 for group in groups if group["kind"] == "exact"),
+        "near_groups": sum(1 for group in groups if group["kind"] == "near"),
+        "removable": sum(len(group["remove"]) for group in groups),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+# Merge each group into its kept book: it becomes read if any book of the
+# group was read, and the others are removed. Books changed since the report
+# was made are left alone. Returns {"merged", "removed", "conflicts"}.
+def merge(repo, groups):
+    result = {"merged": 0, "removed": 0, "conflicts": 0}
+    for group in groups:
+        versions = {book["id"]: book["version"] for book in group["books"]}
+        try:
+            if any(to_bool(book["read_status"]) for book in group["books"]):
+                keeper = next(book for book in group["books"] if book["id"] == group["keep"])
+                if not to_bool(keeper["read_status"]):
+                    repo.update(group["keep"], {"read_status": True}, expected_version=versions[group["keep"]])
+            for book_id in group["remove"]:
+                if repo.remove(book_id, expected_version=versions[book_id]):
+                    result["removed"] += 1
+        except ConflictError:
+            result["conflicts"] += 1
+            continue
+        result["merged"] += 1
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    from repository import LibraryRepository
+    from storage import LIBRARY_FILE, get_storage
+
+    parser = argparse.ArgumentParser(description="Find and merge duplicate books")
+    parser.add_argument("action", choices=["report", "merge"])
+    parser.add_argument("--library", default=LIBRARY_FILE)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--output", help="write the report (groups to review) to this JSON file")
+    parser.add_argument("--report", help="merge the groups of this (reviewed) report instead of a new one")
+    args = parser.parse_args()
+
+    repo = LibraryRepository(get_storage(os.environ.get("LIBRARY_STORAGE", "log"), args.library,
+                                         os.environ.get("LIBRARY_FORMAT", "json")))
+    repo.load()
+    if args.action == "merge" and args.report:
+        with open(args.report) as file:
+            groups = json.load(file)["groups"]
+    else:
+        found = report(repo, args.threshold)
+        groups = found["groups"]
+        print(f"{found['books']:,} books: {found['exact_groups']:,} exact and {found['near_groups']:,} near "
+              f"duplicate groups, {found['removable']:,} books to remove ({found['seconds']:.2f}s)")
+        for group in groups[:20]:
+            print(f"  [{group['kind']} {group['similarity']:.2f}] "
+                  + " | ".join(f"{book['title']} - {book['author']} ({book['publication_year']})"
+                               for book in group["books"]))
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump(found, file, indent=2, default=str)
+            print(f"Report written to {args.output}")
+    if args.action == "merge":
+        merged = merge(repo, groups)
+        print(f"Merged {merged['merged']:,} groups, removed {merged['removed']:,} books "
+              f"({merged['conflicts']:,} groups changed since the report and were skipped)")
@@ -0,0 +1,99 @@
+# Typo-tolerant word lookup: a SymSpell-style deletion dictionary
+#
+# Every word is stored under each string obtained by deleting up to
+# MAX_DISTANCE characters from its first PREFIX_LENGTH characters. A word
+# within edit distance k of the query shares one of those strings with the
+# query's own deletions, so a lookup generates the (few) deletions of the
+# query word, collects the words stored under them and verifies each with a
+# bounded edit distance. No other word of the dictionary is ever looked at,
+# which keeps lookups fast however many words there are.
+#
+# Words are added and removed one at a time (search_index.FieldIndex does it
+# as distinct words come and go). Numbers and words of one or two letters
+# are not stored: a typo in them is not worth matching (see allowed_distance()).
+MAX_DISTANCE = 2
+PREFIX_LENGTH = 7
+
+
+# Edit distance a query word of this length may have: short words must
+# match exactly, medium ones may have one typo
+def allowed_distance(word, max_distance):
+    if len(word) <= 3 or word.isdigit():
+        return 0
+    if len(word) <= 5:
+        return min(1, max_distance)
+    return max_distance
+
+
+def stored(word):
+    return len(word) >= 3 and not word.isdigit()
+
+
+# `word` and every string made by deleting up to `depth` of its characters
+def deletions(word, depth):
+    result = {word}
+    frontier = {word}
+    for _ in range(depth):
+        frontier = {item[:i] + item[i + 1:] for item in frontier for i in range(len(item))}
+        result |= frontier
+    return result
+
+
+# Optimal string alignment distance (an adjacent transposition counts as one
+# edit) between `a` and `b`, or limit + 1 if it is larger than `limit`
+def edit_distance(a, b, limit):
+    if a == b:
+        return 0
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        char = a[i - 1]
+        for j in range(1, len(b) + 1):
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != b[j - 1]))
+            if i > 1 and j > 1 and char == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, before[j - 2] + 1)
+            current[j] = value
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+class DeletionIndex:
+    def __init__(self, words=()):
+        self.deletes = {}  # deletion -> set of words
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        if not stored(word):
+            return
+        for key in deletions(word[:PREFIX_LENGTH], MAX_DISTANCE):
+            words = self.deletes.get(key)
+            if words is None:
+                words = self.deletes[key] = set()
+            words.add(word)
+
+    def remove(self, word):
+        if not stored(word):
+            return
+        for key in deletions(word[:PREFIX_LENGTH], MAX_DISTANCE):
+            words = self.deletes.get(key)
+            if words is not None:
+                words.discard(word)
+                if not words:
+                    del self.deletes[key]
+
+    # Stored words within `max_distance` edits of `term`: {word: distance}
+    def lookup(self, term, max_distance):
+        if max_distance > MAX_DISTANCE:
+            raise ValueError(f"The dictionary only supports edit distances up to {MAX_DISTANCE}")
+        checked = {}
+        for key in deletions(term[:PREFIX_LENGTH], max_distance):
+            for word in self.deletes.get(key, ()):
+                if word not in checked:
+                    checked[word] = edit_distance(term, word, max_distance)
+        return {word: distance for word, distance in checked.items() if distance <= max_distance}
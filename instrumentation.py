@@ -0,0 +1,171 @@
+# Timing instrumentation for the app's hot paths
+#
+# Wrap an operation with `with timed("search_books"):` or decorate it with
+# @instrumented("search_books"). Every call is recorded twice: in the
+# process-wide `global_metrics` and in the metrics of the current session
+# (whatever `session_metrics()` returns; the app points it at st.session_state).
+#
+# Each operation keeps a rolling window of its last `window` durations for the
+# p50/p95/p99 figures plus an all-time count and total, which is exactly what a
+# Prometheus summary reports. to_prometheus() and to_json() render a snapshot;
+# export() writes one to LIBRARY_METRICS_FILE (Prometheus text, or JSON for a
+# .json file) for a scraper such as node_exporter's textfile collector.
+#
+# profile_run()/profile_report() capture one script run with cProfile.
+import cProfile
+import functools
+import io
+import json
+import marshal
+import os
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from storage import atomic_write
+
+DEFAULT_WINDOW = 1000
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+# Value below which `fraction` of the sorted `values` lie (nearest rank)
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+# Rolling timing histograms, one per operation name
+class Metrics:
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.samples = {}  # name -> deque of the last `window` durations
+        self.counts = {}   # name -> number of calls ever
+        self.totals = {}   # name -> seconds spent ever
+
+    def observe(self, name, seconds):
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+                self.counts[name] = 0
+                self.totals[name] = 0.0
+            self.samples[name].append(seconds)
+            self.counts[name] += 1
+            self.totals[name] += seconds
+
+    # {name: {"count", "total", "mean", "max", "p50", "p95", "p99"}} in seconds;
+    # mean, max and the quantiles cover the rolling window
+    def snapshot(self):
+        with self.lock:
+            samples = {name: sorted(values) for name, values in self.samples.items()}
+            counts, totals = dict(self.counts), dict(self.totals)
+        result = {}
+        for name, values in sorted(samples.items()):
+            result[name] = {
+                "count": counts[name],
+                "total": totals[name],
+                "mean": sum(values) / len(values) if values else 0.0,
+                "max": values[-1] if values else 0.0,
+            }
+            for fraction in QUANTILES:
+                result[name][f"p{round(fraction * 100)}"] = percentile(values, fraction)
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+            self.counts.clear()
+            self.totals.clear()
+
+
+global_metrics = Metrics()
+
+# Returns the Metrics of the session running in this thread (or None). The app
+# sets it; without it only the global metrics are kept.
+session_metrics = None
+
+
+def record(name, seconds):
+    global_metrics.observe(name, seconds)
+    metrics = session_metrics() if session_metrics is not None else None
+    if metrics is not None:
+        metrics.observe(name, seconds)
+
+
+@contextmanager
+def timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def instrumented(name):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# -------------------- EXPORT --------------------
+def to_prometheus(metrics=global_metrics, prefix="library_operation_seconds"):
+    lines = [
+        f"# HELP {prefix} Time spent in app operations (quantiles over the last {metrics.window} calls)",
+        f"# TYPE {prefix} summary",
+    ]
+    for name, values in metrics.snapshot().items():
+        label = name.replace("\\", "\\\\").replace('"', '\\"')
+        for fraction in QUANTILES:
+            lines.append(f'{prefix}{{operation="{label}",quantile="{fraction}"}} '
+                         f'{values[f"p{round(fraction * 100)}"]:.9g}')
+        lines.append(f'{prefix}_sum{{operation="{label}"}} {values["total"]:.9g}')
+        lines.append(f'{prefix}_count{{operation="{label}"}} {values["count"]}')
+    return "\n".join(lines) + "\n"
+
+
+def to_json(metrics=global_metrics):
+    return json.dumps({"generated": time.time(), "window": metrics.window, "operations": metrics.snapshot()},
+                      indent=2)
+
+
+_last_export = 0.0
+_export_lock = threading.Lock()
+
+
+# Write the global metrics to `path` (JSON if it ends in .json, else Prometheus
+# text), at most once every `interval` seconds. Returns True if it wrote.
+def export(path, interval=15.0):
+    global _last_export
+    with _export_lock:
+        now = time.monotonic()
+        if now - _last_export < interval:
+            return False
+        _last_export = now
+    text = to_json() if path.endswith(".json") else to_prometheus()
+    atomic_write(path, lambda file: file.write(text), suffix=os.path.splitext(path)[1])
+    return True
+
+
+# -------------------- PROFILING --------------------
+# Start profiling the current script run
+def profile_run():
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+# Stop `profiler`; returns the top `limit` functions by cumulative time as
+# text and the raw stats in the .prof format (pstats/snakeviz can open it)
+def profile_report(profiler, limit=40):
+    profiler.disable()
+    text = io.StringIO()
+    stats = pstats.Stats(profiler, stream=text)
+    stats.sort_stats("cumulative").print_stats(limit)
+    return text.getvalue(), marshal.dumps(stats.stats)
@@ -0,0 +1,101 @@
+# Process-wide cache of the parsed library
+#
+# Streamlit re-runs the whole script on every widget interaction, and every
+# run used to re-open and re-parse library.json. This cache keeps one parsed
+# list per data file, shared by all sessions in the process, and only reloads
+# when the file's (mtime, size) fingerprint changes, e.g. because another
+# process wrote it. Writes made through this process refresh the fingerprint
+# right away so they do not count as a change.
+#
+# Structures derived from the books (e.g. the search index) are attached to
+# the same entry with extra() and are dropped whenever the books are reloaded.
+import threading
+
+
+class LibraryCache:
+    def __init__(self):
+        # Re-entrant: builders passed to extra() may ask for the fingerprint
+        self.lock = threading.RLock()
+        self.entries = {}  # path -> (fingerprint, books, extras)
+        self.writes = {}   # path -> writes recorded with refresh()
+        self.hits = 0
+        self.misses = 0
+
+    # Return the parsed library for `storage`, loading it only if it changed.
+    # `convert(books)` turns freshly loaded books into the in-memory form.
+    def load(self, storage, convert=None):
+        with self.lock:
+            fingerprint = storage.fingerprint()
+            entry = self.entries.get(storage.path)
+            if entry is not None and entry[0] == fingerprint:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            books = storage.load()
+            if convert is not None:
+                books = convert(books)
+            self.entries[storage.path] = (fingerprint, books, {})
+            return books
+
+    # Record that `books` (already written by this process) is the current data.
+    # Derived structures survive if they belong to the same list, because the
+    # repository keeps them up to date on every write.
+    def refresh(self, storage, books):
+        with self.lock:
+            entry = self.entries.get(storage.path)
+            extras = entry[2] if entry is not None and entry[1] is books else {}
+            self.entries[storage.path] = (storage.fingerprint(), books, extras)
+            self.writes[storage.path] = self.writes.get(storage.path, 0) + 1
+
+    # How many writes this process made to `storage`'s books, including those
+    # still queued for the files (which do not change the fingerprint yet)
+    def written(self, storage):
+        with self.lock:
+            return self.writes.get(storage.path, 0)
+
+    # Get the structure `name` derived from `books`, building it on first use
+    def extra(self, storage, books, name, build):
+        with self.lock:
+            entry = self.entries.get(storage.path)
+            if entry is None or entry[1] is not books:
+                return build(books)
+            if name not in entry[2]:
+                entry[2][name] = build(books)
+            return entry[2][name]
+
+    # Get the structure `name` only if it has already been built
+    def built_extra(self, storage, books, name):
+        with self.lock:
+            entry = self.entries.get(storage.path)
+            if entry is None or entry[1] is not books:
+                return None
+            return entry[2].get(name)
+
+    # Fingerprint of the files `books` was loaded from (None if not cached)
+    def fingerprint(self, storage, books):
+        with self.lock:
+            entry = self.entries.get(storage.path)
+            if entry is None or entry[1] is not books:
+                return None
+            return entry[0]
+
+    # Drop the books and derived structures of `storage` (its library was closed)
+    def forget(self, storage):
+        with self.lock:
+            self.entries.pop(storage.path, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) * 100 if total else 0,
+        }
+
+
+# Shared by every session of the Streamlit app
+shared_cache = LibraryCache()
@@ -0,0 +1,205 @@
+# Headless core of the Personal Library Manager
+#
+# Everything the app does with books, without Streamlit: library_manager.py
+# keeps one LibraryRepository per session and calls these functions for its
+# views, and scripts, benchmarks (benchmarks/bench_core.py) and other front
+# ends can use them the same way.
+#
+#   from library_core import open_library, add_book, search_books
+#   repo = open_library()
+#   add_book(repo, "Dune", "Frank Herbert", 1965, "Science Fiction", False, 412)
+#   search_books(repo, "dune", "Title")
+#
+# The backend is configured like the app, from the LIBRARY_STORAGE,
+# LIBRARY_FORMAT, LIBRARY_WRITE_DELAY and LIBRARY_WRITE_BATCH variables.
+# With several libraries (tenants.py), open_libraries() gives the pool and
+# open_library(name=...) one of them:
+#
+#   pool = open_libraries()
+#   repo = open_library(pool=pool, name="alice")
+#   get_all_libraries_status(pool)
+import os
+from datetime import datetime
+
+import duplicates
+import reading_log
+import tenants
+from library_stats import LibraryStats
+from records import DATE_FORMAT
+from repository import ConflictError, LibraryRepository
+from storage import LIBRARY_FILE, get_storage
+from write_behind import get_write_behind
+
+SEARCH_FIELDS = {"Title": "title", "Author": "author", "Genre": "genre"}
+
+
+# -------------------- OPENING --------------------
+# A new repository on this process's shared backend and write-behind queue
+# for `path` (one per session in the app), or on library `name` of `pool`
+def open_library(path=LIBRARY_FILE, environ=os.environ, pool=None, name=None):
+    if pool is not None:
+        return pool.repository(name)
+    storage = get_storage(environ.get("LIBRARY_STORAGE", "log"), path, environ.get("LIBRARY_FORMAT", "json"))
+    writer = get_write_behind(storage, max_delay=float(environ.get("LIBRARY_WRITE_DELAY", 1.0)),
+                              max_batch=int(environ.get("LIBRARY_WRITE_BATCH", 500)))
+    return LibraryRepository(storage, writer=writer)
+
+
+# The process's shared pool of the libraries in LIBRARY_TENANTS_DIR (see
+# tenants.py), with LIBRARY_MAX_OPEN shards open at most and aggregates fanned
+# out over LIBRARY_FANOUT_THREADS threads
+def open_libraries(environ=os.environ):
+    return tenants.get_pool(environ.get("LIBRARY_TENANTS_DIR", tenants.TENANTS_DIR),
+                            environ.get("LIBRARY_STORAGE", "log"), environ.get("LIBRARY_FORMAT", "json"),
+                            max_open=int(environ.get("LIBRARY_MAX_OPEN", tenants.DEFAULT_MAX_OPEN)),
+                            write_delay=float(environ.get("LIBRARY_WRITE_DELAY", 1.0)),
+                            write_batch=int(environ.get("LIBRARY_WRITE_BATCH", 500)),
+                            threads=int(environ.get("LIBRARY_FANOUT_THREADS", tenants.DEFAULT_THREADS)))
+
+
+# Load the books (only re-read when the data files changed). Returns False if
+# there is no library yet.
+def load_library(repo):
+    return repo.load()
+
+
+# Save the whole library (full snapshot, also compacts the operation log)
+def save_library(repo):
+    repo.save()
+
+
+# -------------------- BOOKS --------------------
+# Add a book; returns it with its new id and version
+def add_book(repo, title, author, publication_year, genre, read_status, pages, date_added=None):
+    book = {
+        "title": title,
+        "author": author,
+        "publication_year": publication_year,
+        "genre": genre,
+        "read_status": read_status,
+        "pages": pages,
+        "date_added": date_added or datetime.now().strftime(DATE_FORMAT),
+    }
+    repo.add(book)
+    return book
+
+
+# Add several books (dicts of the fields add_book() takes) with one write;
+# returns them with their ids and versions
+def add_books(repo, books):
+    now = datetime.now().strftime(DATE_FORMAT)
+    books = [dict(book, date_added=book.get("date_added") or now) for book in books]
+    repo.add_many(books)
+    return books
+
+
+# The book with `book_id`, or None
+def get_book(repo, book_id):
+    return repo.get(book_id)
+
+
+# One page of books in id order, from the one after id `after` (None: the
+# first page), optionally filtered (see repository.py). Returns the books and
+# the id to pass as `after` for the next page, None after the last one. Pages
+# stay consistent while books are added and removed in between.
+def get_books_page(repo, limit, after=None, filters=None):
+    books = repo.query(dict(filters or {}, id_after=after), order_by="id", limit=limit + 1)
+    if len(books) > limit:
+        return books[:limit], books[limit - 1]["id"]
+    return books, None
+
+
+# Remove a book, unless it changed since `version` was shown. Returns False if
+# it changed or is already gone.
+def remove_book(repo, book_id, version):
+    try:
+        return repo.remove(book_id, expected_version=version)
+    except ConflictError:
+        return False
+
+
+# Set the read status of a book (same return values as remove_book())
+def set_read_status(repo, book_id, read_status, version):
+    try:
+        return repo.update(book_id, {"read_status": read_status}, expected_version=version)
+    except ConflictError:
+        return False
+
+
+# Books matching `search_term` in the "Title", "Author" or "Genre" field, best
+# matches first. With `max_distance` (1 or 2), words may have up to that many
+# typos ("Fitzgerlad" finds Fitzgerald); exact matches still rank first.
+# `limit` keeps only that many of the best matches.
+def search_books(repo, search_term, search_by, max_distance=0, limit=None):
+    return repo.search(limit=limit, **{SEARCH_FIELDS[search_by]: search_term}, fuzzy=max_distance or None)
+
+
+# -------------------- DUPLICATES --------------------
+# Books that look like the one about to be added, most similar first:
+# [(book, similarity)] (see duplicates.py)
+def find_similar_books(repo, title, author, publication_year=None, threshold=duplicates.DEFAULT_THRESHOLD):
+    return duplicates.similar_books(repo, title, author, publication_year, threshold)
+
+
+# Exact and near-duplicate groups of the whole library, to review and merge
+def duplicate_report(repo, threshold=duplicates.DEFAULT_THRESHOLD):
+    return duplicates.report(repo, threshold)
+
+
+# Merge the (reviewed) groups of a report into their kept books
+def merge_duplicates(repo, groups):
+    return duplicates.merge(repo, groups)
+
+
+# -------------------- STATISTICS --------------------
+# Counts, read percentage, pages and the genre/author/decade histograms. They
+# are kept up to date on every change, so this only sorts the distinct keys.
+def get_library_status(repo):
+    return repo.stats().summary()
+
+
+# Books added, books finished and pages read per "month" or "day", from the
+# rollups of the event log (reading_log.py); `last` keeps that many periods
+def get_reading_trends(repo, period="month", last=None):
+    return repo.events.current().series(period, last)
+
+
+# Reading pace over the last `days` days, and this year's total and the time
+# to read the unread books at that pace
+def get_reading_pace(repo, days=reading_log.PACE_DAYS):
+    stats = repo.stats()
+    return repo.events.current().pace(stats.total_books - stats.read_books, days)
+
+
+# Richer statistics computed on the typed pandas frame (top authors, pages per
+# genre, books added per month). The frame is rebuilt only when the data changes.
+def get_library_analytics(repo, top_n=10):
+    from analytics import shared_frames  # pandas is only loaded for this
+
+    return shared_frames.stats(repo.storage.path, repo.version(), repo.all_books, top_n)
+
+
+# -------------------- ALL LIBRARIES --------------------
+# Statistics of every library of `pool` (or of `names`), gathered in parallel:
+# {"libraries": {name: summary}, "total": summary of them all, "errors":
+# {name: message}}, summaries shaped like get_library_status()
+def get_all_libraries_status(pool, names=None):
+    results, errors = pool.aggregate(pool.stats, names)
+    total = LibraryStats()
+    for stats in results.values():
+        total.merge(stats)
+    return {
+        "libraries": {name: results[name].summary() for name in sorted(results)},
+        "total": total.summary(),
+        "errors": {name: str(error) for name, error in errors.items()},
+    }
+
+
+# Search every library of `pool` (or of `names`) in parallel, at most `limit`
+# results from each. Returns ([(library name, book)], {name: error message}):
+# the best match of each library first, then the second best of each, and so on.
+def search_all_libraries(pool, search_term, search_by, max_distance=0, names=None, limit=50):
+    criteria = {SEARCH_FIELDS[search_by]: search_term, "fuzzy": max_distance or None}
+    results, errors = pool.aggregate(lambda name: pool.search(name, limit, **criteria), names)
+    ranked = sorted((rank, name, book) for name, books in results.items() for rank, book in enumerate(books))
+    return [(name, book) for _, name, book in ranked], {name: str(error) for name, error in errors.items()}
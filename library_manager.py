@@ -1,15 +1,25 @@
-# Import necessary libraries
+# Import necessary libraries. pandas and Plotly (charts.py) are only imported
+# by the Library Statistics view, the first time it is opened.
+import time             # Run timing
+import startup_timing   # Import/first-render report (LIBRARY_STARTUP_TIMING=1)
+startup_timing.install()
+RUN_START = time.perf_counter()
+
 import streamlit as st  # Web app framework
-import pandas as pd     # Data manipulation
-import json             # For saving/loading data
 import os               # File path handling
+import html             # Escaping book fields inside card HTML
+import json             # Duplicate report download
 from datetime import datetime  # For timestamps
-import time             # To delay actions if needed
-import random           # (Unused but imported)
-import plotly.express as px     # For visualizations
-import plotly.graph_objects as go
-from streamlit_lottie import st_lottie  # To load Lottie animations
-import requests         # For making HTTP requests
+from assets import shared_assets  # Cached remote images/animations with bundled fallbacks
+from storage import to_bool, GENRES, MIN_YEAR, MIN_PAGES, MAX_PAGES  # Book fields and form limits
+import library_core as core                      # Book operations, no Streamlit inside
+from library_cache import shared_cache           # Parsed library shared across reruns/sessions
+from query_cache import shared_queries           # Search results shared across sessions
+from bulk_io import import_books, detect_format  # Streaming bulk import
+from duplicates import DEFAULT_THRESHOLD         # Duplicate detection (inline on add, admin report)
+from tenants import NAME_PATTERN                 # Library names when serving several libraries
+import instrumentation                           # Hot path timings (admin view)
+from instrumentation import instrumented
 
 
 
@@ -120,9 +130,47 @@ st.markdown("""
 
     }
 
+    .book-card {
+        background: linear-gradient(to right, #f9fafb, #f3f4f6);
+        border-radius: 1rem;
+        padding: 1.5rem;
+        margin-bottom: 1rem;
+        box-shadow: 0 4px 12px rgba(0, 0, 0, 0.05);
+        border-left: 5px solid #ef4444;
+    }
+
+    .book-card.read {
+        border-left-color: #10b981;
+    }
+
     .book-card h3 {
+        margin: 0;
+        font-size: 1.4rem;
         color: #1f2937;
+        font-weight: 700;
+    }
+
+    .book-card p {
+        margin: 0.5rem 0;
+    }
+
+    .book-card .added-on {
+        font-size: 0.85rem;
+        color: #6b7280;
+    }
+
+    .status-badge {
+        padding: 0.2rem 0.6rem;
+        border-radius: 9999px;
+        background-color: #fee2e2;
+        color: #b91c1c;
         font-weight: 600;
+        font-size: 0.875rem;
+    }
+
+    .status-badge.read {
+        background-color: #dcfce7;
+        color: #15803d;
     }
 
     .read-badge {
@@ -142,20 +190,44 @@ st.markdown("""
 
 
 # -------------------- LOAD LOTTIE FUNCTION --------------------
-# Function to fetch Lottie animation from a URL
-def load_lottie_url(url):
-    try:
-        r = requests.get(url)
-        if r.status_code != 200:
-            return None
-        return r.json()
-    except:
-        return None
+# Fetch a Lottie animation without blocking: returns the cached (or bundled)
+# copy, or None while it is still being downloaded in the background
+def load_lottie_url(url, bundled=None):
+    return shared_assets.lottie(url, bundled)
+
+# -------------------- REMOTE IMAGES --------------------
+# Served from static/ once downloaded; the bundled SVGs are used until then
+HEADER_IMAGE_URL = "https://images.unsplash.com/photo-1521587760476-6c12a4b040da?q=80&w=2070&auto=format&fit=crop&ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8fA%3D%3D"
+STAT_CARD_IMAGE_URL = "https://plus.unsplash.com/premium_photo-1675264382294-350cead0d427?q=80&w=2070&auto=format&fit=crop&ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8fA%3D%3D"
 
 # -------------------- SESSION STATE INITIALIZATION --------------------
-# Initialize session state variables if not already set
-if 'library' not in st.session_state:
-    st.session_state.library = []
+# Initialize session state variables if not already set.
+# Every session gets its own repository over the process-wide backend:
+# LIBRARY_STORAGE picks "log" (snapshot + append-only operation log, default),
+# "json" (rewrite library.json on every change) or "sqlite" (library.db,
+# queries run in the database). LIBRARY_FORMAT=binary writes the library.json
+# snapshot as a memory-mapped binary record file instead of JSON; either
+# format is detected when the library is loaded. Changes are written in the
+# background in batches, at most LIBRARY_WRITE_DELAY seconds (the loss window
+# on a crash) or LIBRARY_WRITE_BATCH changes after they were made;
+# LIBRARY_WRITE_DELAY=0 writes every change before the click returns.
+# With LIBRARY_TENANTS_DIR set, every user or collection has a library of its
+# own (tenants.py): ?library=<name> opens one, the sidebar switches between
+# them, and the session's repository is taken from the shared pool on every
+# run, as the pool may have closed its library since the last one.
+library_pool = core.open_libraries() if os.environ.get("LIBRARY_TENANTS_DIR") else None
+if library_pool is not None:
+    if 'library_name' not in st.session_state:
+        requested = st.query_params.get("library", "default")
+        st.session_state.library_name = requested if NAME_PATTERN.fullmatch(requested) else "default"
+    st.session_state.repo = core.open_library(pool=library_pool, name=st.session_state.library_name)
+    # Results and reviews of the library shown before are not this one's
+    if st.session_state.get("shown_library") != st.session_state.library_name:
+        for key in ("search_results", "pending_book", "duplicate_report", "library_listing"):
+            st.session_state.pop(key, None)
+        st.session_state.shown_library = st.session_state.library_name
+elif 'repo' not in st.session_state:
+    st.session_state.repo = core.open_library()
 
 if 'search_results' not in st.session_state:
     st.session_state.search_results = []
@@ -169,124 +241,177 @@ if 'book_removed' not in st.session_state:
 if 'current_view' not in st.session_state:
     st.session_state.current_view = "library"
 
+# Timings of this session's operations (the admin view shows them next to
+# the process-wide ones)
+if 'metrics' not in st.session_state:
+    st.session_state.metrics = instrumentation.Metrics()
+instrumentation.session_metrics = lambda: st.session_state.get("metrics")
+
+# Profile this whole run if the admin view asked for it
+profiler = instrumentation.profile_run() if st.session_state.pop("profile_next_run", False) else None
+
 # -------------------- LIBRARY LOAD & SAVE FUNCTIONS --------------------
-# Load existing library data from JSON file
+# Load existing library data (JSON or binary snapshot + replayed log, or open
+# the database). Runs on every rerun but only re-reads when the data files changed.
+@instrumented("load_library")
 def load_library():
     try:
-        if os.path.exists("library.json"):
-            with open("library.json", "r") as file:
-                st.session_state.library = json.load(file)
-                return True
-        return False
+        return core.load_library(st.session_state.repo)
     except Exception as e:
         st.error(f"An error occurred while loading the library. {e}")
         return False
 
-# Save current library data to JSON file
+# Save the whole library (full snapshot, also compacts the operation log)
+@instrumented("save_library")
 def save_library():
     try:
-        with open("library.json", "w") as file:
-            json.dump(st.session_state.library, file)
+        core.save_library(st.session_state.repo)
         return True
     except Exception as e:
         st.error(f"An error occurred while saving the library. {e}")
         return False
 
 # -------------------- BOOK MANAGEMENT FUNCTIONS --------------------
+# Page sizes offered in View Library (default from LIBRARY_PAGE_SIZE)
+PAGE_SIZES = [10, 20, 50, 100]
+DEFAULT_PAGE_SIZE = int(os.environ.get("LIBRARY_PAGE_SIZE", 20))
+if DEFAULT_PAGE_SIZE not in PAGE_SIZES:
+    PAGE_SIZES = sorted(PAGE_SIZES + [DEFAULT_PAGE_SIZE])
+
 # Add a book to the library
+@instrumented("add_book")
 def add_book(title, author, publication_year, genre, read_status, pages):
-    book = {
-        "title": title,
-        "author": author,
-        "publication_year": publication_year,
-        "genre": genre,
-        "read_status": read_status,
-        "pages": pages,
-        "date_added": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-    st.session_state.library.append(book)
-    save_library()
+    try:
+        core.add_book(st.session_state.repo, title, author, publication_year, genre, read_status, pages)
+    except Exception as e:
+        st.error(f"An error occurred while saving the library. {e}")
+        return
     st.session_state.book_added = True
-    time.sleep(1)  # Short delay for UX smoothness
-
-# Remove a book from the library by index
-def remove_book(index):
-    if 0 <= index < len(st.session_state.library):
-        del st.session_state.library[index]
-        save_library()
-        st.session_state.book_removed = True
-        return True
+    st.toast(f"📚 Added “{title}”")
+
+# Books already in the library that look like the one being added
+@instrumented("find_similar_books")
+def find_similar_books(title, author, publication_year):
+    return core.find_similar_books(st.session_state.repo, title, author, publication_year)
+
+# Add the book that was held back as a possible duplicate ("Add anyway")
+def add_pending_book():
+    book, _ = st.session_state.pop("pending_book")
+    add_book(*book)
+
+# Message shown when another session changed (or removed) the book first
+CONFLICT_MESSAGE = "⚠️ This book was changed in another session; the list has been refreshed."
+
+# Remove a book from the library by id, unless it changed since `version` was shown
+@instrumented("remove_book")
+def remove_book(book_id, version):
+    try:
+        if core.remove_book(st.session_state.repo, book_id, version):
+            st.session_state.book_removed = True
+            return True
+        st.toast(CONFLICT_MESSAGE)
+    except Exception as e:
+        st.error(f"An error occurred while saving the library. {e}")
     return False
 
-# Search books based on title, author, or genre
-def search_books(search_term, search_by):
-    search_term = search_term.lower()
-    results = []
-
-    for book in st.session_state.library:
-        if search_by == "Title" and search_term in book["title"].lower():
-            results.append(book)
-        elif search_by == "Author" and search_term in book["author"].lower():
-            results.append(book)
-        elif search_by == "Genre" and search_term in book["genre"].lower():
-            results.append(book)
-    
-    st.session_state.search_results = results
+# Set the read status of a book by id, unless it changed since `version` was shown
+@instrumented("set_read_status")
+def set_read_status(book_id, read_status, version):
+    try:
+        if core.set_read_status(st.session_state.repo, book_id, read_status, version):
+            return True
+        st.toast(CONFLICT_MESSAGE)
+    except Exception as e:
+        st.error(f"An error occurred while saving the library. {e}")
+    return False
+
+# Text box that reruns the script while the user types, once they pause for
+# LIBRARY_SEARCH_DEBOUNCE_MS (streamlit-keyup, in requirements.txt; falls back
+# to a plain text box, which only reruns on Enter, if it is missing)
+def search_input(label):
+    try:
+        from st_keyup import st_keyup
+    except ImportError:
+        return st.text_input(label)
+    return st_keyup(label, debounce=int(os.environ.get("LIBRARY_SEARCH_DEBOUNCE_MS", 300)), key="search_term")
+
+
+# Search books based on title, author, or genre (indexed, best matches first)
+@instrumented("search_books")
+def search_books(search_term, search_by, max_distance=0):
+    st.session_state.search_results = core.search_books(st.session_state.repo, search_term, search_by, max_distance)
 
 # -------------------- LIBRARY STATISTICS --------------------
-# Generate statistics for visualization
+# Generate statistics for visualization. The aggregates are kept up to date on
+# every change, so this only sorts the distinct genres/authors/decades.
+@instrumented("get_library_status")
 def get_library_status():
-    total_books = len(st.session_state.library)
-    read_books = sum(1 for book in st.session_state.library if book["read_status"])
-    percentage = (read_books / total_books) * 100 if total_books > 0 else 0
-
-    genres, authors, decades = {}, {}, {}
-
-    for book in st.session_state.library:
-        # Genre count
-        genres[book["genre"]] = genres.get(book["genre"], 0) + 1
-        # Author count
-        authors[book["author"]] = authors.get(book["author"], 0) + 1
-        # Decade count
-        decade = (book["publication_year"] // 10) * 10
-        decades[decade] = decades.get(decade, 0) + 1
-
-    return {
-        "total_books": total_books,
-        "read_books": read_books,
-        "percentage": percentage,
-        "genres": dict(sorted(genres.items(), key=lambda x: x[1], reverse=True)),
-        "authors": dict(sorted(authors.items(), key=lambda x: x[1], reverse=True)),
-        "decades": dict(sorted(decades.items(), key=lambda x: x[0], reverse=True))
-    }
+    return core.get_library_status(st.session_state.repo)
+
+# Richer statistics computed on the typed pandas frame (top authors, pages per
+# genre, books added per month). The frame is rebuilt only when the data changes.
+@instrumented("get_library_analytics")
+def get_library_analytics(top_n=10):
+    return core.get_library_analytics(st.session_state.repo, top_n)
+
+# Books added/finished and pages read per period, from the event log rollups
+@instrumented("get_reading_trends")
+def get_reading_trends(period, last):
+    return core.get_reading_trends(st.session_state.repo, period, last)
+
+@instrumented("get_reading_pace")
+def get_reading_pace():
+    return core.get_reading_pace(st.session_state.repo)
+
+# Statistics of every library, gathered from their shards in parallel
+@instrumented("get_all_libraries_status")
+def get_all_libraries_status():
+    return core.get_all_libraries_status(library_pool)
+
+# Search every library in parallel
+@instrumented("search_all_libraries")
+def search_all_libraries(search_term, search_by, max_distance=0):
+    return core.search_all_libraries(library_pool, search_term, search_by, max_distance)
 
 # -------------------- VISUALIZATIONS --------------------
-# Create and display charts using Plotly
+# Display the statistics charts. Figures come from the chart cache in
+# charts.py and are only rebuilt when their aggregate inputs change.
+@instrumented("create_visulations")
 def create_visulations(status):
+    from charts import read_status_chart, genres_chart, authors_chart, decades_chart  # Cached Plotly figures
+
     if status["total_books"] > 0:
         # Pie chart for read status
-        fig_read_status = go.Figure(data=[go.Pie(
-            labels=["Read", "Not Read"], 
-            values=[status["read_books"], status["total_books"] - status["read_books"]],
-            hole=0.3,
-            marker_colors=["#10B981", "#F87171"]
-        )])
-        fig_read_status.update_layout(title="Read vs Not Read Books", height=400)
-        st.plotly_chart(fig_read_status, use_container_width=True)
-
-        # Bar chart for genres
+        st.plotly_chart(read_status_chart(status), use_container_width=True)
+
+        # Bar charts for genres and authors (top N plus "Other")
         if status['genres']:
-            genres_df = pd.DataFrame({'Genre': list(status['genres'].keys()), 'Count': list(status['genres'].values())})
-            fig_genres = px.bar(genres_df, x='Genre', y='Count', color='Count', color_continuous_scale=px.colors.sequential.Blues)
-            fig_genres.update_layout(title="Books by Genre", height=400)
-            st.plotly_chart(fig_genres, use_container_width=True)
+            st.plotly_chart(genres_chart(status), use_container_width=True)
+        if status['authors']:
+            st.plotly_chart(authors_chart(status), use_container_width=True)
 
         # Line chart for decades
         if status['decades']:
-            decades_df = pd.DataFrame({'Decade': [f"{dec}s" for dec in status['decades'].keys()], 'Count': list(status['decades'].values())})
-            fig_decades = px.line(decades_df, x='Decade', y='Count', markers=True, line_shape="spline")
-            fig_decades.update_layout(title="Books by Publication Decade", height=400)
-            st.plotly_chart(fig_decades, use_container_width=True)
+            st.plotly_chart(decades_chart(status), use_container_width=True)
+
+# -------------------- BOOK CARDS --------------------
+# HTML for one book card; all styling comes from the .book-card CSS classes
+def book_card_html(book, show_added=True):
+    is_read = to_bool(book.get("read_status", False))
+    state = "read" if is_read else "unread"
+    added = (f"<p class='added-on'>🕒 Added on: {html.escape(str(book.get('date_added', 'N/A')))}</p>"
+             if show_added else "")
+    return f"""
+    <div class="book-card {state}">
+        <h3>📖 {html.escape(str(book.get('title', 'Unknown Title')))}</h3>
+        <p><strong>👤 Author:</strong> {html.escape(str(book.get('author', 'Unknown')))}</p>
+        <p><strong>🏷️ Genre:</strong> {html.escape(str(book.get('genre', 'Unknown')))}</p>
+        <p><strong>📅 Year:</strong> {html.escape(str(book.get('publication_year', 'N/A')))}</p>
+        <p><strong>📄 Pages:</strong> {html.escape(str(book.get('pages', 'N/A')))}</p>
+        <p><span class="status-badge {state}">{"✔️ Read" if is_read else "❌ Not Read"}</span></p>
+        {added}
+    </div>
+    """
 
 # -------------------- MAIN UI --------------------
 # Load the library on app start
@@ -304,21 +429,62 @@ st.sidebar.markdown(
   unsafe_allow_html=True
     )
 
-nav_options = st.sidebar.radio("Choose option", ["View Library", "Add Book", "Search Books", "Library Statistics"])
-st.session_state.current_view = {
+# Library cache metric (parsed library reused vs re-read from disk)
+cache_stats = shared_cache.stats()
+st.sidebar.caption(f"🗄️ Library cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+                   f"({cache_stats['hit_rate']:.0f}% hit rate)")
+query_stats = shared_queries.stats()
+st.sidebar.caption(f"🔎 Search cache: {query_stats['hits']} hits / {query_stats['misses']} misses "
+                   f"({query_stats['hit_rate']:.0f}% hit rate)")
+if st.session_state.repo.writer is not None:
+    st.sidebar.caption(f"💾 {st.session_state.repo.writer.pending_count()} change(s) waiting to be saved")
+
+# Library picker (several libraries only); a new library is created by its first book
+def create_library():
+    name = st.session_state.new_library.strip()
+    if NAME_PATTERN.fullmatch(name):
+        st.session_state.library_name = name
+        st.session_state.new_library = ""
+    else:
+        st.session_state.library_name_error = name
+
+if library_pool is not None:
+    library_names = library_pool.names()
+    if st.session_state.library_name not in library_names:
+        library_names = sorted(library_names + [st.session_state.library_name])
+    st.sidebar.selectbox("📚 Library", library_names, key="library_name")
+    st.sidebar.text_input("➕ New library", key="new_library", placeholder="name, then Enter",
+                          on_change=create_library)
+    if "library_name_error" in st.session_state:
+        st.sidebar.error(f"“{st.session_state.pop('library_name_error')}” is not a valid name: "
+                         "use letters, digits, '-' and '_'.")
+    pool_counters = library_pool.counters()
+    st.sidebar.caption(f"📂 {pool_counters['open']} of at most {pool_counters['max_open']} libraries open "
+                       f"({pool_counters['closed']} closed to make room)")
+
+# The admin view is hidden unless LIBRARY_ADMIN_TOKEN is set and the page is
+# opened with ?admin=<LIBRARY_ADMIN_TOKEN> (it can merge away duplicate books)
+views = {
     "View Library": "library",
     "Add Book": "add",
     "Search Books": "search",
     "Library Statistics": "status"
-}[nav_options]
+}
+if library_pool is not None:
+    views["All Libraries"] = "all"
+admin_token = os.environ.get("LIBRARY_ADMIN_TOKEN")
+if admin_token and st.query_params.get("admin") == admin_token:
+    views["Admin"] = "admin"
+nav_options = st.sidebar.radio("Choose option", list(views))
+st.session_state.current_view = views[nav_options]
 
 
 
 
 st.markdown(
-    """
+    f"""
     <div class="image-container">
-        <img src="https://images.unsplash.com/photo-1521587760476-6c12a4b040da?q=80&w=2070&auto=format&fit=crop&ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8fA%3D%3D"/>
+        <img src="{shared_assets.image_url(HEADER_IMAGE_URL, "header.svg")}"/>
         </div>
         
     
@@ -337,6 +503,10 @@ st.markdown(
 )
 
 
+# Only one view below renders per run; its time is recorded as "view.<name>"
+rendered_view = st.session_state.current_view
+view_start = time.perf_counter()
+
 # -------------------- ADD BOOK VIEW --------------------
 if st.session_state.current_view == "add":
     st.markdown("""
@@ -354,25 +524,55 @@ if st.session_state.current_view == "add":
         with col1:
             title = st.text_input("📚 Book Title", max_chars=100, placeholder="e.g., The Great Gatsby")
             author = st.text_input("✍️ Author", max_chars=100, placeholder="e.g., F. Scott Fitzgerald")
-            publication_year = st.number_input("📅 Publication Year", min_value=1000, max_value=datetime.now().year,
+            publication_year = st.number_input("📅 Publication Year", min_value=MIN_YEAR, max_value=datetime.now().year,
                                                 step=1, value=datetime.now().year)
 
         with col2:
-            genre = st.selectbox("🎭 Genre", [
-                "Fiction", "Non-Fiction", "Science Fiction", "Fantasy", "Mystery", "Thriller", "Romance",
-                "Biography", "Autobiography", "Self-Help", "Historical Fiction", "Young Adult", "Children's",
-                "Poetry", "Graphic Novel", "Others"
-            ])
+            genre = st.selectbox("🎭 Genre", GENRES)
             read_status = st.radio("📖 Read Status", ["Read ✅", "Not Read ❌"], horizontal=True)
             read_bool = "Read" in read_status
-            pages = st.number_input("📄 Pages", min_value=1, max_value=10000, step=1, value=100)
+            pages = st.number_input("📄 Pages", min_value=MIN_PAGES, max_value=MAX_PAGES, step=1, value=100)
 
         st.markdown("---")
         submit_button = st.form_submit_button(label="✅ Add Book")
 
+    # Bulk import: the file is parsed in chunks and every batch is saved with one write
+    with st.expander("📦 Bulk import (CSV, JSON Lines, Parquet)"):
+        uploaded = st.file_uploader("Choose a file", type=["csv", "jsonl", "ndjson", "parquet"])
+        if uploaded is not None and st.button("⬆️ Import books", use_container_width=True):
+            progress = st.empty()
+            try:
+                report = import_books(
+                    st.session_state.repo, uploaded, detect_format(uploaded.name),
+                    on_batch=lambda r: progress.info(f"{r['rows']:,} rows read, {r['imported']:,} imported..."),
+                )
+            except Exception as e:
+                st.error(f"An error occurred while importing. {e}")
+            else:
+                progress.success(f"✅ Imported {report['imported']:,} of {report['rows']:,} rows "
+                                 f"({report['duplicates']:,} duplicates, {report['invalid']:,} invalid) "
+                                 f"in {report['seconds']:.1f}s — {report['rows_per_second']:,.0f} rows/s")
+                for error in report["errors"]:
+                    st.caption(f"Skipped {error}")
+
+    # A book that looks like one already in the library waits for confirmation
     if submit_button and title and author:
-        add_book(title, author, publication_year, genre, read_bool, pages)
-        st.session_state.book_added = True
+        matches = find_similar_books(title, author, publication_year)
+        if matches:
+            st.session_state.pending_book = ((title, author, publication_year, genre, read_bool, pages), matches)
+        else:
+            add_book(title, author, publication_year, genre, read_bool, pages)
+
+    if st.session_state.get("pending_book"):
+        book, matches = st.session_state.pending_book
+        st.warning(f"⚠️ “{book[0]}” may already be in your library:")
+        for match, similarity in matches:
+            st.markdown(book_card_html(match), unsafe_allow_html=True)
+            st.caption(f"{similarity:.0%} similar")
+        col1, col2 = st.columns(2)
+        col1.button("➕ Add anyway", on_click=add_pending_book, use_container_width=True)
+        col2.button("✖️ Cancel", on_click=lambda: st.session_state.pop("pending_book", None),
+                    use_container_width=True)
 
     if st.session_state.get("book_added"):
         st.success("✅ Book added successfully!")
@@ -385,53 +585,66 @@ if st.session_state.current_view == "add":
 if st.session_state.current_view == "library":
     st.markdown("<h2 class='sub-header' style=' margin-bottom: 1.5rem; ' >📚 Your Library</h2>", unsafe_allow_html=True)
 
-    if not st.session_state.library:
+    repo = st.session_state.repo
+    if not repo.count():
         pass
     else:
+        # Sorting, filtering and page size controls
+        sort_labels = {"Date Added": "date_added", "Title": "title", "Author": "author", "Year": "publication_year"}
+        ctrl1, ctrl2, ctrl3, ctrl4, ctrl5 = st.columns(5)
+        with ctrl1:
+            sort_by = st.selectbox("Sort by", list(sort_labels), key="library_sort")
+        with ctrl2:
+            descending = st.selectbox("Order", ["Ascending", "Descending"], key="library_order") == "Descending"
+        with ctrl3:
+            genre_filter = st.selectbox("Genre", ["All"] + GENRES, key="library_genre")
+        with ctrl4:
+            status_filter = st.selectbox("Status", ["All", "Read", "Not Read"], key="library_status")
+        with ctrl5:
+            page_size = st.selectbox("Per page", PAGE_SIZES, index=PAGE_SIZES.index(DEFAULT_PAGE_SIZE),
+                                     key="library_page_size")
+
+        filters = {
+            "genre": None if genre_filter == "All" else genre_filter,
+            "read_status": None if status_filter == "All" else status_filter == "Read",
+        }
+        total = repo.count(filters)
+        page_count = max(1, -(-total // page_size))
+
+        # Start again from the first page whenever the listing changes
+        listing = (sort_by, descending, genre_filter, status_filter, page_size)
+        if st.session_state.get("library_listing") != listing:
+            st.session_state.library_listing = listing
+            st.session_state.library_page = 1
+        st.session_state.library_page = min(st.session_state.get("library_page", 1), page_count)
+
+        page = st.number_input(f"Page (of {page_count}, {total} books)", min_value=1, max_value=page_count,
+                               key="library_page")
+
+        # Only the visible slice is fetched and rendered
+        with instrumentation.timed("query_page"):
+            books = repo.query(filters, order_by=sort_labels[sort_by], descending=descending,
+                               limit=page_size, offset=(page - 1) * page_size)
+
         cols = st.columns(2)
-        for i, book in enumerate(st.session_state.library):
-            with cols[i % 2]:
-                st.markdown(f"""
-                <div style="background: linear-gradient(to right, #f9fafb, #f3f4f6); 
-                            border-radius: 1rem; 
-                            padding: 1.5rem; 
-                            margin-bottom: 1rem; 
-                            box-shadow: 0 4px 12px rgba(0, 0, 0, 0.05); 
-                            border-left: 5px solid {'#10b981' if book.get('read_status', False) else '#ef4444'};">
-                    <h3 style="margin: 0; font-size: 1.4rem; font-weight: 700; color: #1f2937;">📖 {book.get('title', 'Unknown Title')}</h3>
-                    <p style="margin: 0.5rem 0;"><strong>👤 Author:</strong> {book.get('author', 'Unknown')}</p>
-                    <p style="margin: 0.5rem 0;"><strong>🏷️ Genre:</strong> {book.get('genre', 'Unknown')}</p>
-                    <p style="margin: 0.5rem 0;"><strong>📅 Year:</strong> {book.get('publication_year', 'N/A')}</p>
-                    <p style="margin: 0.5rem 0;"><strong>📄 Pages:</strong> {book.get('pages', 'N/A')}</p>
-                    <p style="margin: 0.5rem 0;">
-                        <span style="padding: 0.2rem 0.6rem; 
-                                    border-radius: 9999px; 
-                                    background-color: {'#dcfce7' if book.get('read_status', False) else '#fee2e2'}; 
-                                    color: {'#15803d' if book.get('read_status', False) else '#b91c1c'}; 
-                                    font-weight: 600; 
-                                    font-size: 0.875rem;">
-                            {"✔️ Read" if book.get("read_status", False) else "❌ Not Read"}
-                        </span>
-                    </p>
-                    <p style="font-size: 0.85rem; color: #6b7280;">🕒 Added on: {book.get('date_added', 'N/A')}</p>
-                </div>
-                """, unsafe_allow_html=True)
+        for n, book in enumerate(books):
+            book_id, version = book["id"], book.get("version", 1)
+            with cols[n % 2]:
+                st.markdown(book_card_html(book), unsafe_allow_html=True)
 
-                # Buttons below each card
+                # Buttons below each card. The change runs in the click callback,
+                # before the rerun, so one click costs one script run.
                 col1, col2 = st.columns([1, 1])
                 with col1:
-                    if st.button("🗑️ Remove Book", key=f"remove_{i}", use_container_width=True):
-                        if remove_book(i):
-                            st.session_state.book_removed = True
-                            st.rerun()
+                    st.button("🗑️ Remove Book", key=f"remove_{book_id}", use_container_width=True,
+                              on_click=remove_book, args=(book_id, version))
 
                 with col2:
-                    new_status = not book["read_status"]
-                    label = "✅ Mark as Read" if not book["read_status"] else "❌ Mark as Not Read"
-                    if st.button(label, key=f"status_{i}", use_container_width=True):
-                        st.session_state.library[i]["read_status"] = new_status
-                        save_library()
-                        st.rerun()
+                    is_read = to_bool(book.get("read_status", False))
+                    new_status = not is_read
+                    label = "✅ Mark as Read" if not is_read else "❌ Mark as Not Read"
+                    st.button(label, key=f"status_{book_id}", use_container_width=True,
+                              on_click=set_read_status, args=(book_id, new_status, version))
 
 
 # Show a success message if a book was removed
@@ -446,62 +659,204 @@ if st.session_state.current_view == "search":
 
     with st.container():
         search_by = st.selectbox("🔎 Search by:", ["Title", "Author", "Genre"])
-        search_term = st.text_input("Enter your search term...")
-
-    if st.button("Search", use_container_width=True):
-        if search_term:
-            with st.spinner("Searching..."):
-                search_books(search_term, search_by)
-
-            # Display search results
-            if hasattr(st.session_state, "search_results"):
-                if st.session_state.search_results:
-                    st.markdown(f"<h4 style='color:#10b981;'>✅ Found {len(st.session_state.search_results)} result(s):</h4>", unsafe_allow_html=True)
-
-                    cols = st.columns(2)
-                    for i, book in enumerate(st.session_state.search_results):
-                        with cols[i % 2]:
-                            st.markdown(f"""
-                                <div style="background: #f9fafb; 
-                                            border-radius: 1rem; 
-                                            padding: 1.5rem; 
-                                            margin-bottom: 1rem; 
-                                            box-shadow: 0 2px 6px rgba(0, 0, 0, 0.05); 
-                                            border-left: 5px solid {'#10b981' if book.get('read_status') else '#ef4444'};">
-                                    <h3 style="margin-bottom: 0.5rem; font-size: 1.25rem; color: #1f2937;">📖 {book['title']}</h3>
-                                    <p style="margin: 0.2rem 0;"><strong>👤 Author:</strong> {book['author']}</p>
-                                    <p style="margin: 0.2rem 0;"><strong>🏷️ Genre:</strong> {book['genre']}</p>
-                                    <p style="margin: 0.2rem 0;"><strong>📅 Year:</strong> {book['publication_year']}</p>
-                                    <p style="margin: 0.2rem 0;"><strong>📄 Pages:</strong> {book['pages']}</p>
-                                    <p style="margin: 0.5rem 0;">
-                                        <span style="padding: 0.2rem 0.6rem; 
-                                                    border-radius: 9999px; 
-                                                    background-color: {'#dcfce7' if book['read_status'] else '#fee2e2'}; 
-                                                    color: {'#15803d' if book['read_status'] else '#b91c1c'}; 
-                                                    font-weight: 600; 
-                                                    font-size: 0.875rem;">
-                                            {"✔️ Read" if book["read_status"] else "❌ Not Read"}
-                                        </span>
-                                    </p>
-                                </div>
-                            """, unsafe_allow_html=True)
-                else:
-                    st.markdown("""
-                        <div class='warning-message'>
-                            ❌ No book found matching your search.
-                        </div>
-                    """, unsafe_allow_html=True)
+        search_term = search_input("Enter your search term...")
+        max_distance = st.select_slider("✏️ Typo tolerance", options=[0, 1, 2],
+                                        format_func=lambda n: ["Exact", "1 typo", "2 typos"][n],
+                                        help="Also find words spelled with this many mistakes, e.g. 'Fitzgerlad'")
+
+    # Results follow the term as it is typed; repeated searches (also from
+    # other sessions) and longer terms reuse the cached results
+    st.button("Search", use_container_width=True)
+    if search_term:
+        with st.spinner("Searching..."):
+            search_books(search_term, search_by, max_distance)
+
+        # Display search results
+        if st.session_state.search_results:
+            st.markdown(f"<h4 style='color:#10b981;'>✅ Found {len(st.session_state.search_results)} result(s):</h4>", unsafe_allow_html=True)
+
+            cols = st.columns(2)
+            for i, book in enumerate(st.session_state.search_results):
+                with cols[i % 2]:
+                    st.markdown(book_card_html(book, show_added=False), unsafe_allow_html=True)
+        else:
+            st.markdown("""
+                <div class='warning-message'>
+                    ❌ No book found matching your search.
+                </div>
+            """, unsafe_allow_html=True)
 
 # =================== LIBRARY STATISTICS VIEW ===================
-
-if not st.session_state.library:
+if st.session_state.current_view == "status":
+    st.markdown("<h2 class='sub-header'>📊 Library Statistics</h2>", unsafe_allow_html=True)
+
+    if st.session_state.repo.count():
+        import pandas as pd  # Loaded on first use of this view
+        analytics = get_library_analytics()
+
+        col1, col2, col3 = st.columns(3)
+        col1.metric("📖 Read", f"{analytics['percentage']:.1f}%")
+        col2.metric("🏷️ Genres", len(analytics["genres"]))
+        col3.metric("📅 Decades", len(analytics["decades"]))
+
+        create_visulations(get_library_status())
+
+        st.markdown("#### 📄 Pages per Genre")
+        st.bar_chart(pd.Series(analytics["pages_per_genre"], name="Pages"))
+
+        if analytics["added_per_month"]:
+            st.markdown("#### 🕒 Books Added per Month")
+            st.line_chart(pd.Series(analytics["added_per_month"], name="Books"))
+
+        # Reading history, from rollups kept up to date on every change
+        st.markdown("#### 📈 Reading Trends")
+        period = st.radio("Per", ["Month", "Day"], horizontal=True, key="trend_period")
+        trends = get_reading_trends(period.lower(), 24 if period == "Month" else 90)
+        if trends:
+            frame = pd.DataFrame.from_dict(trends, orient="index")
+            st.line_chart(frame[["added", "finished"]].rename(columns={"added": "Added", "finished": "Finished"}))
+            st.bar_chart(frame["pages"].rename("Pages read"))
+            pace = get_reading_pace()
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("📚 Books per month", f"{pace['books_per_month']:.1f}")
+            col2.metric("📄 Pages per day", f"{pace['pages_per_day']:.0f}")
+            col3.metric(f"🎯 Projected for {datetime.now().year}", pace["projected_this_year"],
+                        f"{pace['finished_this_year']} so far", delta_color="off")
+            months = pace["months_to_finish_unread"]
+            col4.metric("⏳ Unread books done in", f"{months:.1f} months" if months is not None else "—")
+            st.caption(f"Pace of the last {pace['days']} days.")
+        else:
+            st.info("The reading history starts with the next book you add or mark as read.")
+
+# ==================== ALL LIBRARIES VIEW ====================
+# Totals and a search across every library (several libraries only). Each
+# library is read in its own thread; libraries that are not open answer from
+# their saved statistics.
+if st.session_state.current_view == "all":
+    st.markdown("<h2 class='sub-header'>🗂️ All Libraries</h2>", unsafe_allow_html=True)
+
+    overview = get_all_libraries_status()
+    for name, error in overview["errors"].items():
+        st.warning(f"⚠️ Library “{name}” could not be read: {error}")
+    total = overview["total"]
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("📚 Libraries", len(overview["libraries"]))
+    col2.metric("📖 Books", f"{total['total_books']:,}")
+    col3.metric("✔️ Read", f"{total['percentage']:.1f}%")
+    col4.metric("📄 Pages", f"{total['total_pages']:,}")
+
+    if overview["libraries"]:
+        import pandas as pd  # Loaded on first use of this view
+        st.dataframe(pd.DataFrame([
+            {"Library": name, "Books": summary["total_books"], "Read": summary["read_books"],
+             "Read %": round(summary["percentage"], 1), "Pages": summary["total_pages"],
+             "Top genre": next(iter(summary["genres"]), "")}
+            for name, summary in overview["libraries"].items()
+        ]), hide_index=True, use_container_width=True)
+        if total["genres"]:
+            st.markdown("#### 🏷️ Books per Genre")
+            st.bar_chart(pd.Series(total["genres"], name="Books"))
+
+    st.markdown("#### 🔍 Search all libraries")
+    col1, col2 = st.columns([1, 3])
+    all_search_by = col1.selectbox("Search by", ["Title", "Author", "Genre"], key="all_search_by")
+    all_search_term = col2.text_input("Search term", key="all_search_term")
+    if all_search_term:
+        found, failed = search_all_libraries(all_search_term, all_search_by)
+        for name, error in failed.items():
+            st.warning(f"⚠️ Library “{name}” could not be searched: {error}")
+        if found:
+            st.caption(f"{len(found)} result(s), the best of each library first.")
+            cols = st.columns(2)
+            for i, (name, book) in enumerate(found):
+                with cols[i % 2]:
+                    st.caption(f"📚 {name}")
+                    st.markdown(book_card_html(book, show_added=False), unsafe_allow_html=True)
+        else:
+            st.info("No book found in any library.")
+
+# ======================= ADMIN VIEW =======================
+# Timings of the hot paths, cache counters, cProfile of one run, metric export
+if st.session_state.current_view == "admin":
+    st.markdown("<h2 class='sub-header'>⚙️ Admin</h2>", unsafe_allow_html=True)
+
+    scope = st.radio("Timings", ["All sessions", "This session"], horizontal=True)
+    metrics = instrumentation.global_metrics if scope == "All sessions" else st.session_state.metrics
+    rows = [
+        {"operation": name, "calls": values["count"], "p50 ms": round(values["p50"] * 1000, 2),
+         "p95 ms": round(values["p95"] * 1000, 2), "p99 ms": round(values["p99"] * 1000, 2),
+         "max ms": round(values["max"] * 1000, 2), "total s": round(values["total"], 2)}
+        for name, values in metrics.snapshot().items()
+    ]
+    if rows:
+        st.table(rows)
+    else:
+        st.info("Nothing timed yet.")
+    st.caption(f"Percentiles cover the last {metrics.window} calls of each operation.")
+
+    col1, col2 = st.columns(2)
+    col1.download_button("⬇️ Prometheus", instrumentation.to_prometheus(), "library_metrics.prom", "text/plain",
+                         use_container_width=True)
+    col2.download_button("⬇️ JSON", instrumentation.to_json(), "library_metrics.json", "application/json",
+                         use_container_width=True)
+
+    st.markdown("#### 🗄️ Caches and writes")
+    st.json({"library_cache": shared_cache.stats(),
+             "query_cache": shared_queries.stats(),
+             "write_behind": st.session_state.repo.writer.stats() if st.session_state.repo.writer else None,
+             "libraries": library_pool.counters() if library_pool is not None else None})
+
+    # Duplicate groups of the whole library; unticked groups are left alone
+    st.markdown("#### 🧹 Duplicates")
+    threshold = st.slider("Similarity threshold", 0.3, 1.0, DEFAULT_THRESHOLD, 0.05)
+    if st.button("Find duplicates"):
+        with st.spinner("Looking for duplicates..."):
+            st.session_state.duplicate_report = core.duplicate_report(st.session_state.repo, threshold)
+    report = st.session_state.get("duplicate_report")
+    if report:
+        st.caption(f"{report['books']:,} books: {report['exact_groups']:,} exact and {report['near_groups']:,} "
+                   f"near duplicate groups, {report['removable']:,} books to remove ({report['seconds']:.1f}s)")
+        if report["groups"]:
+            def describe(book):
+                return f"{book['title']} – {book['author']} ({book['publication_year']})"
+
+            edited = st.data_editor(
+                [{"merge": True, "kind": group["kind"], "similarity": group["similarity"],
+                  "keep": describe(group["books"][0]),
+                  "remove": " | ".join(describe(book) for book in group["books"][1:])}
+                 for group in report["groups"]],
+                disabled=["kind", "similarity", "keep", "remove"], hide_index=True, use_container_width=True,
+            )
+            selected = [group for group, row in zip(report["groups"], edited) if row["merge"]]
+            col1, col2 = st.columns(2)
+            if col1.button(f"Merge {len(selected):,} groups", disabled=not selected, use_container_width=True):
+                merged = core.merge_duplicates(st.session_state.repo, selected)
+                del st.session_state.duplicate_report
+                st.success(f"Merged {merged['merged']:,} groups, removed {merged['removed']:,} books"
+                           + (f" ({merged['conflicts']:,} changed since the report were skipped)"
+                              if merged["conflicts"] else ""))
+            col2.download_button("⬇️ Report (JSON)", json.dumps(report, indent=2, default=str),
+                                 "duplicates.json", "application/json", use_container_width=True)
+
+    st.markdown("#### 🔬 Profile a run")
+    st.button("Profile the next run", on_click=lambda: st.session_state.update(profile_next_run=True))
+    if "last_profile" in st.session_state:
+        profile_text, profile_data = st.session_state.last_profile
+        st.download_button("⬇️ Profile (.prof)", profile_data, "rerun.prof", "application/octet-stream")
+        st.code(profile_text)
+
+instrumentation.record(f"view.{rendered_view}", time.perf_counter() - view_start)
+
+
+if not st.session_state.repo.count():
     st.markdown("<div class='warning-message'>Your library is empty. Add some books to see statistics.</div>", unsafe_allow_html=True)
 else:
-    # 🧠 STEP 1: Define your stats first
-    total_books = len(st.session_state.library)
-    read_books = sum(1 for book in st.session_state.library if book.get("read_status"))
+    # 🧠 STEP 1: Define your stats first (maintained incrementally, no rescans)
+    library_stats = st.session_state.repo.stats()
+    total_books = library_stats.total_books
+    read_books = library_stats.read_books
     unread_books = total_books - read_books
-    total_pages = sum(book.get("pages", 0) for book in st.session_state.library)
+    total_pages = library_stats.total_pages
 
     # 💡 STEP 2: Now use the variables in the HTML below
     st.markdown(f"""
@@ -515,7 +870,7 @@ else:
     }}
 
     .stat-card {{
-        background: url("https://plus.unsplash.com/premium_photo-1675264382294-350cead0d427?q=80&w=2070&auto=format&fit=crop&ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8fA%3D%3D") !important;
+        background: url("{shared_assets.image_url(STAT_CARD_IMAGE_URL, "stat-card.svg")}") !important;
         background-size: cover;
         background-position: center;
         border-radius: 1.25rem;
@@ -584,3 +939,15 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 st.markdown("<footer>Copyright © 2025 Khansa TanveerAhmed — Personal Library Manager</footer>", unsafe_allow_html=True)
+
+# Whole run timing, profile and metrics file (LIBRARY_METRICS_FILE, for scraping)
+instrumentation.record("rerun", time.perf_counter() - RUN_START)
+if profiler is not None:
+    st.session_state.last_profile = instrumentation.profile_report(profiler)
+    st.rerun()  # show it right away
+if os.environ.get("LIBRARY_METRICS_FILE"):
+    instrumentation.export(os.environ["LIBRARY_METRICS_FILE"])
+
+# Startup timing report (only printed with LIBRARY_STARTUP_TIMING=1)
+startup_timing.report(RUN_START, first_in_session="rendered" not in st.session_state)
+st.session_state.rendered = True
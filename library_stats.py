@@ -0,0 +1,183 @@
+# Incrementally maintained library statistics
+#
+# Counts, page totals and the genre/author/decade histograms are updated from
+# every add/remove/update instead of being recomputed by scanning all books,
+# so reading them costs O(number of distinct keys).
+#
+# The aggregates are saved to `<library>.stats.json` together with the
+# fingerprint of the data files they describe. On start-up they are reused if
+# the fingerprint still matches, otherwise they are rebuilt from the books.
+#
+#   python library_stats.py check [library.json]
+# verifies the saved aggregates against a full recompute (set LIBRARY_STORAGE
+# like for the app).
+import json
+import os
+
+from storage import atomic_write_json, to_bool
+
+
+def stats_path(library_path):
+    return os.path.splitext(library_path)[0] + ".stats.json"
+
+
+def decade_of(book):
+    year = book.get("publication_year")
+    return (year // 10) * 10 if isinstance(year, int) else None
+
+
+class LibraryStats:
+    HISTOGRAMS = ("genres", "authors", "decades")
+
+    def __init__(self):
+        self.dirty = False  # changed since it was last saved
+        self.total_books = 0
+        self.read_books = 0
+        self.total_pages = 0
+        self.genres = {}
+        self.authors = {}
+        self.decades = {}
+
+    @classmethod
+    def from_books(cls, books):
+        stats = cls()
+        for book in books:
+            stats.add(book)
+        return stats
+
+    def add(self, book):
+        self._apply(book, 1)
+
+    def remove(self, book):
+        self._apply(book, -1)
+
+    # `old` is a copy of the book taken before its fields were changed
+    def update(self, old, new):
+        self._apply(old, -1)
+        self._apply(new, 1)
+
+    def _apply(self, book, sign):
+        self.dirty = True
+        self.total_books += sign
+        if to_bool(book.get("read_status", False)):
+            self.read_books += sign
+        self.total_pages += sign * (book.get("pages", 0) or 0)
+        self._bump(self.genres, book.get("genre"), sign)
+        self._bump(self.authors, book.get("author"), sign)
+        decade = decade_of(book)
+        if decade is not None:
+            self._bump(self.decades, decade, sign)
+
+    def _bump(self, counts, key, sign):
+        count = counts.get(key, 0) + sign
+        if count:
+            counts[key] = count
+        else:
+            counts.pop(key, None)
+
+    # Same shape as get_library_status() in library_manager.py
+    def summary(self):
+        return {
+            "total_books": self.total_books,
+            "read_books": self.read_books,
+            "percentage": (self.read_books / self.total_books) * 100 if self.total_books > 0 else 0,
+            "total_pages": self.total_pages,
+            "genres": dict(sorted(self.genres.items(), key=lambda x: x[1], reverse=True)),
+            "authors": dict(sorted(self.authors.items(), key=lambda x: x[1], reverse=True)),
+            "decades": dict(sorted(self.decades.items(), key=lambda x: x[0], reverse=True)),
+        }
+
+    def to_dict(self):
+        return {
+            "total_books": self.total_books,
+            "read_books": self.read_books,
+            "total_pages": self.total_pages,
+            "genres": self.genres,
+            "authors": self.authors,
+            # JSON object keys are strings
+            "decades": {str(decade): count for decade, count in self.decades.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.total_books = data["total_books"]
+        stats.read_books = data["read_books"]
+        stats.total_pages = data["total_pages"]
+        stats.genres = dict(data["genres"])
+        stats.authors = dict(data["authors"])
+        stats.decades = {int(decade): count for decade, count in data["decades"].items()}
+        stats.dirty = False
+        return stats
+
+    # Snapshot that other sessions' writes will not change underneath the reader
+    def copy(self):
+        stats = LibraryStats()
+        stats.total_books = self.total_books
+        stats.read_books = self.read_books
+        stats.total_pages = self.total_pages
+        stats.genres = dict(self.genres)
+        stats.authors = dict(self.authors)
+        stats.decades = dict(self.decades)
+        return stats
+
+    # Add the counts of `other` (another library's statistics) to these
+    def merge(self, other):
+        self.total_books += other.total_books
+        self.read_books += other.read_books
+        self.total_pages += other.total_pages
+        for name in self.HISTOGRAMS:
+            counts = getattr(self, name)
+            for key, count in getattr(other, name).items():
+                counts[key] = counts.get(key, 0) + count
+
+    # Differences against a full recompute from `books` (empty list = consistent)
+    def verify(self, books):
+        expected = LibraryStats.from_books(books)
+        problems = []
+        for name in ("total_books", "read_books", "total_pages") + self.HISTOGRAMS:
+            actual_value, expected_value = getattr(self, name), getattr(expected, name)
+            if actual_value != expected_value:
+                problems.append(f"{name}: stored {actual_value!r}, recomputed {expected_value!r}")
+        return problems
+
+
+# -------------------- PERSISTENCE --------------------
+# Save aggregates for the data whose files currently have `fingerprint`
+def save_stats(path, stats, fingerprint):
+    atomic_write_json(path, {"fingerprint": fingerprint, "stats": stats.to_dict()}, stream=False)
+    stats.dirty = False
+
+
+# Load saved aggregates if they describe the data with `fingerprint`, else None
+def load_stats(path, fingerprint):
+    try:
+        with open(path, "r") as file:
+            data = json.load(file)
+    except (OSError, ValueError):
+        return None
+    # JSON turns the fingerprint tuples into lists
+    if json.loads(json.dumps(fingerprint)) != data.get("fingerprint"):
+        return None
+    return LibraryStats.from_dict(data["stats"])
+
+
+if __name__ == "__main__":
+    import sys
+
+    from storage import get_storage
+
+    if len(sys.argv) < 2 or sys.argv[1] != "check":
+        print("usage: python library_stats.py check [library.json]")
+        sys.exit(1)
+    library_path = sys.argv[2] if len(sys.argv) > 2 else "library.json"
+    storage = get_storage(os.environ.get("LIBRARY_STORAGE", "log"), library_path)
+    saved = load_stats(stats_path(library_path), storage.fingerprint())
+    if saved is None:
+        print(f"No up-to-date statistics file for {library_path}")
+        sys.exit(1)
+    problems = saved.verify(storage.load())
+    for problem in problems:
+        print(problem)
+    print("Statistics are consistent" if not problems else f"{len(problems)} inconsistencies found")
+    sys.exit(1 if problems else 0)
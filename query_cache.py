@@ -0,0 +1,155 @@
+# Results of recent searches, shared by all sessions
+#
+# Every session searching the same library for the same thing used to run the
+# same search again, and a session's results were gone as soon as it changed
+# the "Search by" field. This cache keeps the result ids of recent searches
+# under (library path, criteria, limit); text terms are lowercased, as the
+# search ignores case.
+#
+# Each entry also keeps the stamp of the data it was computed from, and a
+# lookup whose stamp differs is a miss:
+#   * in memory the results are SearchIndex document ids, stamped by
+#     SearchIndex.stamp() with the counters of the fields the criteria look
+#     at: toggling a read status only invalidates searches filtered by read
+#     status, an added book invalidates every search of that library, and a
+#     reload from disk builds a new index
+#   * for SQLite the results are the rows themselves, stamped with the data
+#     version (the storage fingerprint) and a counter of the writes made by
+#     this process (changed()), as the fingerprint may miss a write that
+#     lands within the same mtime tick without changing the file size
+#
+# For search-as-you-type, the results for "dun" are the candidates for "dune"
+# (see shorter_queries()), so each keystroke only re-checks the previous
+# results. The least recently used entries are evicted once the estimated
+# size of all cached results passes max_bytes (LIBRARY_QUERY_CACHE_MB).
+import os
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+
+TEXT_CRITERIA = ("title", "author", "genre")
+ROW_BYTES = 1024  # rough size of one cached SQLite row (a dict of nine fields)
+
+
+# Cache key of a search; criteria left as None do not count
+def query_key(path, criteria, limit=None):
+    items = tuple(sorted(
+        (name, value.lower() if name in TEXT_CRITERIA and isinstance(value, str) else value)
+        for name, value in criteria.items()
+        if value is not None
+    ))
+    return (path, items, limit)
+
+
+# The same criteria with one text term cut shorter, longest first. Every book
+# matching the full term is among the results of each of them.
+def shorter_queries(criteria):
+    shorter = []
+    for name in TEXT_CRITERIA:
+        term = criteria.get(name)
+        if isinstance(term, str):
+            shorter += [(length, dict(criteria, **{name: term[:length]})) for length in range(1, len(term))]
+    shorter.sort(key=lambda item: item[0], reverse=True)
+    return [query for _, query in shorter]
+
+
+# Compact list of document ids, and its size in bytes
+def id_list(doc_ids):
+    ids = array("q", doc_ids)
+    return ids, sys.getsizeof(ids)
+
+
+def row_list(rows):
+    return list(rows), sys.getsizeof(rows) + len(rows) * ROW_BYTES
+
+
+# Least recently used cache of search results, bounded by their estimated size
+class QueryCache:
+    def __init__(self, max_bytes=32 << 20):
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (stamp, results, size)
+        self.writes = {}              # path -> writes through changed()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.prefix_hits = 0
+        self.evictions = 0
+
+    # Cached results for `key` if they were computed with `stamp`, else None
+    def get(self, key, stamp):
+        results = self._lookup(key, stamp)
+        with self.lock:
+            if results is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return results
+
+    # Like get(), for the results of a shorter term; not counted as a hit or miss
+    def get_shorter(self, key, stamp):
+        results = self._lookup(key, stamp)
+        if results is not None:
+            with self.lock:
+                self.prefix_hits += 1
+        return results
+
+    def put(self, key, stamp, results, size):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[2]
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (stamp, results, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def _lookup(self, key, stamp):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != stamp:
+                # Computed from older data; it can never match again
+                del self.entries[key]
+                self.size -= entry[2]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    # Count a write to the library at `path`, for stamps using written()
+    def changed(self, path):
+        with self.lock:
+            self.writes[path] = self.writes.get(path, 0) + 1
+
+    def written(self, path):
+        with self.lock:
+            return self.writes.get(path, 0)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "prefix_hits": self.prefix_hits,
+                "hit_rate": (self.hits / total) * 100 if total else 0,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+
+# Shared by every session of the Streamlit app
+shared_queries = QueryCache(int(float(os.environ.get("LIBRARY_QUERY_CACHE_MB", 32)) * (1 << 20)))
@@ -0,0 +1,362 @@
+# Reading history: an event log of the library and daily/monthly rollups of it
+#
+# Books only carry the time they were added, so when a book was read was lost
+# as soon as its status flipped. Every change the repository makes now also
+# appends one JSON line to `<library>.events.jsonl`:
+#   {"time": 1718000000, "event": "finished", "id": "...", "pages": 320}
+# with the events "added" (at the book's date added, so imported books land in
+# their own month), "removed", "finished" (read status set) and "unfinished"
+# (read status cleared). Times are seconds like records.parse_date() makes them.
+#
+# The rollups count, per day and per month, the books added, the books
+# finished and the pages of the finished books. They are updated event by event
+# and saved to `<library>.rollups.json` with the log offset they cover; on start
+# they are loaded and only the events appended since (by any process) are
+# applied, so the trend charts never read the whole history. An "unfinished"
+# event takes the book back out of the period it was finished in (an undone
+# click does not count); books added as already read have no finish time and
+# are not counted as finished.
+#
+# Undoing needs the time and pages of each book's last "finished" event. That
+# map grows with every book ever read, so it is not part of the rollups file
+# (saved in full after every change) but kept in `<library>.finished.jsonl`,
+# one appended line per change: [log offset, id, time, pages] when a book is
+# finished, [log offset, id] when that is undone. Lines beyond the offset the
+# saved rollups cover are ignored on load; their events are applied again.
+#
+#   python reading_log.py rebuild [library.json] [--backfill]
+# regenerates the rollups from the event log; --backfill first logs an
+# "added" event for every book that has none (libraries older than the log).
+import json
+import os
+import threading
+import time
+from datetime import date, datetime
+
+from records import EPOCH, added_epoch
+from storage import atomic_write_json, to_bool
+
+MEASURES = ("added", "finished", "pages")
+PACE_DAYS = 90
+DAYS_PER_MONTH = 365.25 / 12
+
+
+def events_path(library_path):
+    return os.path.splitext(library_path)[0] + ".events.jsonl"
+
+
+def rollups_path(library_path):
+    return os.path.splitext(library_path)[0] + ".rollups.json"
+
+
+def finished_path(library_path):
+    return os.path.splitext(library_path)[0] + ".finished.jsonl"
+
+
+# The current local time in seconds, as records.parse_date() stores dates
+def now():
+    return int((datetime.now() - EPOCH).total_seconds())
+
+
+def day_of(seconds):
+    return time.strftime("%Y-%m-%d", time.gmtime(seconds))
+
+
+class Rollups:
+    def __init__(self):
+        self.dirty = False   # changed since it was last saved
+        self.offset = 0      # bytes of the event log applied
+        self.daily = {}      # "YYYY-MM-DD" -> [added, finished, pages]
+        self.monthly = {}    # "YYYY-MM" -> [added, finished, pages]
+        self.finished = {}   # book id -> [time, pages] of its last "finished" event
+        self.finished_changes = []  # changes to `finished` not yet in the finished log
+
+    def apply(self, event):
+        self.dirty = True
+        kind = event.get("event")
+        if kind == "added":
+            self._bump(event["time"], 1, 0)
+        elif kind == "finished":
+            pages = event.get("pages") or 0
+            self.finished[event["id"]] = [event["time"], pages]
+            self.finished_changes.append([event["id"], event["time"], pages])
+            self._bump(event["time"], 0, 1, pages)
+        elif kind == "unfinished":
+            finished = self.finished.pop(event["id"], None)
+            if finished is not None:
+                self.finished_changes.append([event["id"]])
+                self._bump(finished[0], 0, -1, -finished[1])
+
+    def _bump(self, seconds, added, finished, pages=0):
+        day = day_of(seconds)
+        for periods, key in ((self.daily, day), (self.monthly, day[:7])):
+            values = periods.setdefault(key, [0, 0, 0])
+            values[0] += added
+            values[1] += finished
+            values[2] += pages
+
+    # {period: {"added", "finished", "pages"}} from the first period with an
+    # event to the one containing `until` (seconds), empty periods included;
+    # `last` keeps only that many periods
+    def series(self, period="month", last=None, until=None):
+        periods = self.monthly if period == "month" else self.daily
+        if not periods:
+            return {}
+        end = day_of(until if until is not None else now())
+        keys = _period_range(min(periods), end[:7] if period == "month" else end, period, last)
+        return {key: dict(zip(MEASURES, periods.get(key, (0, 0, 0)))) for key in keys}
+
+    # Books and pages per period at the pace of the last `days` days, this
+    # year's total at that pace, and how long the unread books would take
+    def pace(self, unread_books, days=PACE_DAYS, until=None):
+        until = until if until is not None else now()
+        first_day = day_of(until - (days - 1) * 86400)
+        recent = [values for day, values in self.daily.items() if first_day <= day <= day_of(until)]
+        finished, pages = sum(values[1] for values in recent), sum(values[2] for values in recent)
+        per_day = finished / days
+        year = day_of(until)[:4]
+        this_year = sum(values[1] for month, values in self.monthly.items() if month.startswith(year))
+        days_left = (datetime(int(year) + 1, 1, 1) - EPOCH).days - until // 86400 - 1
+        return {
+            "days": days,
+            "books_per_month": per_day * DAYS_PER_MONTH,
+            "pages_per_day": pages / days,
+            "finished_this_year": this_year,
+            "projected_this_year": round(this_year + per_day * days_left),
+            "unread_books": unread_books,
+            "months_to_finish_unread": unread_books / (per_day * DAYS_PER_MONTH) if per_day else None,
+        }
+
+    # What the rollups file holds (the finish times are in the finished log)
+    def to_dict(self):
+        return {"offset": self.offset, "daily": self.daily, "monthly": self.monthly}
+
+    @classmethod
+    def from_dict(cls, data):
+        rollups = cls()
+        rollups.offset = data["offset"]
+        rollups.daily = data["daily"]
+        rollups.monthly = data["monthly"]
+        return rollups
+
+    # Snapshot that other sessions' events will not change underneath the
+    # reader, for series() and pace() (without the finish times of the books,
+    # which only apply() needs)
+    def copy(self):
+        rollups = Rollups()
+        rollups.offset = self.offset
+        rollups.daily = {key: list(values) for key, values in self.daily.items()}
+        rollups.monthly = {key: list(values) for key, values in self.monthly.items()}
+        return rollups
+
+
+# "YYYY-MM" months or "YYYY-MM-DD" days from `first` to `last` inclusive, or
+# only the last `count` of them
+def _period_range(first, last, period, count=None):
+    if period == "month":
+        start, end = (int(key[:4]) * 12 + int(key[5:7]) - 1 for key in (first, last))
+        if count is not None:
+            start = max(start, end - count + 1)
+        return [f"{month // 12:04d}-{month % 12 + 1:02d}" for month in range(start, end + 1)]
+    start, end = (date.fromisoformat(key).toordinal() for key in (first, last))
+    if count is not None:
+        start = max(start, end - count + 1)
+    return [date.fromordinal(day).isoformat() for day in range(start, end + 1)]
+
+
+# -------------------- EVENT LOG --------------------
+# One per library file per process (see get_event_log()). Appends are single
+# O_APPEND writes, so processes sharing a library never interleave lines.
+class EventLog:
+    def __init__(self, library_path):
+        self.path = events_path(library_path)
+        self.rollups_path = rollups_path(library_path)
+        self.finished_path = finished_path(library_path)
+        self.lock = threading.Lock()
+        self.rollups = None  # loaded on first read
+
+    # Log the events of a change, then apply them (and any other process's)
+    # to the rollups if they are loaded
+    def record(self, events):
+        if not events:
+            return
+        data = "".join(json.dumps(event, separators=(",", ":")) + "\n" for event in events).encode()
+        with self.lock:
+            descriptor = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(descriptor, data)
+            finally:
+                os.close(descriptor)
+            if self.rollups is not None:
+                self._catch_up(self.rollups)
+
+    def added(self, books):
+        self.record([{"time": added_epoch(book) or now(), "event": "added", "id": book["id"],
+                      "pages": book.get("pages")} for book in books])
+
+    def removed(self, book):
+        self.record([{"time": now(), "event": "removed", "id": book["id"], "pages": book.get("pages")}])
+
+    # `old` is a copy of the book taken before its fields were changed
+    def updated(self, old, new):
+        was_read, is_read = to_bool(old.get("read_status", False)), to_bool(new.get("read_status", False))
+        if was_read != is_read:
+            self.record([{"time": now(), "event": "finished" if is_read else "unfinished", "id": new["id"],
+                          "pages": new.get("pages")}])
+
+    # Up-to-date rollups (a copy); saved when they changed since they were read last
+    def current(self):
+        with self.lock:
+            if self.rollups is None:
+                self.rollups = self._load()
+            self._catch_up(self.rollups)
+            if self.rollups.dirty:
+                atomic_write_json(self.rollups_path, self.rollups.to_dict(), stream=False)
+                self.rollups.dirty = False
+            return self.rollups.copy()
+
+    # Recompute the rollups from the whole log and save them
+    def rebuild(self):
+        with self.lock:
+            self.rollups = self._start_over()
+            self._catch_up(self.rollups)
+            atomic_write_json(self.rollups_path, self.rollups.to_dict(), stream=False)
+            self.rollups.dirty = False
+            return self.rollups.copy()
+
+    # Every event in the log, oldest first
+    def events(self):
+        return self._read(0)[0]
+
+    def _load(self):
+        try:
+            with open(self.rollups_path, "r") as file:
+                data = json.load(file)
+            rollups = Rollups.from_dict(data)
+        except (OSError, ValueError, KeyError):
+            return self._start_over()
+        # A log shorter than what the rollups cover was replaced, and older
+        # rollups files held the finish times themselves: start over
+        if rollups.offset > self._size() or "finished" in data:
+            return self._start_over()
+        rollups.finished = self._read_finished(rollups.offset)
+        return rollups
+
+    # Empty rollups, applied from the start of the log: the finished log is
+    # rewritten as they go
+    def _start_over(self):
+        try:
+            os.remove(self.finished_path)
+        except FileNotFoundError:
+            pass
+        return Rollups()
+
+    # Apply the events appended since `rollups.offset`, then log the changes
+    # to the finish times
+    def _catch_up(self, rollups):
+        if self._size() > rollups.offset:
+            events, rollups.offset = self._read(rollups.offset)
+            for event in events:
+                rollups.apply(event)
+        if rollups.finished_changes:
+            data = "".join(json.dumps([rollups.offset] + change, separators=(",", ":")) + "\n"
+                           for change in rollups.finished_changes).encode()
+            descriptor = os.open(self.finished_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(descriptor, data)
+            finally:
+                os.close(descriptor)
+            rollups.finished_changes = []
+
+    # Book id -> [time, pages] from the finished log, up to event log `offset`.
+    # Processes sharing the library each log the changes of the events they
+    # applied, so lines are replayed in the order of the offsets they cover.
+    def _read_finished(self, offset):
+        finished = {}
+        try:
+            with open(self.finished_path, "rb") as file:
+                lines = file.read().splitlines()
+        except FileNotFoundError:
+            return finished
+        changes = []
+        for line in lines:
+            try:
+                change = json.loads(line)
+            except ValueError:
+                continue  # torn by a crash
+            if change[0] <= offset:
+                changes.append(change)
+        for change in sorted(changes, key=lambda change: change[0]):
+            if len(change) == 4:
+                finished[change[1]] = change[2:]
+            else:
+                finished.pop(change[1], None)
+        return finished
+
+    # Events from byte `offset` on, and the offset after the last complete line
+    def _read(self, offset):
+        try:
+            with open(self.path, "rb") as file:
+                file.seek(offset)
+                data = file.read()
+        except FileNotFoundError:
+            return [], offset
+        end = data.rfind(b"\n") + 1  # a line still being written is left for later
+        events = []
+        for line in data[:end].splitlines():
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue  # torn by a crash
+        return events, offset + end
+
+    def _size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+
+# Event logs already opened in this process, keyed by library path
+_open_logs = {}
+_open_logs_lock = threading.Lock()
+
+
+# The event log of the library at `library_path`, shared by every repository
+# (session) of this process
+def get_event_log(library_path):
+    with _open_logs_lock:
+        key = os.path.abspath(library_path)
+        if key not in _open_logs:
+            _open_logs[key] = EventLog(library_path)
+        return _open_logs[key]
+
+
+# Log an "added" event for every book the log has none for; returns how many
+def backfill(log, books):
+    logged = {event.get("id") for event in log.events() if event.get("event") == "added"}
+    missing = [book for book in books if book["id"] not in logged]
+    log.added(missing)
+    return len(missing)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from storage import LIBRARY_FILE, get_storage
+
+    parser = argparse.ArgumentParser(description="Rebuild the reading rollups from the event log")
+    parser.add_argument("action", choices=["rebuild"])
+    parser.add_argument("library", nargs="?", default=LIBRARY_FILE)
+    parser.add_argument("--backfill", action="store_true",
+                        help="first log an 'added' event (at its date added) for every book without one")
+    args = parser.parse_args()
+
+    storage = get_storage(os.environ.get("LIBRARY_STORAGE", "log"), args.library,
+                          os.environ.get("LIBRARY_FORMAT", "json"))
+    log = get_event_log(storage.path)
+    if args.backfill:
+        print(f"Logged {backfill(log, storage.load()):,} added events")
+    rollups = log.rebuild()
+    print(f"Rebuilt the rollups of {len(log.events()):,} events: {len(rollups.daily):,} days, "
+          f"{len(rollups.monthly):,} months")
@@ -0,0 +1,275 @@
+# Binary record files: a library snapshot that is memory-mapped and decoded lazily
+#
+#   header   magic, record count, log sequence number, section offsets
+#   data     one body per book: its id, its title and (rarely) a JSON object
+#            with the fields that do not fit a column, each length-prefixed
+#   columns  fixed-width arrays: version, flags (read status, which values are
+#            present), publication year, pages, date added (epoch seconds),
+#            and author and genre as positions in the string table
+#   strings  every distinct author and genre, once
+#   index    where each body starts, so book i is found without reading 0..i-1
+#
+# Opening a file maps it and reads only the header and the string table.
+# books() walks the columns to make one LazyBook per record, and a record's
+# body is only decoded when its id or title is needed: the View Library page
+# decodes the books on screen, while sorting, filters, statistics and the
+# analytics frame only use the columns.
+#
+# All numbers are little-endian. Files are written in one pass (the header
+# last) into a temporary file that replaces the snapshot (storage.atomic_write);
+# records still pointing into a replaced file keep reading the old mapping.
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import uuid
+from array import array
+
+from records import Book, gc_paused, to_record
+
+MAGIC = b"PLMLIB\x00\x01"
+COLUMNS = (
+    ("version", "I"), ("flags", "B"), ("publication_year", "i"), ("pages", "i"), ("added", "q"),
+    ("author", "I"), ("genre", "I"),
+)
+# magic, count, seq, strings offset, index offset, one offset per column
+HEADER = struct.Struct("<8s" + "Q" * (4 + len(COLUMNS)))
+BODY = struct.Struct("<III")  # id, title and rest lengths
+NONE = 0xFFFFFFFF             # length or string position of a missing value
+
+# Bits of the flags column
+READ = 1
+HAS_YEAR = 2
+HAS_PAGES = 4
+HAS_ADDED = 8
+HAS_REST = 16  # the body has a JSON object of fields that override the columns
+
+# Integer columns: presence flag and the bound of the column type
+INT_COLUMNS = {"publication_year": (HAS_YEAR, 1 << 31), "pages": (HAS_PAGES, 1 << 31), "added": (HAS_ADDED, 1 << 63)}
+BODY_SLOTS = frozenset(("id", "title", "extra"))
+
+
+def is_record_file(path):
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+# -------------------- WRITING --------------------
+# Write `books` (records or dicts) to the binary file object `file`. Books
+# without an id get one, like storage.assign_ids() does on load.
+def write_records(file, books, seq=0):
+    columns = {name: array(code) for name, code in COLUMNS}
+    versions, all_flags = columns["version"].append, columns["flags"].append
+    strings, string_ids = [], {}
+    index = array("Q")
+    file.write(bytes(HEADER.size))
+    offset = HEADER.size
+    chunk = []
+    for book in books:
+        book = to_record(book)
+        # Unchanged lazy records copy their body as it is
+        source = book.source if type(book) is LazyBook else None
+        body = source.body(book.index) if source is not None and not source.flags[book.index] & HAS_REST else None
+        if body is None and book.id is None:
+            book["id"] = uuid.uuid4().hex
+        flags = book.state & READ
+        rest = {}
+        for name, (flag, bound) in INT_COLUMNS.items():
+            value = getattr(book, name)
+            if type(value) is int and -bound <= value < bound:
+                flags |= flag
+                columns[name].append(value)
+            else:
+                columns[name].append(0)
+                if value is not None:
+                    rest[name] = value
+        for name in ("author", "genre"):
+            value = getattr(book, name)
+            if type(value) is str:
+                position = string_ids.get(value)
+                if position is None:
+                    position = string_ids[value] = len(strings)
+                    strings.append(value)
+            else:
+                position = NONE
+                if value is not None:
+                    rest[name] = value
+            columns[name].append(position)
+        if body is None:
+            body = _encode_body(book, rest)
+            if rest:
+                flags |= HAS_REST
+        versions(book.state >> 1)
+        all_flags(flags)
+        index.append(offset)
+        chunk.append(body)
+        offset += len(body)
+        if len(chunk) == 10000:
+            file.write(b"".join(chunk))
+            chunk = []
+    file.write(b"".join(chunk))
+    index.append(offset)
+
+    column_offsets = []
+    for name, _ in COLUMNS:
+        offset = _pad(file, offset)
+        column_offsets.append(offset)
+        offset += _write_array(file, columns[name])
+    offset = strings_offset = _pad(file, offset)
+    table = [struct.pack("<I", len(strings))]
+    for value in strings:
+        encoded = value.encode()
+        table += [struct.pack("<I", len(encoded)), encoded]
+    offset += file.write(b"".join(table))
+    index_offset = _pad(file, offset)
+    _write_array(file, index)
+    file.seek(0)
+    file.write(HEADER.pack(MAGIC, len(index) - 1, seq or 0, strings_offset, index_offset, *column_offsets))
+
+
+# id and title, plus `rest` (fields that did not fit a column) as JSON
+def _encode_body(book, rest):
+    book_id, title = book.id, book.title
+    if type(book_id) is str and type(title) is str and not rest and not book.extra:
+        book_id, title = book_id.encode(), title.encode()
+        return BODY.pack(len(book_id), len(title), 0) + book_id + title
+    parts = []
+    for name, value in (("id", book_id), ("title", title)):
+        if value is None or type(value) is str:
+            parts.append(value)
+        else:
+            rest[name] = value
+            parts.append(None)
+    if book.extra:
+        rest["extra"] = book.extra
+    encoded = [b"" if value is None else value.encode() for value in parts]
+    encoded.append(json.dumps(rest).encode() if rest else b"")
+    lengths = [NONE if value is None else len(data) for value, data in zip(parts, encoded)]
+    return BODY.pack(*lengths, len(encoded[2])) + b"".join(encoded)
+
+
+# Start the next section on an 8 byte boundary
+def _pad(file, offset):
+    padding = -offset % 8
+    file.write(bytes(padding))
+    return offset + padding
+
+
+def _write_array(file, values):
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return file.write(values.tobytes())
+
+
+# -------------------- READING --------------------
+class RecordFile:
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            if os.name == "nt":
+                # A mapped file cannot be replaced on Windows; read it instead
+                self.data = file.read()
+            else:
+                self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.seq, strings_offset, index_offset, *column_offsets = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a library record file")
+        view = memoryview(self.data)
+        for (name, code), offset in zip(COLUMNS, column_offsets):
+            setattr(self, name, _column(view, offset, code, self.count))
+        self.index = _column(view, index_offset, "Q", self.count + 1)
+        self.strings = self._read_strings(strings_offset)
+        # Sessions may decode the same record at once
+        self.lock = threading.Lock()
+
+    def _read_strings(self, offset):
+        (count,) = struct.unpack_from("<I", self.data, offset)
+        offset += 4
+        strings = []
+        for _ in range(count):
+            (length,) = struct.unpack_from("<I", self.data, offset)
+            strings.append(sys.intern(self.data[offset + 4:offset + 4 + length].decode()))
+            offset += 4 + length
+        return strings
+
+    # One record per book, in file order, with only the columns read
+    def books(self):
+        names = dict(enumerate(self.strings))
+        names[NONE] = None
+        new = LazyBook.__new__
+        books = []
+        rows = zip(self.version, self.flags, self.publication_year, self.pages, self.added, self.author, self.genre)
+        with gc_paused():
+            for i, (version, flags, year, pages, added, author, genre) in enumerate(rows):
+                book = new(LazyBook)
+                book.source = self
+                book.index = i
+                book.state = (version << 1) | (flags & READ)
+                book.author = names[author]
+                book.genre = names[genre]
+                book.publication_year = year if flags & HAS_YEAR else None
+                book.pages = pages if flags & HAS_PAGES else None
+                book.added = added if flags & HAS_ADDED else None
+                if flags & HAS_REST:
+                    self._decode(book)
+                books.append(book)
+        return books
+
+    def body(self, i):
+        return self.data[self.index[i]:self.index[i + 1]]
+
+    # Read the id, title and other fields of `book` from its body and detach
+    # it from the file
+    def decode(self, book):
+        with self.lock:
+            if book.source is not None:
+                self._decode(book)
+
+    def _decode(self, book):
+        start = self.index[book.index]
+        id_length, title_length, rest_length = BODY.unpack_from(self.data, start)
+        position = start + BODY.size
+        book.id = None if id_length == NONE else self.data[position:position + id_length].decode()
+        position += 0 if id_length == NONE else id_length
+        book.title = None if title_length == NONE else self.data[position:position + title_length].decode()
+        position += 0 if title_length == NONE else title_length
+        book.extra = None
+        if rest_length:
+            for name, value in json.loads(self.data[position:position + rest_length]).items():
+                setattr(book, name, value)
+        book.source = None
+
+
+def _column(view, offset, code, count):
+    size = array(code).itemsize
+    data = view[offset:offset + size * count]
+    if sys.byteorder == "little":
+        return data.cast(code)
+    column = array(code, data.tobytes())
+    column.byteswap()
+    return column
+
+
+# A Book whose id, title and extra fields stay in the RecordFile until one of
+# them is read (__getattr__ is only called for slots that are not set yet);
+# changing a field decodes it first.
+class LazyBook(Book):
+    __slots__ = ("source", "index")
+
+    def __getattr__(self, name):
+        if name not in BODY_SLOTS or self.source is None:
+            raise AttributeError(name)
+        self.source.decode(self)
+        return getattr(self, name)
+
+    def __setitem__(self, key, value):
+        if self.source is not None:
+            self.source.decode(self)
+        Book.__setitem__(self, key, value)
+
+
+def read_records(path):
+    records = RecordFile(path)
+    return records.books(), records.seq
@@ -0,0 +1,209 @@
+# Compact in-memory book records
+#
+# A book parsed from JSON is a dict of nine keys with its own copy of every
+# string, about 700 bytes each. Book keeps the same fields in __slots__:
+#   * author and genre are interned, so all books by one author share a string
+#   * date_added is kept as integer seconds since the epoch and formatted back
+#     to "YYYY-mm-dd HH:MM:SS" when read
+#   * read status is bit-packed with the version into one small int
+# which roughly halves the memory per book (see benchmarks/bench_memory.py).
+#
+# Book behaves like a dict for everything the app does with books:
+# book["title"], book.get("pages", 0), "id" in book, book.update(...),
+# book.setdefault(...), dict(book), iterating keys/items. Two records are
+# only equal if they are the same object. JSON writers serialize it through
+# to_dict() (see storage.json_default).
+import gc
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+EPOCH = datetime(1970, 1, 1)
+
+# Keys stored as they are in a slot of the same name
+PLAIN_SLOTS = {"id", "title", "publication_year", "pages"}
+INTERNED_SLOTS = {"author", "genre"}
+KNOWN_KEYS = PLAIN_SLOTS | INTERNED_SLOTS | {"read_status", "version", "date_added", "addad_data"}
+
+
+# Older records store read_status as the strings "true"/"false"
+def to_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "yes", "read")
+    return bool(value)
+
+
+# "2024-01-31 18:05:00" -> seconds since the epoch; other values are kept as they are
+def parse_date(value):
+    if isinstance(value, str) and len(value) == 19 and value[10] == " " and value[13] == ":" and value[16] == ":":
+        try:
+            return int((datetime.fromisoformat(value) - EPOCH).total_seconds())
+        except (TypeError, ValueError):
+            return value
+    return value
+
+
+def format_date(value):
+    if isinstance(value, int):
+        return time.strftime(DATE_FORMAT, time.gmtime(value))
+    return value
+
+
+# Slots hold None for a key the book does not have
+class Book:
+    __slots__ = ("id", "title", "author", "genre", "publication_year", "pages", "added", "state", "extra")
+
+    def __init__(self, fields=()):
+        self.id = self.title = self.author = self.genre = None
+        self.publication_year = self.pages = self.added = self.extra = None
+        self.state = 1 << 1  # version 1, not read
+        self.update(fields)
+
+    def __getitem__(self, key):
+        if key in PLAIN_SLOTS or key in INTERNED_SLOTS:
+            value = getattr(self, key)
+        elif key == "read_status":
+            return bool(self.state & 1)
+        elif key == "version":
+            return self.state >> 1
+        elif key == "date_added":
+            value = format_date(self.added)
+        else:
+            value = self.extra.get(key) if self.extra else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in PLAIN_SLOTS:
+            setattr(self, key, value)
+        elif key in INTERNED_SLOTS:
+            setattr(self, key, sys.intern(value) if isinstance(value, str) else value)
+        elif key == "read_status":
+            self.state = (self.state & ~1) | to_bool(value)
+        elif key == "version":
+            self.state = (value << 1) | (self.state & 1)
+        elif key == "date_added":
+            self.added = parse_date(value)
+        elif key == "addad_data":
+            # Older records call this field "addad_data"
+            if self.added is None:
+                self.added = parse_date(value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    # Faster than Book(data) for the bulk conversion of a loaded library
+    @classmethod
+    def from_dict(cls, data):
+        book = cls.__new__(cls)
+        book.id = data.get("id")
+        book.title = data.get("title")
+        author, genre = data.get("author"), data.get("genre")
+        book.author = sys.intern(author) if isinstance(author, str) else author
+        book.genre = sys.intern(genre) if isinstance(genre, str) else genre
+        book.publication_year = data.get("publication_year")
+        book.pages = data.get("pages")
+        book.added = parse_date(data.get("date_added", data.get("addad_data")))
+        read = data.get("read_status", False)
+        book.state = (data.get("version", 1) << 1) | (read if read.__class__ is bool else to_bool(read))
+        book.extra = None
+        if not data.keys() <= KNOWN_KEYS:
+            book.extra = {key: data[key] for key in data.keys() - KNOWN_KEYS}
+        return book
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.to_dict())
+
+    def __len__(self):
+        return len(self.to_dict())
+
+    def keys(self):
+        return self.to_dict().keys()
+
+    def values(self):
+        return self.to_dict().values()
+
+    def items(self):
+        return self.to_dict().items()
+
+    def update(self, fields=(), **more):
+        for key, value in (fields.items() if hasattr(fields, "items") else fields):
+            self[key] = value
+        for key, value in more.items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    # Plain dict with the keys in their usual order
+    def to_dict(self):
+        book = {}
+        if self.id is not None:
+            book["id"] = self.id
+        book["version"] = self.state >> 1
+        for key in ("title", "author", "publication_year", "genre"):
+            value = getattr(self, key)
+            if value is not None:
+                book[key] = value
+        book["read_status"] = bool(self.state & 1)
+        if self.pages is not None:
+            book["pages"] = self.pages
+        if self.added is not None:
+            book["date_added"] = format_date(self.added)
+        if self.extra:
+            book.update(self.extra)
+        return book
+
+    def __repr__(self):
+        return f"Book({self.to_dict()!r})"
+
+
+def to_record(book):
+    return book if isinstance(book, Book) else Book.from_dict(book)
+
+
+# Pause the cyclic garbage collector while allocating many records: it would
+# otherwise rescan the growing heap many times over while a million of them
+# are created (none form cycles)
+@contextmanager
+def gc_paused():
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+# Convert a freshly loaded list of dicts in place
+def compact_books(books):
+    with gc_paused():
+        books[:] = [to_record(book) for book in books]
+    return books
+
+
+# Seconds since the epoch a book was added (None if unknown), without
+# formatting and re-parsing the date string for compact records
+def added_epoch(book):
+    value = book.added if isinstance(book, Book) else parse_date(book.get("date_added", book.get("addad_data")))
+    return value if isinstance(value, int) else None
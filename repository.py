@@ -0,0 +1,446 @@
+# Repository: the one API the UI uses to read and change books
+#
+# For the JSON backends the books live in memory (as compact records.Book
+# objects) and queries run in Python.
+# For the SQLite backend nothing is kept in memory and every query, count and
+# group-by is pushed down to the database.
+#
+# Supported filters (all optional, combined with AND):
+#   author, genre, read_status            exact match
+#   year_min, year_max                    publication year range (inclusive)
+#   title_contains, author_contains,
+#   genre_contains                        case-insensitive substring
+#   id_after                              ids greater than this one (with
+#                                         order_by="id", the next page after it)
+#
+# Books are addressed by their "id". remove() and update() take the "version"
+# the caller last saw and raise ConflictError if the book changed since, so a
+# session acting on a stale page never overwrites someone else's change.
+import heapq
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+
+from library_cache import shared_cache
+from library_stats import LibraryStats, load_stats, save_stats, stats_path
+from query_cache import id_list, query_key, row_list, shared_queries, shorter_queries
+from reading_log import get_event_log
+from records import Book, added_epoch, compact_books, to_record
+from search_index import SearchIndex
+from storage import ConflictError, new_id, to_bool, write_locked
+
+SORT_KEYS = ("title", "author", "publication_year", "date_added")
+
+
+# Value used when grouping/sorting in memory, mirroring storage.SQL_EXPRESSIONS
+def field_value(book, field):
+    if field == "decade":
+        return (book["publication_year"] // 10) * 10
+    if field == "read_status":
+        return to_bool(book.get("read_status", False))
+    if field == "pages":
+        return book.get("pages", 0) or 0
+    if field == "date_added" and isinstance(book, Book):
+        # Records keep it as epoch seconds: same order, nothing to format
+        return added_epoch(book)
+    return book.get(field)
+
+
+# Check one in-memory book against repository filters
+def matches(book, filters):
+    for key, value in (filters or {}).items():
+        if value is None:
+            continue
+        if key in ("author", "genre"):
+            if book.get(key) != value:
+                return False
+        elif key == "read_status":
+            if to_bool(book.get("read_status", False)) != to_bool(value):
+                return False
+        elif key == "year_min":
+            if book.get("publication_year", 0) < value:
+                return False
+        elif key == "year_max":
+            if book.get("publication_year", 0) > value:
+                return False
+        elif key.endswith("_contains"):
+            if str(value).lower() not in str(book.get(key[: -len("_contains")], "")).lower():
+                return False
+        elif key == "id_after":
+            if book["id"] <= value:
+                return False
+    return True
+
+
+def index_by_id(books):
+    return {book["id"]: book for book in books}
+
+
+# Where each book sits in the in-memory list, for removing one without
+# scanning the whole list. Removing shifts the books after it down by one, so
+# a recorded position is only an upper bound: the book is at most `removed`
+# places earlier. The map is rebuilt once that window gets long.
+class BookPositions:
+    MAX_WINDOW = 1024
+
+    def __init__(self, books):
+        self.books = books
+        self.rebuild()
+
+    def rebuild(self):
+        self.positions = {book["id"]: n for n, book in enumerate(self.books)}
+        self.removed = 0
+
+    def added(self, book, position):
+        self.positions[book["id"]] = position
+
+    # Delete `book` from the list, keeping the order of the others
+    def remove(self, book):
+        position = self.positions.pop(book["id"])
+        position = self.books.index(book, max(0, position - self.removed), position + 1)
+        del self.books[position]
+        self.removed += 1
+        if self.removed >= self.MAX_WINDOW:
+            self.rebuild()
+
+
+class LibraryRepository:
+    # `writer` is an optional write-behind queue (write_behind.py) that takes
+    # the storage writes for the in-memory backends; `queries` caches search
+    # results (query_cache.py); `events` logs every change for the reading
+    # history (reading_log.py, by default the library's shared log)
+    def __init__(self, storage, cache=shared_cache, writer=None, queries=shared_queries, events=None):
+        self.storage = storage
+        self.cache = cache
+        self.queries = queries
+        self.events = events if events is not None else get_event_log(storage.path)
+        self.writer = writer
+        self.writes = writer if writer is not None else storage
+        self.books = []
+        # Backends that can answer queries themselves (SQLite) keep no in-memory copy
+        self.in_database = hasattr(storage, "query")
+
+    # Load the books; in-memory backends share one parsed copy per process
+    def load(self):
+        if not self.storage.exists() and not self._pending():
+            return False
+        if not self.in_database:
+            with self.storage.lock:
+                self._sync()
+        return True
+
+    # Pick up the current books. Queued changes are written first if another
+    # process changed the files, so re-reading them does not drop ours.
+    def _sync(self):
+        if self._pending() and self.cache.fingerprint(self.storage, self.books) != self.storage.fingerprint():
+            self.writer.flush()
+        self.books = self.cache.load(self.storage, compact_books)
+
+    def _pending(self):
+        return self.writer is not None and self.writer.pending_count() > 0
+
+    # Rewrite everything (only meaningful for in-memory backends)
+    def save(self):
+        if not self.in_database:
+            with write_locked(self.storage):
+                if self.writer is not None:
+                    self.writer.flush()
+                self.storage.save(self.books)
+                self.cache.refresh(self.storage, self.books)
+                stats = self._built_stats()
+                if stats is not None:
+                    save_stats(stats_path(self.storage.path), stats, self.storage.fingerprint())
+
+    # In-memory writes run under the storage locks, on the latest data (another
+    # process may have written the files), and refresh the cache afterwards
+    @contextmanager
+    def _writing(self):
+        with write_locked(self.storage):
+            self._sync()
+            yield
+            self.cache.refresh(self.storage, self.books)
+
+    # Add a new book; it gets its id and version here
+    def add(self, book):
+        self.add_many([book])
+
+    # Add several books with one storage write
+    def add_many(self, new_books):
+        if not new_books:
+            return
+        for book in new_books:
+            book.setdefault("id", new_id())
+            book.setdefault("version", 1)
+        if self.in_database:
+            self.storage.add_many(self.books, new_books)
+            self.queries.changed(self.storage.path)
+            self.events.added(new_books)
+            return
+        new_books = [to_record(book) for book in new_books]
+        with self._writing():
+            start = len(self.books)
+            self.books.extend(new_books)
+            ids = self.cache.built_extra(self.storage, self.books, "ids")
+            positions = self.cache.built_extra(self.storage, self.books, "positions")
+            id_order = self.cache.built_extra(self.storage, self.books, "id_order")
+            index = self._built_index()
+            stats = self._built_stats()
+            for position, book in enumerate(new_books, start):
+                if ids is not None:
+                    ids[book["id"]] = book
+                if positions is not None:
+                    positions.added(book, position)
+                if id_order is not None:
+                    insort(id_order, book["id"])
+                if index is not None:
+                    index.add(book)
+                if stats is not None:
+                    stats.add(book)
+            self.writes.add_many(self.books, new_books)
+        self.events.added(new_books)
+
+    # Remove a book. Returns False if it is already gone; raises ConflictError
+    # if `expected_version` is given and the book has changed since.
+    def remove(self, book_id, expected_version=None):
+        if self.in_database:
+            try:
+                removed = self.storage.remove(self.books, book_id, expected_version)
+            finally:
+                self.queries.changed(self.storage.path)
+            if removed:
+                self.events.removed({"id": book_id})
+            return removed
+        with self._writing():
+            book = self._find(book_id, expected_version)
+            if book is None:
+                return False
+            self._positions().remove(book)
+            del self._ids()[book_id]
+            id_order = self.cache.built_extra(self.storage, self.books, "id_order")
+            if id_order is not None:
+                del id_order[bisect_left(id_order, book_id)]
+            search_index = self._built_index()
+            if search_index is not None:
+                search_index.remove(book_id)
+            stats = self._built_stats()
+            if stats is not None:
+                stats.remove(book)
+            self.writes.remove(self.books, book_id, book.get("version", 1))
+        self.events.removed(book)
+        return True
+
+    # Change some fields of a book and bump its version (same return values
+    # and conflict check as remove())
+    def update(self, book_id, fields, expected_version=None):
+        if self.in_database:
+            # The book as it was, for the read status event
+            old = self.storage.get(book_id) if "read_status" in fields else None
+            try:
+                updated = self.storage.update(self.books, book_id, fields, expected_version)
+            finally:
+                self.queries.changed(self.storage.path)
+            if updated and old is not None:
+                self.events.updated(old, dict(old, **fields))
+            return updated
+        with self._writing():
+            book = self._find(book_id, expected_version)
+            if book is None:
+                return False
+            old = dict(book)
+            changes = dict(fields, version=book.get("version", 1) + 1)
+            book.update(changes)
+            search_index = self._built_index()
+            if search_index is not None:
+                search_index.update(book_id)
+            stats = self._built_stats()
+            if stats is not None:
+                stats.update(old, book)
+            self.writes.update(self.books, book_id, changes, old.get("version", 1))
+        self.events.updated(old, book)
+        return True
+
+    # The book with `book_id`, or None
+    def get(self, book_id):
+        if self.in_database:
+            return self.storage.get(book_id)
+        return self._ids().get(book_id)
+
+    # The book with `book_id` (None if missing), checked against `expected_version`
+    def _find(self, book_id, expected_version):
+        book = self._ids().get(book_id)
+        if book is not None and expected_version is not None and book.get("version", 1) != expected_version:
+            raise ConflictError(f"Book {book_id} was changed by someone else")
+        return book
+
+    # id -> book for the in-memory books, shared through the cache
+    def _ids(self):
+        return self.cache.extra(self.storage, self.books, "ids", index_by_id)
+
+    # Positions of the in-memory books (BookPositions), for removing one
+    def _positions(self):
+        return self.cache.extra(self.storage, self.books, "positions", BookPositions)
+
+    # The ids sorted, for pages in id order (see query())
+    def _id_order(self):
+        return self.cache.extra(self.storage, self.books, "id_order", lambda books: sorted(book["id"] for book in books))
+
+    # Aggregated statistics (LibraryStats). In memory they are maintained
+    # incrementally and saved next to the library when read after a change;
+    # for the database backend they come from indexed GROUP BY queries.
+    def stats(self):
+        if self.in_database:
+            stats = LibraryStats()
+            stats.total_books = self.storage.count()
+            stats.read_books = self.storage.count({"read_status": True})
+            stats.total_pages = self.storage.sum("pages")
+            stats.genres = self.storage.group_count("genre")
+            stats.authors = self.storage.group_count("author")
+            stats.decades = {decade: count for decade, count in self.storage.group_count("decade").items()
+                             if decade is not None}
+            return stats
+        with self.storage.lock:
+            stats = self.cache.extra(self.storage, self.books, "stats", self._load_stats)
+            # Saved under the fingerprint of the data they were computed from,
+            # which may already be older than the files if another process
+            # wrote, and only once queued changes are on disk too
+            fingerprint = self.cache.fingerprint(self.storage, self.books)
+            if stats.dirty and fingerprint is not None and not self._pending():
+                save_stats(stats_path(self.storage.path), stats, fingerprint)
+            return stats.copy()
+
+    # Saved aggregates if they match the loaded data, else a full recompute
+    def _load_stats(self, books):
+        path = stats_path(self.storage.path)
+        fingerprint = self.cache.fingerprint(self.storage, books)
+        stats = load_stats(path, fingerprint) if fingerprint is not None else None
+        if stats is None:
+            stats = LibraryStats.from_books(books)
+            if fingerprint is not None:
+                save_stats(path, stats, fingerprint)
+        return stats
+
+    def _built_stats(self):
+        return self.cache.built_extra(self.storage, self.books, "stats")
+
+    # Ranked search, every criterion must match (see SearchIndex.search):
+    # title/author/genre are case-insensitive substrings, plus optional
+    # year_min/year_max and read_status. fuzzy=1 or 2 also matches the text
+    # criteria with that many typos per word (in memory only; the database
+    # matches substrings). Returns a list of books.
+    # Results are cached for all sessions until a change could affect them.
+    def search(self, limit=None, **criteria):
+        if self.in_database:
+            criteria.pop("fuzzy", None)
+        key = query_key(self.storage.path, criteria, limit)
+        if self.in_database:
+            stamp = (self.storage.fingerprint(), self.queries.written(self.storage.path))
+            rows = self.queries.get(key, stamp)
+            if rows is None:
+                filters = {
+                    (f"{name}_contains" if name in ("title", "author", "genre") else name): value
+                    for name, value in criteria.items()
+                }
+                rows, size = row_list(self.storage.query(filters, limit=limit))
+                self.queries.put(key, stamp, rows, size)
+            return list(rows)
+        # Other sessions may be updating the index
+        with self.storage.lock:
+            index = self._index()
+            stamp = index.stamp(criteria, limit)
+            doc_ids = self.queries.get(key, stamp)
+            if doc_ids is None:
+                doc_ids, size = id_list(index.search_ids(limit=limit, within=self._shorter_results(criteria, limit, stamp),
+                                                         **criteria))
+                self.queries.put(key, stamp, doc_ids, size)
+            return index.books(doc_ids)
+
+    # Cached results of the same search with a shorter text term (they include
+    # every result of this one), or None
+    def _shorter_results(self, criteria, limit, stamp):
+        if limit is not None or criteria.get("fuzzy"):
+            # A typo match for "dune" ("dene") need not be one for "dun"
+            return None
+        for shorter in shorter_queries(criteria):
+            doc_ids = self.queries.get_shorter(query_key(self.storage.path, shorter), stamp)
+            if doc_ids is not None:
+                return doc_ids
+        return None
+
+    # Search index over the in-memory books, shared through the cache
+    def _index(self):
+        return self.cache.extra(self.storage, self.books, "search_index", SearchIndex)
+
+    def _built_index(self):
+        return self.cache.built_extra(self.storage, self.books, "search_index")
+
+    # Data version: changes whenever the library changes, also when a change
+    # is still queued in the write-behind buffer
+    def version(self):
+        if self.in_database:
+            return self.storage.fingerprint()
+        return self.storage.fingerprint(), self.cache.written(self.storage)
+
+    # Every book as a list (reads the whole table for the database backend)
+    def all_books(self):
+        if self.in_database:
+            return self.storage.load()
+        return self.books
+
+    # Return the matching books, sorted and paginated
+    def query(self, filters=None, order_by=None, descending=False, limit=None, offset=0):
+        if self.in_database:
+            return self.storage.query(filters, order_by, descending, limit, offset)
+        if order_by == "id" and not descending and limit is not None:
+            return self._id_page(filters, limit, offset)
+        rows = [book for book in self.books if matches(book, filters)] if filters else list(self.books)
+        if order_by:
+            def sort_key(book):
+                value = field_value(book, order_by)
+                return (value is None, value)
+            if limit is not None:
+                # Only the rows up to the requested page have to be ordered
+                pick = heapq.nlargest if descending else heapq.nsmallest
+                rows = pick(offset + limit, rows, key=sort_key)
+            else:
+                rows.sort(key=sort_key, reverse=descending)
+        if limit is not None:
+            rows = rows[offset:offset + limit]
+        return rows
+
+    # A page in id order: walks the sorted ids from `id_after` until the page
+    # is full, instead of filtering and ordering every book
+    def _id_page(self, filters, limit, offset):
+        filters = dict(filters or {})
+        after = filters.pop("id_after", None)
+        rows = []
+        with self.storage.lock:
+            id_order, ids = self._id_order(), self._ids()
+            position = bisect_right(id_order, after) if after is not None else 0
+            while position < len(id_order) and len(rows) < offset + limit:
+                book = ids[id_order[position]]
+                if matches(book, filters):
+                    rows.append(book)
+                position += 1
+        return rows[offset:]
+
+    def count(self, filters=None):
+        if self.in_database:
+            return self.storage.count(filters)
+        if not filters:
+            return len(self.books)
+        return sum(1 for book in self.books if matches(book, filters))
+
+    def sum(self, field, filters=None):
+        if self.in_database:
+            return self.storage.sum(field, filters)
+        return sum(field_value(book, field) for book in self.books if matches(book, filters))
+
+    # Return {value: count} for a field or "decade"
+    def group_count(self, field, filters=None):
+        if self.in_database:
+            return self.storage.group_count(field, filters)
+        counts = {}
+        for book in self.books:
+            if matches(book, filters):
+                value = field_value(book, field)
+                counts[value] = counts.get(value, 0) + 1
+        return counts
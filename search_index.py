@@ -0,0 +1,406 @@
+# In-memory search index for the JSON backends
+#
+# Answers exactly what the old search_books() loop answered - a
+# case-insensitive substring test on title, author or genre - without looking
+# at every book:
+#   * every distinct lowercased field value is indexed by its trigrams, so a
+#     term of 3+ characters only has to be verified against the values that
+#     contain all of its trigrams (terms of 1-2 characters scan the distinct
+#     values, which is still far fewer than the books for author and genre)
+#   * a token (word) inverted index is used for ranking whole-word matches
+#   * publication year and read status have their own postings so range and
+#     status filters can be combined with text criteria
+#   * for typo-tolerant search (fuzzy=1 or 2), the distinct words of a field
+#     get a deletion dictionary (fuzzy.py), built on the first fuzzy search
+#     and then kept up to date as words come and go
+#
+# Documents get an internal id in library order, so sorting by id keeps the
+# library order for results with equal score. The index is updated
+# incrementally by LibraryRepository on add/remove/update, by book id.
+#
+# Document ids are never reused, so a list of them (search_ids()) stays a
+# valid result after unrelated changes: stamp() tells which changes a query
+# depends on, and query_cache.py keeps results until their stamp changes.
+import bisect
+import heapq
+import re
+
+from fuzzy import MAX_DISTANCE, DeletionIndex, allowed_distance
+from storage import to_bool
+
+TEXT_FIELDS = ("title", "author", "genre")
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Score of one matching field, best match type first
+SCORE_EXACT = 3.0
+SCORE_WORD = 2.0
+SCORE_PREFIX = 1.5
+SCORE_SUBSTRING = 1.0
+
+# Keep intersecting postings while more candidates than this remain, using
+# text criteria that match at most this many distinct values
+NARROW_THRESHOLD = 64
+NARROW_MAX_VALUES = 16
+
+# Indexed key each search criterion looks at (see SearchIndex.stamp())
+CRITERIA_KEYS = {
+    "title": "title", "author": "author", "genre": "genre",
+    "year_min": "year", "year_max": "year", "read_status": "read", "fuzzy": None,
+}
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def tokenize(text):
+    return set(TOKEN_PATTERN.findall(text))
+
+
+# Postings for one text field: distinct values -> documents, plus trigram and
+# token postings over the distinct values
+class FieldIndex:
+    def __init__(self):
+        self.value_docs = {}  # lowercased value -> set of doc ids
+        self.grams = {}       # trigram -> set of values
+        self.tokens = {}      # token -> set of values
+        self.fuzzy = None     # DeletionIndex over the tokens, once a fuzzy search needs it
+        self.doc_count = 0
+
+    def add(self, value, doc_id):
+        self.doc_count += 1
+        docs = self.value_docs.get(value)
+        if docs is None:
+            docs = self.value_docs[value] = set()
+            for gram in trigrams(value):
+                self.grams.setdefault(gram, set()).add(value)
+            for token in tokenize(value):
+                values = self.tokens.get(token)
+                if values is None:
+                    values = self.tokens[token] = set()
+                    if self.fuzzy is not None:
+                        self.fuzzy.add(token)
+                values.add(value)
+        docs.add(doc_id)
+
+    def remove(self, value, doc_id):
+        docs = self.value_docs.get(value)
+        if docs is None or doc_id not in docs:
+            return
+        self.doc_count -= 1
+        docs.discard(doc_id)
+        if docs:
+            return
+        del self.value_docs[value]
+        for gram in trigrams(value):
+            self._discard(self.grams, gram, value)
+        for token in tokenize(value):
+            if self._discard(self.tokens, token, value) and self.fuzzy is not None:
+                self.fuzzy.remove(token)
+
+    # Distinct values that contain `term` as a substring
+    def matching_values(self, term):
+        if not term:
+            return list(self.value_docs)
+        if len(term) < 3:
+            return [value for value in self.value_docs if term in value]
+        postings = []
+        for gram in trigrams(term):
+            values = self.grams.get(gram)
+            if not values:
+                return []
+            postings.append(values)
+        postings.sort(key=len)
+        candidates = postings[0].intersection(*postings[1:]) if len(postings) > 1 else postings[0]
+        if len(term) == 3:
+            return list(candidates)
+        return [value for value in candidates if term in value]
+
+    # Distinct values matching `term` with typos: {value: edit distance}. Every
+    # word of the term must be within its allowed distance (fuzzy.allowed_distance())
+    # of a word of the value, and the distances are summed; values containing
+    # `term` as it is have distance 0.
+    def fuzzy_values(self, term, max_distance):
+        result = dict.fromkeys(self.matching_values(term), 0)
+        words = TOKEN_PATTERN.findall(term)
+        if not words:
+            return result
+        if self.fuzzy is None:
+            self.fuzzy = DeletionIndex(self.tokens)
+        word_matches = []
+        for word in words:
+            distance = allowed_distance(word, max_distance)
+            tokens = self.fuzzy.lookup(word, distance) if distance else {}
+            if word in self.tokens:
+                tokens[word] = 0
+            values = {}
+            for token, token_distance in tokens.items():
+                for value in self.tokens[token]:
+                    if token_distance < values.get(value, distance + 1):
+                        values[value] = token_distance
+            word_matches.append(values)
+        word_matches.sort(key=len)
+        for value, total in word_matches[0].items():
+            for values in word_matches[1:]:
+                if value not in values:
+                    break
+                total += values[value]
+            else:
+                result.setdefault(value, total)
+        return result
+
+    # Rough number of documents containing `term`: values sharing its rarest
+    # trigram times the average documents per value (no verification)
+    def estimate(self, term):
+        if not self.value_docs:
+            return 0
+        return self.estimate_values(term) * self.doc_count / len(self.value_docs)
+
+    # Upper bound on the number of distinct values containing `term`
+    def estimate_values(self, term):
+        if len(term) < 3:
+            return len(self.value_docs)
+        return min(len(self.grams.get(gram, ())) for gram in trigrams(term))
+
+    # How well `value` matches `term` (it is already known to contain it)
+    def score(self, value, term):
+        if value == term:
+            return SCORE_EXACT
+        if value in self.tokens.get(term, ()):
+            return SCORE_WORD
+        if value.startswith(term):
+            return SCORE_PREFIX
+        return SCORE_SUBSTRING
+
+    # Remove `value` from the postings of `key`; True if that was the last one
+    def _discard(self, postings, key, value):
+        values = postings.get(key)
+        if values is not None:
+            values.discard(value)
+            if not values:
+                del postings[key]
+                return True
+        return False
+
+
+class SearchIndex:
+    def __init__(self, books=()):
+        self.fields = {field: FieldIndex() for field in TEXT_FIELDS}
+        self.docs = {}     # doc id -> (book, indexed keys)
+        self.doc_ids = {}  # book id -> doc id
+        self.next_id = 0
+        self.year_docs = {}   # publication year -> set of doc ids
+        self.years = []       # sorted distinct years
+        self.read_docs = {True: set(), False: set()}
+        # Change counters: "docs" counts added books, "removed" removed ones and
+        # the others count updates that changed that indexed key
+        self.changes = dict.fromkeys(("docs", "removed", "title", "author", "genre", "year", "read"), 0)
+        self.token = object()  # tells this index apart from one built after a reload
+        for book in books:
+            self.add(book)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, book):
+        doc_id = self.next_id
+        self.next_id += 1
+        self.doc_ids[book.get("id")] = doc_id
+        self._index(doc_id, book)
+        self.changes["docs"] += 1
+        return doc_id
+
+    def remove(self, book_id):
+        doc_id = self.doc_ids.pop(book_id)
+        self._unindex(doc_id)
+        del self.docs[doc_id]
+        self.changes["removed"] += 1
+
+    # Re-index a book after its fields were changed in place
+    def update(self, book_id):
+        doc_id = self.doc_ids[book_id]
+        book, old_keys = self.docs[doc_id]
+        self._unindex(doc_id)
+        self._index(doc_id, book)
+        new_keys = self.docs[doc_id][1]
+        for key, value in new_keys.items():
+            if old_keys[key] != value:
+                self.changes[key] += 1
+
+    # What the results of a search with `criteria` depend on: this index, the
+    # books added to it and the keys the criteria look at. Results without a
+    # limit do not depend on removals, as removed ids are skipped by books().
+    def stamp(self, criteria, limit=None):
+        keys = {CRITERIA_KEYS[name] for name, value in criteria.items() if value is not None} - {None}
+        if limit is not None:
+            keys.add("removed")
+        return (self.token, self.changes["docs"]) + tuple(self.changes[key] for key in sorted(keys))
+
+    # The books with these document ids, skipping removed ones
+    def books(self, doc_ids):
+        docs = self.docs
+        return [docs[doc_id][0] for doc_id in doc_ids if doc_id in docs]
+
+    # Books matching every given criterion, best score first (ties keep library order).
+    # title/author/genre are substrings, as in the original search_books().
+    def search(self, limit=None, **criteria):
+        return self.books(self.search_ids(limit=limit, **criteria))
+
+    # Document ids of the books search() returns. `within` limits the search to
+    # these document ids, e.g. the results of a shorter term: any value
+    # containing "dune" also contains "dun". With `fuzzy` (a maximum edit
+    # distance), the text criteria also match with typos (see _fuzzy_ids()).
+    def search_ids(self, title=None, author=None, genre=None, year_min=None, year_max=None,
+                   read_status=None, limit=None, within=None, fuzzy=None):
+        terms = {
+            field: term.lower()
+            for field, term in (("title", title), ("author", author), ("genre", genre))
+            if term is not None
+        }
+        if fuzzy and terms:
+            return self._fuzzy_ids(terms, fuzzy, year_min, year_max, read_status, limit)
+
+        # Drive the search from the most selective criterion (estimated from
+        # postings sizes) and verify the others against each candidate's
+        # indexed keys
+        drivers = [(self.fields[field].estimate(term), "text", field) for field, term in terms.items()]
+        if year_min is not None or year_max is not None:
+            drivers.append((sum(len(self.year_docs[year]) for year in self._years_in(year_min, year_max)), "year", None))
+        if read_status is not None:
+            drivers.append((len(self.read_docs[to_bool(read_status)]), "read", None))
+
+        if within is not None:
+            candidates = [doc_id for doc_id in within if doc_id in self.docs]
+        elif not drivers:
+            candidates = self.docs
+        else:
+            drivers.sort(key=lambda driver: driver[0])
+            candidates = self._criterion_docs(drivers[0], terms, year_min, year_max, read_status)
+            # Narrow down with cheap set intersections while the candidate set is
+            # still large; whatever is left is verified per candidate below
+            for driver in drivers[1:]:
+                if len(candidates) < NARROW_THRESHOLD:
+                    break
+                _, kind, field = driver
+                if kind == "read":
+                    candidates = candidates & self.read_docs[to_bool(read_status)]
+                elif kind == "text" and self.fields[field].estimate_values(terms[field]) <= NARROW_MAX_VALUES:
+                    index = self.fields[field]
+                    docs = self._union(index.value_docs[value] for value in index.matching_values(terms[field]))
+                    candidates = candidates & docs
+
+        status = None if read_status is None else to_bool(read_status)
+        scores = {}
+        for doc_id in candidates:
+            keys = self.docs[doc_id][1]
+            if not _in_filters(keys, status, year_min, year_max):
+                continue
+            score = 0.0
+            for field, term in terms.items():
+                value = keys[field]
+                if term not in value:
+                    break
+                score += self.fields[field].score(value, term)
+            else:
+                scores[doc_id] = score
+
+        if limit is not None:
+            return heapq.nsmallest(limit, scores, key=lambda d: (-scores[d], d))
+        return sorted(scores, key=lambda d: (-scores[d], d))
+
+    # Ranked document ids for text terms matched with up to `max_distance` typos
+    # per word: fewest edits first, then the usual score, then library order
+    def _fuzzy_ids(self, terms, max_distance, year_min, year_max, read_status, limit):
+        if max_distance > MAX_DISTANCE:
+            raise ValueError(f"Fuzzy search allows at most {MAX_DISTANCE} typos per word")
+        matches = {field: self.fields[field].fuzzy_values(term, max_distance) for field, term in terms.items()}
+        driver = min(matches, key=lambda field: len(matches[field]))
+        candidates = self._union(self.fields[driver].value_docs[value] for value in matches[driver])
+        status = None if read_status is None else to_bool(read_status)
+        ranks = {}
+        for doc_id in candidates:
+            keys = self.docs[doc_id][1]
+            if not _in_filters(keys, status, year_min, year_max):
+                continue
+            distance, score = 0, 0.0
+            for field, term in terms.items():
+                value = keys[field]
+                if value not in matches[field]:
+                    break
+                distance += matches[field][value]
+                if term in value:
+                    score += self.fields[field].score(value, term)
+            else:
+                ranks[doc_id] = (distance, -score, doc_id)
+        if limit is not None:
+            return heapq.nsmallest(limit, ranks, key=ranks.get)
+        return sorted(ranks, key=ranks.get)
+
+    # Documents matching one criterion (see the drivers in search_ids())
+    def _criterion_docs(self, driver, terms, year_min, year_max, read_status):
+        _, kind, field = driver
+        if kind == "text":
+            index = self.fields[field]
+            return self._union(index.value_docs[value] for value in index.matching_values(terms[field]))
+        if kind == "year":
+            return self._union(self.year_docs[year] for year in self._years_in(year_min, year_max))
+        return self.read_docs[to_bool(read_status)]
+
+    # Union of doc id sets; a single set is returned as is (callers never mutate it)
+    def _union(self, sets):
+        result = None
+        copied = False
+        for docs in sets:
+            if result is None:
+                result = docs
+            elif not copied:
+                result = result | docs
+                copied = True
+            else:
+                result |= docs
+        return set() if result is None else result
+
+    # Distinct indexed years within the (inclusive) range
+    def _years_in(self, year_min, year_max):
+        low = 0 if year_min is None else bisect.bisect_left(self.years, year_min)
+        high = len(self.years) if year_max is None else bisect.bisect_right(self.years, year_max)
+        return self.years[low:high]
+
+    def _index(self, doc_id, book):
+        keys = {field: str(book.get(field, "")).lower() for field in TEXT_FIELDS}
+        keys["year"] = book.get("publication_year")
+        keys["read"] = to_bool(book.get("read_status", False))
+        for field in TEXT_FIELDS:
+            self.fields[field].add(keys[field], doc_id)
+        if keys["year"] not in self.year_docs:
+            self.year_docs[keys["year"]] = set()
+            if keys["year"] is not None:
+                bisect.insort(self.years, keys["year"])
+        self.year_docs[keys["year"]].add(doc_id)
+        self.read_docs[keys["read"]].add(doc_id)
+        self.docs[doc_id] = (book, keys)
+
+    def _unindex(self, doc_id):
+        _, keys = self.docs[doc_id]
+        for field in TEXT_FIELDS:
+            self.fields[field].remove(keys[field], doc_id)
+        year_docs = self.year_docs[keys["year"]]
+        year_docs.discard(doc_id)
+        if not year_docs:
+            del self.year_docs[keys["year"]]
+            if keys["year"] is not None:
+                self.years.remove(keys["year"])
+        self.read_docs[keys["read"]].discard(doc_id)
+
+
+# Check indexed keys against the read status and year range filters
+def _in_filters(keys, status, year_min, year_max):
+    if status is not None and keys["read"] != status:
+        return False
+    year = keys["year"]
+    if year_min is not None and (year is None or year < year_min):
+        return False
+    if year_max is not None and (year is None or year > year_max):
+        return False
+    return True
@@ -0,0 +1,82 @@
+# Startup timing report, turned on with LIBRARY_STARTUP_TIMING=1
+#
+# While it is on, every import is timed (by wrapping builtins.__import__) and
+# at the end of each script run the app prints to stderr:
+#   * the modules the app imported itself during that run, slowest first,
+#     each with everything it pulled in (the first run of a process shows the
+#     cold-start imports, later runs the ones a view loaded on first use)
+#   * the time of the first run of every session, and for the first run in
+#     the process also how long the process had been running (from /proc on
+#     Linux), i.e. the time to the first render after a cold start
+# With it off, install() does nothing and nothing is timed.
+import builtins
+import os
+import sys
+import threading
+import time
+
+ENABLED = os.environ.get("LIBRARY_STARTUP_TIMING", "").lower() in ("1", "true", "yes")
+
+_original_import = builtins.__import__
+_local = threading.local()
+_lock = threading.Lock()
+_imports = []         # (module, seconds) imported directly by the app, not reported yet
+_first_run_done = False
+
+
+# Seconds since this process started, where the OS tells us
+def process_age():
+    try:
+        with open("/proc/self/stat") as file:
+            start_ticks = int(file.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as file:
+            uptime = float(file.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level or name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+    depth = getattr(_local, "depth", 0)
+    _local.depth = depth + 1
+    start = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _local.depth = depth
+        # Only imports made by the app's own modules are listed; the time of
+        # everything they import is included in theirs
+        if depth == 0:
+            with _lock:
+                _imports.append((name, time.perf_counter() - start))
+
+
+def install():
+    if ENABLED and builtins.__import__ is _original_import:
+        builtins.__import__ = _timed_import
+
+
+# Print the report for a script run that started at `run_start`
+# (time.perf_counter()); `first_in_session` says whether it was the session's first run
+def report(run_start, first_in_session):
+    global _first_run_done
+    if not ENABLED:
+        return
+    run_seconds = time.perf_counter() - run_start
+    with _lock:
+        imports, _imports[:] = sorted(_imports, key=lambda item: item[1], reverse=True), []
+        first_in_process, _first_run_done = not _first_run_done, True
+    lines = []
+    if first_in_process:
+        age = process_age()
+        lines.append(f"[startup] first render after {age:.2f}s of process time" if age is not None
+                     else "[startup] first render in this process")
+    if first_in_process or first_in_session:
+        lines.append(f"[startup] first run of a session: {run_seconds * 1000:.0f} ms")
+    if imports:
+        lines.append(f"[startup] imports in this run: {sum(seconds for _, seconds in imports) * 1000:.0f} ms")
+        lines += [f"[startup]   {name:<30} {seconds * 1000:8.1f} ms" for name, seconds in imports]
+    if lines:
+        print("\n".join(lines), file=sys.stderr)
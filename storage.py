@@ -0,0 +1,727 @@
+# Storage backends for the library data
+#
+# Every backend exposes the same small API so library_manager.py does not care
+# which one is in use:
+#   load()                      -> list of book dicts
+#   save(books)                 -> rewrite everything (used for bulk changes)
+#   add(books, book)            -> persist a book that was appended to `books`
+#   add_many(books, new_books)  -> persist several appended books in one write
+#   remove(books, book_id)      -> persist a removal that was applied to `books`
+#   update(books, book_id, fields) -> persist a field change applied to `books`
+#   commit(books, ops)          -> persist several log operations (see replay())
+#                                  in one write (file backends, for write_behind.py)
+#
+# The mutation methods are called *after* the in-memory list was changed, so a
+# backend that can only rewrite the whole file simply saves `books`.
+#
+# Every book has a stable "id" and a "version" that goes up by one on each
+# update. The file backends are shared by all sessions of the process and are
+# guarded by `lock` (threads) and `file_lock` (other processes, `<path>.lock`);
+# the repository checks versions while holding both (see write_locked()).
+# SQLite does the version check in the UPDATE/DELETE itself.
+#
+# Snapshots are JSON or binary record files (record_file.py, memory-mapped and
+# decoded lazily); `snapshot_format` picks what is written, and reading
+# detects the format, so switching it converts the file on the next save.
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock is used
+    fcntl = None
+
+from record_file import LazyBook, is_record_file, read_records, write_records
+from records import to_bool
+
+LIBRARY_FILE = "library.json"
+SNAPSHOT_FORMATS = ("json", "binary")
+
+
+# -------------------- FILE HELPERS --------------------
+# Records that are not dicts (records.Book) are written through their to_dict()
+def json_default(value):
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+# Write `path` without ever leaving a half-written file behind: `write(file)`
+# fills a temp file next to it, which is fsynced and atomically swapped in
+# with os.replace
+def atomic_write(path, write, mode="w", suffix=".json"):
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=suffix, dir=folder)
+    try:
+        with os.fdopen(fd, mode) as file:
+            write(file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# json.dump() streams the text but encodes in pure Python. Small files
+# (statistics, rollups) pass stream=False to be encoded in one go by the much
+# faster C encoder; snapshots stream so the text is never all in memory.
+def atomic_write_json(path, data, stream=True):
+    if stream:
+        atomic_write(path, lambda file: json.dump(data, file, default=json_default))
+    else:
+        atomic_write(path, lambda file: file.write(json.dumps(data, default=json_default)))
+
+
+# (mtime, size) of each file, used to tell whether the data changed on disk
+def file_fingerprint(*paths):
+    result = []
+    for path in paths:
+        try:
+            info = os.stat(path)
+            result.append((info.st_mtime_ns, info.st_size))
+        except FileNotFoundError:
+            result.append(None)
+    return tuple(result)
+
+
+# Read a snapshot file. Binary record files are detected by their magic bytes;
+# for JSON, plain lists (the original library.json layout) are accepted as well
+# as {"seq": n, "books": [...]} written by LogStorage.
+def read_snapshot(path):
+    if not os.path.exists(path):
+        return [], 0
+    if is_record_file(path):
+        return read_records(path)
+    with open(path, "r") as file:
+        data = json.load(file)
+    if isinstance(data, dict):
+        return data.get("books", []), data.get("seq", 0)
+    return data, 0
+
+
+# Write a snapshot in `snapshot_format`. JsonStorage passes no `seq` and gets
+# the original plain-list layout.
+def write_snapshot(path, books, seq=None, snapshot_format="json"):
+    if snapshot_format == "binary":
+        atomic_write(path, lambda file: write_records(file, books, seq), mode="wb", suffix=".bin")
+    elif seq is None:
+        atomic_write_json(path, books)
+    else:
+        atomic_write_json(path, {"seq": seq, "books": books})
+
+
+# Lock file shared by every process that writes the same library. Re-entrant
+# within the thread that holds it; callers serialize threads themselves.
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.depth = 0
+
+    def __enter__(self):
+        if self.depth == 0 and fcntl is not None:
+            if self.file is None:
+                self.file = open(self.path, "a")
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.depth -= 1
+        if self.depth == 0 and self.file is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+
+
+# Hold both the in-process and the cross-process lock of a file backend
+@contextmanager
+def write_locked(storage):
+    with storage.lock, storage.file_lock:
+        yield
+
+
+# -------------------- RECORD HELPERS --------------------
+# Book fields, in column order
+BOOK_FIELDS = ("title", "author", "publication_year", "genre", "read_status", "pages", "date_added")
+
+# Constraints of the Add Book form, shared with bulk import
+GENRES = [
+    "Fiction", "Non-Fiction", "Science Fiction", "Fantasy", "Mystery", "Thriller", "Romance",
+    "Biography", "Autobiography", "Self-Help", "Historical Fiction", "Young Adult", "Children's",
+    "Poetry", "Graphic Novel", "Others"
+]
+MIN_YEAR = 1000
+MIN_PAGES = 1
+MAX_PAGES = 10000
+
+
+# Raised when a book was changed by someone else since it was read
+class ConflictError(Exception):
+    pass
+
+
+def new_id():
+    return uuid.uuid4().hex
+
+
+# Give books saved before ids existed an id and a version. Returns how many changed.
+# Records from a binary snapshot always have both (and are not decoded here).
+def assign_ids(books):
+    changed = 0
+    for book in books:
+        if type(book) is LazyBook:
+            continue
+        if "id" not in book:
+            book["id"] = new_id()
+            changed += 1
+        if "version" not in book:
+            book["version"] = 1
+            changed += 1
+    return changed
+
+
+# Return a copy of `book` with legacy keys/values cleaned up
+def normalize_book(book):
+    book = dict(book)
+    if "date_added" not in book and "addad_data" in book:
+        book["date_added"] = book.pop("addad_data")
+    book["read_status"] = to_bool(book.get("read_status", False))
+    return book
+
+
+# -------------------- WHOLE-FILE JSON BACKEND --------------------
+# Original behaviour: every change rewrites library.json (now atomically)
+class JsonStorage:
+    def __init__(self, path=LIBRARY_FILE, snapshot_format="json"):
+        self.path = path
+        self.snapshot_format = snapshot_format
+        self.lock = threading.RLock()
+        self.file_lock = FileLock(path + ".lock")
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def fingerprint(self):
+        return file_fingerprint(self.path)
+
+    def load(self):
+        books, _ = read_snapshot(self.path)
+        if assign_ids(books):
+            with write_locked(self):
+                self.save(books)
+        return books
+
+    def save(self, books):
+        write_snapshot(self.path, books, snapshot_format=self.snapshot_format)
+
+    def add(self, books, book):
+        self.save(books)
+
+    def add_many(self, books, new_books):
+        self.save(books)
+
+    def remove(self, books, book_id, expected_version=None):
+        self.save(books)
+
+    def update(self, books, book_id, fields, expected_version=None):
+        self.save(books)
+
+    def commit(self, books, ops):
+        self.save(books)
+
+
+# -------------------- APPEND-ONLY LOG BACKEND --------------------
+# Snapshot + operation log. Each mutation appends one JSON line to
+# `<path>.log`, so a click costs O(1) I/O instead of a full rewrite. After
+# `compact_every` operations the current list is written as a new snapshot and
+# the log is truncated.
+#
+# Every log entry carries a sequence number and the snapshot records the last
+# sequence it contains, so a crash between writing the snapshot and truncating
+# the log never replays an operation twice. A torn last line (crash while
+# appending) is cut off on load.
+class LogStorage:
+    def __init__(self, path=LIBRARY_FILE, compact_every=1000, fsync=True, snapshot_format="json"):
+        self.path = path
+        self.snapshot_format = snapshot_format
+        self.log_path = path + ".log"
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.seq = None
+        self.pending_ops = 0
+        # Sessions share one backend per file; appends must not interleave
+        self.lock = threading.RLock()
+        self.file_lock = FileLock(path + ".lock")
+
+    def exists(self):
+        return os.path.exists(self.path) or os.path.exists(self.log_path)
+
+    def fingerprint(self):
+        return file_fingerprint(self.path, self.log_path)
+
+    # Under the file lock: another process could otherwise compact between
+    # reading the snapshot and the log, or be halfway through an append
+    def load(self):
+        with write_locked(self):
+            books, snapshot_seq = read_snapshot(self.path)
+            self.seq = snapshot_seq
+            ops = [op for op in self._read_log() if op["seq"] > snapshot_seq]
+            replay(books, ops)
+            if ops:
+                self.seq = ops[-1]["seq"]
+            self.pending_ops = len(ops)
+            if assign_ids(books):
+                self.compact(books)
+            return books
+
+    def save(self, books):
+        self.compact(books)
+
+    def add(self, books, book):
+        self._append(books, [{"op": "add", "book": book}])
+
+    def add_many(self, books, new_books):
+        self._append(books, [{"op": "add", "book": book} for book in new_books])
+
+    def remove(self, books, book_id, expected_version=None):
+        self._append(books, [{"op": "remove", "id": book_id}])
+
+    def update(self, books, book_id, fields, expected_version=None):
+        self._append(books, [{"op": "update", "id": book_id, "fields": fields}])
+
+    def commit(self, books, ops):
+        self._append(books, [dict(op) for op in ops])
+
+    # Write the full list as a snapshot and start an empty log
+    def compact(self, books):
+        with self.lock:
+            if self.seq is None:
+                self.seq = self._last_seq()
+            write_snapshot(self.path, books, self.seq, self.snapshot_format)
+            with open(self.log_path, "w"):
+                pass
+            self.pending_ops = 0
+
+    # Append operations with a single write (and fsync)
+    def _append(self, books, ops):
+        with self.lock:
+            if self.seq is None:
+                self.seq = self._last_seq()
+            lines = []
+            for op in ops:
+                self.seq += 1
+                op["seq"] = self.seq
+                lines.append(json.dumps(op, default=json_default) + "\n")
+            with open(self.log_path, "a") as file:
+                file.write("".join(lines))
+                file.flush()
+                if self.fsync:
+                    os.fsync(file.fileno())
+            self.pending_ops += len(ops)
+            if self.pending_ops >= self.compact_every:
+                self.compact(books)
+
+    def _read_log(self):
+        if not os.path.exists(self.log_path):
+            return []
+        ops = []
+        good_offset = 0
+        with open(self.log_path, "rb") as file:
+            for line in file:
+                # A line without its newline, or one that does not parse, is a
+                # torn write at the end of the log
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    ops.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+                good_offset += len(line)
+        # Cut the torn tail off so the next append starts on a clean line. Only
+        # under the file lock: without it the tail may be another process's
+        # append still being written.
+        if self.file_lock.depth and good_offset < os.path.getsize(self.log_path):
+            with open(self.log_path, "r+b") as file:
+                file.truncate(good_offset)
+        return ops
+
+    def _last_seq(self):
+        _, seq = read_snapshot(self.path)
+        for op in self._read_log():
+            seq = max(seq, op["seq"])
+        return seq
+
+
+# -------------------- SQLITE BACKEND --------------------
+# One row per book in a `books` table (WAL mode, indexed on the columns the UI
+# filters and groups by). Unlike the JSON backends it also answers queries
+# itself, so filtering, counting and pagination run in the database.
+#
+# Books are addressed by the `uid` column (the book "id"); the integer row id
+# only keeps the order books were added in.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid TEXT,
+    version INTEGER NOT NULL DEFAULT 1,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    publication_year INTEGER,
+    genre TEXT,
+    read_status INTEGER NOT NULL DEFAULT 0,
+    pages INTEGER,
+    date_added TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_books_author ON books(author);
+CREATE INDEX IF NOT EXISTS idx_books_genre ON books(genre);
+CREATE INDEX IF NOT EXISTS idx_books_year ON books(publication_year);
+CREATE INDEX IF NOT EXISTS idx_books_read_status ON books(read_status);
+"""
+UID_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS idx_books_uid ON books(uid)"
+
+# Expressions the repository may group or sort by
+SQL_EXPRESSIONS = {
+    "title": "title",
+    "author": "author",
+    "genre": "genre",
+    "publication_year": "publication_year",
+    "date_added": "date_added",
+    "read_status": "read_status",
+    "pages": "pages",
+    "decade": "(publication_year / 10) * 10",
+    "id": "uid",
+}
+
+
+class SqliteStorage:
+    def __init__(self, path="library.db", migrate_from=LIBRARY_FILE):
+        self.path = path
+        self.migrate_from = migrate_from
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def exists(self):
+        return os.path.exists(self.path) or bool(self.migrate_from and os.path.exists(self.migrate_from))
+
+    # Changes with every committed write (WAL mode appends to the -wal file first)
+    def fingerprint(self):
+        return file_fingerprint(self.path, self.path + "-wal")
+
+    def connect(self):
+        if self.conn is None:
+            is_new = not os.path.exists(self.path)
+            # Streamlit runs each session in its own thread; access is serialized by self.lock
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.row_factory = sqlite3.Row
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(SCHEMA)
+            self._add_uid_column()
+            if is_new and self.migrate_from and os.path.exists(self.migrate_from):
+                self._insert_many(LogStorage(self.migrate_from).load())
+        return self.conn
+
+    def load(self):
+        return self.query()
+
+    # Close the connection; the next call opens it again
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def save(self, books):
+        with self.lock:
+            self._insert_many(books, replace=True)
+
+    def add(self, books, book):
+        with self.lock:
+            self._insert_many([book])
+
+    def add_many(self, books, new_books):
+        with self.lock:
+            self._insert_many(new_books)
+
+    # Delete `book_id`, only if it is still at `expected_version` (when given).
+    # Returns False if there is no such book.
+    def remove(self, books, book_id, expected_version=None):
+        sql, params = "DELETE FROM books WHERE uid = ?", [book_id]
+        if expected_version is not None:
+            sql += " AND version = ?"
+            params.append(expected_version)
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                if conn.execute(sql, params).rowcount:
+                    return True
+            return self._check_conflict(book_id)
+
+    # Compare-and-swap field update: bumps the version, and only applies if the
+    # book is still at `expected_version` (when given)
+    def update(self, books, book_id, fields, expected_version=None):
+        fields = {key: value for key, value in fields.items() if key in BOOK_FIELDS}
+        if "read_status" in fields:
+            fields["read_status"] = int(to_bool(fields["read_status"]))
+        assignments = "".join(f"{key} = ?, " for key in fields)
+        sql = f"UPDATE books SET {assignments}version = version + 1 WHERE uid = ?"
+        params = [*fields.values(), book_id]
+        if expected_version is not None:
+            sql += " AND version = ?"
+            params.append(expected_version)
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                if conn.execute(sql, params).rowcount:
+                    return True
+            return self._check_conflict(book_id)
+
+    # Nothing was changed: raise if the book exists (so its version moved on)
+    def _check_conflict(self, book_id):
+        if self.conn.execute("SELECT 1 FROM books WHERE uid = ?", (book_id,)).fetchone():
+            raise ConflictError(f"Book {book_id} was changed by someone else")
+        return False
+
+    # The book with `book_id`, or None
+    def get(self, book_id):
+        with self.lock:
+            row = self.connect().execute("SELECT * FROM books WHERE uid = ?", (book_id,)).fetchone()
+        return self._row_to_book(row) if row is not None else None
+
+    # Return the books matching `filters`, sorted and paginated in SQL
+    def query(self, filters=None, order_by=None, descending=False, limit=None, offset=0):
+        where, params = self._where(filters)
+        sql = f"SELECT * FROM books {where}"
+        if order_by:
+            sql += f" ORDER BY {SQL_EXPRESSIONS[order_by]} {'DESC' if descending else 'ASC'}, id"
+        else:
+            sql += " ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        with self.lock:
+            rows = self.connect().execute(sql, params).fetchall()
+        return [self._row_to_book(row) for row in rows]
+
+    def count(self, filters=None):
+        where, params = self._where(filters)
+        with self.lock:
+            return self.connect().execute(f"SELECT COUNT(*) FROM books {where}", params).fetchone()[0]
+
+    def sum(self, field, filters=None):
+        where, params = self._where(filters)
+        with self.lock:
+            total = self.connect().execute(f"SELECT SUM({SQL_EXPRESSIONS[field]}) FROM books {where}", params).fetchone()[0]
+        return total or 0
+
+    # Return {value: count} for a column or expression (e.g. "genre", "decade")
+    def group_count(self, field, filters=None):
+        where, params = self._where(filters)
+        expression = SQL_EXPRESSIONS[field]
+        with self.lock:
+            rows = self.connect().execute(
+                f"SELECT {expression} AS value, COUNT(*) FROM books {where} GROUP BY value", params
+            ).fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    # Insert `books` in one transaction (caller holds self.lock); with
+    # replace=True they replace every stored book in the same transaction, so
+    # a failed insert leaves the old books in place
+    def _insert_many(self, books, replace=False):
+        rows = []
+        for book in books:
+            book = normalize_book(book)
+            rows.append((
+                book.get("id") or new_id(), book.get("version", 1), book.get("title", ""), book.get("author", ""), book.get("publication_year"),
+                book.get("genre"), int(book["read_status"]), book.get("pages"), book.get("date_added"),
+            ))
+        conn = self.connect()
+        with conn:
+            if replace:
+                conn.execute("DELETE FROM books")
+            conn.executemany(
+                "INSERT INTO books (uid, version, title, author, publication_year, genre, read_status, pages, "
+                "date_added) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    # Build a WHERE clause from repository filters (see repository.FILTER_KEYS)
+    def _where(self, filters):
+        clauses, params = [], []
+        for key, value in (filters or {}).items():
+            if value is None:
+                continue
+            if key in ("author", "genre"):
+                clauses.append(f"{key} = ?")
+                params.append(value)
+            elif key == "read_status":
+                clauses.append("read_status = ?")
+                params.append(int(to_bool(value)))
+            elif key == "year_min":
+                clauses.append("publication_year >= ?")
+                params.append(value)
+            elif key == "year_max":
+                clauses.append("publication_year <= ?")
+                params.append(value)
+            elif key.endswith("_contains"):
+                column = key[: -len("_contains")]
+                if column in ("title", "author", "genre"):
+                    clauses.append(f"instr(lower({column}), ?) > 0")
+                    params.append(str(value).lower())
+            elif key == "id_after":
+                clauses.append("uid > ?")
+                params.append(value)
+        return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    # Databases created before books had ids get the uid/version columns
+    def _add_uid_column(self):
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(books)")}
+        if "uid" not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE books ADD COLUMN uid TEXT")
+                self.conn.execute("ALTER TABLE books ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+                ids = [(new_id(), row[0]) for row in self.conn.execute("SELECT id FROM books")]
+                self.conn.executemany("UPDATE books SET uid = ? WHERE id = ?", ids)
+        self.conn.execute(UID_INDEX)
+
+    def _row_to_book(self, row):
+        return {
+            "id": row["uid"],
+            "version": row["version"],
+            "title": row["title"],
+            "author": row["author"],
+            "publication_year": row["publication_year"],
+            "genre": row["genre"],
+            "read_status": bool(row["read_status"]),
+            "pages": row["pages"],
+            "date_added": row["date_added"],
+        }
+
+
+# Copy an existing JSON library (snapshot + log) into a new SQLite database
+def migrate_json_to_sqlite(json_path=LIBRARY_FILE, db_path="library.db"):
+    if os.path.exists(db_path):
+        raise FileExistsError(f"{db_path} already exists; refusing to migrate over it")
+    db = SqliteStorage(db_path, migrate_from=json_path)
+    db.connect()
+    return db.count()
+
+
+# Apply log operations to an in-memory list of books. Removals are collected
+# and done in one pass at the end instead of one list scan per operation.
+# An update/remove carrying "expected" only applies if the book is still at
+# that version. Returns the number of operations skipped for that reason.
+def replay(books, ops):
+    by_id = None
+    removed = set()
+    skipped = 0
+    for op in ops:
+        if "index" in op:
+            # Logs written before books had ids address them by position
+            if removed:
+                books[:] = [book for book in books if book.get("id") not in removed]
+                removed.clear()
+            apply_positional_op(books, op)
+            by_id = None
+            continue
+        if by_id is None:
+            by_id = {book["id"]: book for book in books if "id" in book}
+        if op["op"] == "add":
+            books.append(op["book"])
+            by_id[op["book"].get("id")] = op["book"]
+            continue
+        book = by_id.get(op["id"])
+        if book is None:
+            continue
+        if op.get("expected") is not None and op["expected"] != book.get("version"):
+            skipped += 1
+        elif op["op"] == "remove":
+            del by_id[op["id"]]
+            removed.add(op["id"])
+        elif op["op"] == "update":
+            book.update(op["fields"])
+    if removed:
+        books[:] = [book for book in books if book.get("id") not in removed]
+    return skipped
+
+
+def apply_positional_op(books, op):
+    if op["op"] == "add":
+        books.append(op["book"])
+    elif op["op"] == "remove":
+        if 0 <= op["index"] < len(books):
+            del books[op["index"]]
+    elif op["op"] == "update":
+        if 0 <= op["index"] < len(books):
+            books[op["index"]].update(op["fields"])
+
+
+# -------------------- BACKEND SELECTION --------------------
+BACKENDS = {
+    "json": JsonStorage,
+    "log": LogStorage,
+    "sqlite": SqliteStorage,
+}
+
+
+# Backends already opened in this process, keyed by (kind, path)
+_open_backends = {}
+_open_backends_lock = threading.Lock()
+
+
+# Get the storage backend by name ("json", "log" or "sqlite").
+# There is one instance per file per process: Streamlit re-executes the app
+# script on every rerun and for every session, and they must all share the
+# same backend (log sequence numbers, SQLite connection).
+# The SQLite database lives next to the JSON file and is seeded from it once.
+# `snapshot_format` ("json" or "binary") is what the JSON backends write.
+def get_storage(kind="log", path=LIBRARY_FILE, snapshot_format="json"):
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown storage backend '{kind}'. Choose one of: {', '.join(BACKENDS)}")
+    if snapshot_format not in SNAPSHOT_FORMATS:
+        raise ValueError(f"Unknown snapshot format '{snapshot_format}'. Choose one of: {', '.join(SNAPSHOT_FORMATS)}")
+    with _open_backends_lock:
+        key = (kind, os.path.abspath(path))
+        if key not in _open_backends:
+            if kind == "sqlite":
+                _open_backends[key] = SqliteStorage(os.path.splitext(path)[0] + ".db", migrate_from=path)
+            else:
+                _open_backends[key] = BACKENDS[kind](path, snapshot_format=snapshot_format)
+        return _open_backends[key]
+
+
+# Rewrite a JSON library (snapshot + log) as one snapshot in `snapshot_format`
+def convert_snapshot(path=LIBRARY_FILE, snapshot_format="binary"):
+    storage = LogStorage(path, snapshot_format=snapshot_format)
+    with write_locked(storage):
+        books = storage.load()
+        storage.compact(books)
+    return len(books)
+
+
+# One-shot migration/conversion from the command line:
+#   python storage.py migrate [library.json] [library.db]
+#   python storage.py convert [library.json] [binary|json]
+if __name__ == "__main__":
+    import sys
+
+    usage = "usage: python storage.py migrate [library.json] [library.db]\n" \
+            "       python storage.py convert [library.json] [binary|json]"
+    if len(sys.argv) < 2 or sys.argv[1] not in ("migrate", "convert"):
+        print(usage)
+        sys.exit(1)
+    source = sys.argv[2] if len(sys.argv) > 2 else LIBRARY_FILE
+    if sys.argv[1] == "convert":
+        snapshot_format = sys.argv[3] if len(sys.argv) > 3 else "binary"
+        if snapshot_format not in SNAPSHOT_FORMATS:
+            print(usage)
+            sys.exit(1)
+        print(f"Wrote {convert_snapshot(source, snapshot_format)} books to {source} as {snapshot_format}")
+        sys.exit(0)
+    target = sys.argv[3] if len(sys.argv) > 3 else "library.db"
+    print(f"Migrated {migrate_json_to_sqlite(source, target)} books from {source} to {target}")
@@ -0,0 +1,278 @@
+# Several libraries (per user or per collection), one shard each
+#
+# With LIBRARY_TENANTS_DIR set, the app serves many libraries instead of the
+# one library.json. Each lives in its own shard in that directory:
+# `<name>.json` with its log, statistics and reading history next to it for
+# the JSON backends, `<name>.db` for SQLite (LIBRARY_STORAGE and LIBRARY_FORMAT
+# apply to all of them). Names are letters, digits, "-" and "_".
+#
+# A shard is opened the first time its library is used: its backend,
+# write-behind queue and event log, plus the parsed books, search index and
+# statistics the shared caches hold for it. At most LIBRARY_MAX_OPEN (default
+# 16) are open at once; opening another closes the least recently used one:
+# its queued changes are written, its SQLite connection is closed and its data
+# is dropped from the caches. Memory follows the libraries in use, not how
+# many there are. A repository a session got before its shard was closed
+# keeps working (it reloads the books, and its changes are written at once).
+#
+# aggregate() runs a function for many libraries in a thread pool of
+# LIBRARY_FANOUT_THREADS (default 8) and returns the results per library;
+# library_core.py merges them for the "All Libraries" view. These reads never
+# open a shard, so they do not push the libraries in use out of the LRU.
+# Statistics of a library that is not open come from its saved aggregates when
+# they still match its files; otherwise it is read into a private cache that
+# is dropped afterwards, and searching it scans its books instead of building
+# a search index for one query.
+#
+#   python tenants.py list [--dir libraries]
+import logging
+import os
+import re
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from library_cache import LibraryCache, shared_cache
+from library_stats import load_stats, stats_path
+from query_cache import TEXT_CRITERIA
+from reading_log import EventLog
+from repository import LibraryRepository
+from storage import BACKENDS, SNAPSHOT_FORMATS, SqliteStorage
+from write_behind import DEFAULT_MAX_BATCH, DEFAULT_MAX_DELAY, WriteBehind
+
+TENANTS_DIR = "libraries"
+DEFAULT_MAX_OPEN = 16
+DEFAULT_THREADS = 8
+NAME_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]{0,63}")
+SHARD_FILE = re.compile(r"([A-Za-z0-9][A-Za-z0-9_-]{0,63})\.(?:json|json\.log|db)")
+
+logger = logging.getLogger(__name__)
+
+
+def check_name(name):
+    if not isinstance(name, str) or not NAME_PATTERN.fullmatch(name):
+        raise ValueError(f"Invalid library name {name!r}: use up to 64 letters, digits, '-' and '_'")
+    return name
+
+
+# One open library: what a repository of it needs, and how to let it go
+class Shard:
+    def __init__(self, name, storage, writer, events, cache):
+        self.name = name
+        self.storage = storage
+        self.writer = writer
+        self.events = events
+        self.cache = cache
+
+    # A new repository (one per session or request), loaded
+    def repository(self):
+        repo = LibraryRepository(self.storage, self.cache, self.writer, events=self.events)
+        repo.load()
+        return repo
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if hasattr(self.storage, "close"):
+            self.storage.close()
+        self.cache.forget(self.storage)
+        analytics = sys.modules.get("analytics")  # only loaded once the statistics view was used
+        if analytics is not None:
+            analytics.shared_frames.forget(self.storage.path)
+
+
+class TenantPool:
+    def __init__(self, directory=TENANTS_DIR, kind="log", snapshot_format="json", max_open=DEFAULT_MAX_OPEN,
+                 write_delay=DEFAULT_MAX_DELAY, write_batch=DEFAULT_MAX_BATCH, threads=DEFAULT_THREADS,
+                 cache=shared_cache):
+        if kind not in BACKENDS:
+            raise ValueError(f"Unknown storage backend '{kind}'. Choose one of: {', '.join(BACKENDS)}")
+        if snapshot_format not in SNAPSHOT_FORMATS:
+            raise ValueError(f"Unknown snapshot format '{snapshot_format}'. Choose one of: {', '.join(SNAPSHOT_FORMATS)}")
+        self.directory = directory
+        self.kind = kind
+        self.snapshot_format = snapshot_format
+        self.max_open = max(1, max_open)
+        self.write_delay = write_delay
+        self.write_batch = write_batch
+        self.threads = threads
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.shards = OrderedDict()  # name -> Shard, least recently used first
+        # Backends stay shared for as long as anything uses them, so a session
+        # holding a closed shard's repository and the reopened shard never
+        # keep two log sequence counters for one file
+        self.backends = weakref.WeakValueDictionary()
+        self.executor = None
+        self.opened = 0
+        self.closed = 0
+
+    # The library file of `name` (the SQLite database sits next to it)
+    def path(self, name):
+        return os.path.join(self.directory, check_name(name) + ".json")
+
+    # Names of the libraries in the directory and of those open (whose first
+    # books may still be queued), sorted
+    def names(self):
+        try:
+            files = os.listdir(self.directory)
+        except FileNotFoundError:
+            files = []
+        with self.lock:
+            names = set(self.shards)
+        return sorted(names | {match.group(1) for match in map(SHARD_FILE.fullmatch, files) if match})
+
+    # A new repository on library `name`, opening its shard if needed. The
+    # library is created by its first change.
+    def repository(self, name):
+        return self._shard(name).repository()
+
+    def _shard(self, name):
+        with self.lock:
+            shard = self.shards.get(name)
+            if shard is not None:
+                self.shards.move_to_end(name)
+                return shard
+            shard = self._open(name)
+            self.shards[name] = shard
+            # Closed under the lock, so the library is not reopened (and
+            # reloaded into the cache) while its queued changes are written
+            while len(self.shards) > self.max_open:
+                self.shards.popitem(last=False)[1].close()
+                self.closed += 1
+            return shard
+
+    def _open(self, name):
+        path = self.path(name)
+        os.makedirs(self.directory, exist_ok=True)
+        storage = self._storage(path)
+        writer = None
+        if self.write_delay > 0 and hasattr(storage, "commit"):
+            writer = WriteBehind(storage, self.cache, self.write_batch, self.write_delay)
+        self.opened += 1
+        return Shard(name, storage, writer, EventLog(path), self.cache)
+
+    # The backend of the library file `path`, shared while anything uses it
+    # (called with self.lock held)
+    def _storage(self, path):
+        storage = self.backends.get(path)
+        if storage is None:
+            if self.kind == "sqlite":
+                storage = SqliteStorage(os.path.splitext(path)[0] + ".db", migrate_from=path)
+            else:
+                storage = BACKENDS[self.kind](path, snapshot_format=self.snapshot_format)
+            self.backends[path] = storage
+        return storage
+
+    # A loaded repository on library `name` for one read: the open shard's if
+    # there is one, else one with a private cache, leaving the LRU as it is
+    def _reader(self, name):
+        with self.lock:
+            shard = self.shards.get(name)
+            if shard is None:
+                path = self.path(name)
+                storage = self._storage(path)
+        if shard is not None:
+            return shard.repository(), True
+        repo = LibraryRepository(storage, LibraryCache(), events=EventLog(path))
+        repo.load()
+        return repo, False
+
+    # Close library `name` if it is open (its queued changes are written)
+    def close(self, name):
+        with self.lock:
+            shard = self.shards.pop(name, None)
+            if shard is not None:
+                shard.close()
+                self.closed += 1
+
+    def close_all(self):
+        with self.lock:
+            while self.shards:
+                self.shards.popitem(last=False)[1].close()
+                self.closed += 1
+
+    # Statistics (LibraryStats) of library `name`, without opening it. A
+    # library that is not open is answered from its saved aggregates if they
+    # match its files.
+    def stats(self, name):
+        with self.lock:
+            is_open = name in self.shards
+        if not is_open and self.kind != "sqlite":
+            path = self.path(name)
+            storage = self.backends.get(path) or BACKENDS[self.kind](path, snapshot_format=self.snapshot_format)
+            stats = load_stats(stats_path(path), storage.fingerprint())
+            if stats is not None:
+                return stats
+        return self._reader(name)[0].stats()
+
+    # Search library `name` like LibraryRepository.search(), without opening
+    # it. A library that is not open is scanned for substrings (as the SQLite
+    # backend matches) rather than indexed: its index would be built for this
+    # one search and dropped. Typo-tolerant searches still build one.
+    def search(self, name, limit=None, **criteria):
+        repo, is_open = self._reader(name)
+        if is_open or criteria.get("fuzzy") or repo.in_database:
+            return repo.search(limit=limit, **criteria)
+        filters = {(f"{field}_contains" if field in TEXT_CRITERIA else field): value
+                   for field, value in criteria.items() if field != "fuzzy"}
+        return repo.query(filters, limit=limit)
+
+    # Run `fn(name)` for every library in `names` (default: all of them) in the
+    # thread pool. Returns ({name: result}, {name: exception}).
+    def aggregate(self, fn, names=None):
+        names = self.names() if names is None else names
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.threads, thread_name_prefix="tenants")
+        futures = {name: self.executor.submit(fn, name) for name in names}
+        results, errors = {}, {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                logger.warning("Library %s failed: %s", name, e)
+                errors[name] = e
+        return results, errors
+
+    def counters(self):
+        with self.lock:
+            return {"open": len(self.shards), "max_open": self.max_open, "opened": self.opened, "closed": self.closed}
+
+
+# Pools already created in this process, one per directory
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# The shared pool of the libraries in `directory`, for every session of this
+# process (the settings of the first call apply)
+def get_pool(directory=TENANTS_DIR, kind="log", snapshot_format="json", max_open=DEFAULT_MAX_OPEN,
+             write_delay=DEFAULT_MAX_DELAY, write_batch=DEFAULT_MAX_BATCH, threads=DEFAULT_THREADS):
+    with _pools_lock:
+        key = os.path.abspath(directory)
+        if key not in _pools:
+            _pools[key] = TenantPool(directory, kind, snapshot_format, max_open, write_delay, write_batch, threads)
+        return _pools[key]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="List the libraries of a multi-library directory")
+    parser.add_argument("action", choices=["list"])
+    parser.add_argument("--dir", default=os.environ.get("LIBRARY_TENANTS_DIR", TENANTS_DIR))
+    args = parser.parse_args()
+
+    pool = TenantPool(args.dir, os.environ.get("LIBRARY_STORAGE", "log"), os.environ.get("LIBRARY_FORMAT", "json"),
+                      write_delay=0)
+    results, errors = pool.aggregate(pool.stats)
+    for name in pool.names():
+        if name in results:
+            stats = results[name]
+            print(f"{name:<30} {stats.total_books:>10,} books {stats.read_books:>10,} read {stats.total_pages:>14,} pages")
+        else:
+            print(f"{name:<30} error: {errors[name]}")
+    pool.close_all()
@@ -0,0 +1,36 @@
+# Tests run against the flat modules in the repository root
+#
+#   python -m pytest tests
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library_cache import LibraryCache  # noqa: E402
+from repository import LibraryRepository  # noqa: E402
+from storage import BACKENDS, SqliteStorage  # noqa: E402
+
+
+def new_book(title, author="Author", year=2000, genre="Fiction", read_status=False, pages=100):
+    return {"title": title, "author": author, "publication_year": year, "genre": genre,
+            "read_status": read_status, "pages": pages, "date_added": "2024-01-01 10:00:00"}
+
+
+# A repository on a new library in a temporary directory, with its own cache.
+# `open_repo()` opens another one on the same files, as a fresh process would.
+@pytest.fixture(params=["json", "log", "sqlite"])
+def open_repo(request, tmp_path):
+    path = str(tmp_path / "library.json")
+
+    def open_repo():
+        if request.param == "sqlite":
+            storage = SqliteStorage(str(tmp_path / "library.db"), migrate_from=path)
+        else:
+            storage = BACKENDS[request.param](path)
+        repo = LibraryRepository(storage, LibraryCache())
+        repo.load()
+        return repo
+
+    return open_repo
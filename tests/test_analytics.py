@@ -0,0 +1,30 @@
+import pytest
+
+import library_core as core
+from conftest import new_book
+from library_cache import LibraryCache
+from repository import LibraryRepository
+from storage import LogStorage
+from write_behind import WriteBehind
+
+pytest.importorskip("pandas")
+
+
+# A change still queued for the files shows in the statistics right away
+def test_analytics_follow_queued_changes(tmp_path):
+    storage = LogStorage(str(tmp_path / "library.json"))
+    cache = LibraryCache()
+    writer = WriteBehind(storage, cache, max_delay=60)
+    try:
+        repo = LibraryRepository(storage, cache, writer)
+        repo.add_many([new_book("Book 0"), new_book("Book 1", genre="Poetry")])
+        assert core.get_library_analytics(repo)["read_books"] == 0
+
+        book = repo.all_books()[0]
+        assert core.set_read_status(repo, book["id"], True, book["version"])
+        assert writer.pending_count() > 0
+        analytics = core.get_library_analytics(repo)
+        assert analytics["read_books"] == 1
+        assert analytics["read_books"] == core.get_library_status(repo)["read_books"]
+    finally:
+        writer.close()
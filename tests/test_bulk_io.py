@@ -0,0 +1,59 @@
+import gc
+import io
+
+import pytest
+
+from bulk_io import export_books, read_batches, validate_row
+from conftest import new_book
+
+
+@pytest.mark.parametrize("field, value", [
+    ("publication_year", 1999.7),
+    ("publication_year", "1999.7"),
+    ("publication_year", True),
+    ("pages", 12.9),
+    ("pages", "twelve"),
+    ("date_added", "yesterday"),
+    ("date_added", "2024-13-45 10:00:00"),
+    ("date_added", "2024-01-01"),
+])
+def test_invalid_values_are_rejected(field, value):
+    with pytest.raises(ValueError, match=field):
+        validate_row(dict(new_book("Book"), **{field: value}))
+
+
+def test_whole_numbers_and_dates_are_accepted():
+    book = validate_row(dict(new_book("Book"), publication_year="1999", pages=120.0,
+                             date_added=" 2024-02-29 08:30:00"))
+    assert (book["publication_year"], book["pages"], book["date_added"]) == (1999, 120, "2024-02-29 08:30:00")
+    assert len(validate_row(dict(new_book("Book"), date_added=None))["date_added"]) == 19
+
+
+class FailingFile(io.BytesIO):
+    def write(self, data):
+        raise OSError("disk full")
+
+
+# The caller's file stays open when reading or writing fails midway
+def test_files_stay_open_on_errors():
+    source = io.BytesIO(b"title,author\nBook,\xff\xfe\n")
+    with pytest.raises(UnicodeDecodeError):
+        list(read_batches(source, "csv"))
+    assert not source.closed
+
+    target = FailingFile()
+    with pytest.raises(OSError):
+        export_books([new_book("Book")], target, "csv")
+    gc.collect()
+    assert not target.closed
+
+
+def test_export_then_read_back():
+    books = [dict(new_book(f"Book {n}"), id=str(n)) for n in range(5)]
+    for fmt in ("csv", "jsonl"):
+        target = io.BytesIO()
+        assert export_books(books, target, fmt, batch_size=2)["rows"] == 5
+        target.seek(0)
+        rows = [row for batch in read_batches(target, fmt) for row in batch]
+        assert [row["title"] for row in rows] == [book["title"] for book in books]
+        assert not target.closed
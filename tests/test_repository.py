@@ -0,0 +1,74 @@
+import pytest
+
+import library_core as core
+from conftest import new_book
+from records import to_bool
+from storage import ConflictError
+
+
+def titles(books):
+    return [book["title"] for book in books]
+
+
+# Removing a book keeps the order of the others, in memory and on disk
+def test_remove_keeps_order(open_repo):
+    repo = open_repo()
+    repo.add_many([new_book(f"Book {n}") for n in range(6)])
+    ids = [book["id"] for book in repo.all_books()]
+    repo._positions()  # built before the removes, as after any earlier one
+
+    assert repo.remove(ids[1])
+    assert repo.remove(ids[4])
+    expected = ["Book 0", "Book 2", "Book 3", "Book 5"]
+    assert titles(repo.all_books()) == expected
+    assert titles(open_repo().all_books()) == expected
+
+    repo.save()  # full snapshot (compacts the log)
+    assert titles(open_repo().all_books()) == expected
+
+
+# Positions recorded before earlier removes still find the right book
+def test_remove_many_keeps_order(open_repo):
+    repo = open_repo()
+    repo.add_many([new_book(f"Book {n}") for n in range(50)])
+    books = repo.all_books()
+    repo._positions()
+    removed = {book["id"] for book in books[::3]}
+    for book_id in sorted(removed):
+        assert repo.remove(book_id)
+    expected = [f"Book {n}" for n in range(50) if n % 3]
+    assert titles(repo.all_books()) == expected
+    assert titles(open_repo().all_books()) == expected
+
+
+# A change made against an old version of a book is refused, and the book is
+# left as the other writer made it
+def test_stale_version_is_refused(open_repo):
+    repo = open_repo()
+    repo.add_many([new_book("Book 0"), new_book("Book 1")])
+    book = repo.all_books()[0]
+    version = book["version"]
+
+    other = open_repo()  # another session or process
+    other.update(book["id"], {"read_status": True}, expected_version=version)
+
+    repo = open_repo()
+    with pytest.raises(ConflictError):
+        repo.update(book["id"], {"title": "Changed"}, expected_version=version)
+    with pytest.raises(ConflictError):
+        repo.remove(book["id"], expected_version=version)
+    assert not core.set_read_status(repo, book["id"], False, version)
+
+    current = next(book for book in open_repo().all_books() if book["title"] == "Book 0")
+    assert to_bool(current["read_status"]) and current["version"] == version + 1
+    assert repo.remove(book["id"], expected_version=version + 1)
+    assert titles(open_repo().all_books()) == ["Book 1"]
+
+
+# A book removed by someone else is reported as gone, not as a conflict
+def test_remove_of_removed_book(open_repo):
+    repo = open_repo()
+    repo.add_many([new_book("Book 0")])
+    book_id = repo.all_books()[0]["id"]
+    assert open_repo().remove(book_id)
+    assert open_repo().remove(book_id) is False
@@ -0,0 +1,61 @@
+import pytest
+
+from conftest import new_book
+
+TITLES = [
+    "Café Society", "CAFE SOCIETY", "cafe", "Über Alles", "über", "Straße", "STRASSE", "İstanbul",
+    "the the the", "The Theory of Everything", "a", "aa aa aa", "Aaaa", "Book 1", "book 10",
+    "Dune", "Dune Messiah", "(Parenthesised) title.", "x", "Ω Omega",
+]
+AUTHORS = ["José Saramago", "jose saramago", "Ann Lee", "Lee Child", "A. A. Milne"]
+GENRES = ["Fiction", "Science Fiction", "Non-Fiction", "Poetry"]
+TERMS = [
+    "é", "e", "E", "ü", "Ü", "ß", "ss", "İ", "i", "a", "aa", "aaa", "A", "the", "the the", "THE THE THE",
+    "caf", "Café", "cafe s", " ", ".", "(", "book 1", "Ω", "dune m", "zz", "fiction", "lee", "ée",
+]
+
+
+# The old search_books(): a case-insensitive substring test of one field
+def linear_search(books, field, term):
+    return {book["id"] for book in books if term.lower() in str(book[field]).lower()}
+
+
+@pytest.fixture
+def repo(open_repo):
+    repo = open_repo()
+    if repo.in_database:
+        pytest.skip("the database matches substrings itself (LIKE)")
+    repo.add_many([new_book(title, AUTHORS[n % len(AUTHORS)], genre=GENRES[n % len(GENRES)])
+                   for n, title in enumerate(TITLES)])
+    return repo
+
+
+# The index answers exactly what a scan of every book answers
+@pytest.mark.parametrize("field", ["title", "author", "genre"])
+def test_search_matches_substring_scan(repo, field):
+    books = repo.all_books()
+    for term in TERMS:
+        found = repo.search(**{field: term})
+        assert len(found) == len({book["id"] for book in found}), term
+        assert {book["id"] for book in found} == linear_search(books, field, term), term
+
+
+# Results with equal scores come back in library order, also after a remove
+def test_equal_scores_keep_library_order(repo):
+    repo.add_many([new_book(f"Saga part {n}") for n in range(6)])
+    saga = [book for book in repo.all_books() if book["title"].startswith("Saga")]
+    assert repo.remove(saga[1]["id"])
+    assert [book["title"] for book in repo.search(title="saga")] == [
+        f"Saga part {n}" for n in (0, 2, 3, 4, 5)]
+
+
+# The index follows adds, updates and removes
+def test_search_after_changes(repo):
+    dune = repo.search(title="dune")
+    assert len(dune) == 2
+    repo.update(dune[0]["id"], {"title": "Arrakis"})
+    assert repo.remove(dune[1]["id"])
+    repo.add_many([new_book("Children of Dune")])
+    books = repo.all_books()
+    for term in ("dune", "arrakis", "du", "children"):
+        assert {book["id"] for book in repo.search(title=term)} == linear_search(books, "title", term)
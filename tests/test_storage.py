@@ -0,0 +1,42 @@
+import json
+import threading
+
+from conftest import new_book
+from storage import FileLock, LogStorage
+
+
+# A load waits for an append another process is still writing (it holds the
+# file lock) instead of cutting it off as a torn tail
+def test_load_waits_for_append_in_progress(tmp_path):
+    path = str(tmp_path / "library.json")
+    writer = LogStorage(path)
+    writer.add_many([], [dict(new_book("Book 0"), id="b0")])
+
+    other_process = FileLock(path + ".lock")  # a separate lock file handle, like another process's
+    line = json.dumps({"op": "add", "book": dict(new_book("Book 1"), id="b1"), "seq": 2}) + "\n"
+    loaded = []
+    with other_process:
+        with open(path + ".log", "a") as file:
+            file.write(line[:20])
+            file.flush()
+            reader = threading.Thread(target=lambda: loaded.append(LogStorage(path).load()))
+            reader.start()
+            reader.join(0.3)
+            assert reader.is_alive()
+            file.write(line[20:])
+    reader.join(5)
+    assert [book["title"] for book in loaded[0]] == ["Book 0", "Book 1"]
+
+
+# A tail left torn by a crash is cut off on load, and later appends follow
+def test_torn_tail_is_cut_on_load(tmp_path):
+    path = str(tmp_path / "library.json")
+    storage = LogStorage(path)
+    storage.add_many([], [dict(new_book("Book 0"), id="b0")])
+    with open(path + ".log", "a") as file:
+        file.write('{"op": "add", "bo')
+
+    storage = LogStorage(path)
+    books = storage.load()
+    storage.add_many(books, [dict(new_book("Book 1"), id="b1")])
+    assert [book["title"] for book in LogStorage(path).load()] == ["Book 0", "Book 1"]
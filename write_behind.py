@@ -0,0 +1,197 @@
+# Write-behind queue for the file backends
+#
+# With it, a click changes the shared in-memory library and queues the change;
+# a background worker writes queued changes in one batch once `max_batch` are
+# waiting or the oldest has waited `max_delay` seconds. Changes to the same
+# book are coalesced: a book added and then toggled is written once, toggling
+# it twice writes one update, and adding then removing it writes nothing.
+#
+# Durability: a crash loses at most the changes of the last `max_delay`
+# seconds. Pending changes are written when the process exits (atexit), before
+# the library is re-read because another process changed the files, on
+# flush() and on close(), after which changes are written as they are made.
+# `max_delay=0` (LIBRARY_WRITE_DELAY=0) turns the queue off and every change
+# is written before the click returns, as without it.
+#
+# It has the same mutation API as the backends, so LibraryRepository uses it in
+# their place (SQLite writes are compare-and-swap in the database and are not
+# queued). Version checks between sessions of one process are unaffected, but
+# another process only sees queued changes once they are written; if it
+# changed the same book first, the queued change is dropped when it is merged
+# (and logged). Run several server processes on one library with
+# LIBRARY_WRITE_DELAY=0 to have conflicts reported to the user instead.
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from library_cache import shared_cache
+from storage import replay, write_locked
+
+DEFAULT_MAX_BATCH = 500
+DEFAULT_MAX_DELAY = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+# Put `op` into the pending {book id: op} dict, merging it with what is there.
+# The merged operation keeps the version the book had on disk ("expected").
+def coalesce(pending, op):
+    book_id = op["book"]["id"] if op["op"] == "add" else op["id"]
+    queued = pending.get(book_id)
+    if queued is None:
+        pending[book_id] = op
+    elif op["op"] == "remove":
+        if queued["op"] == "add":
+            del pending[book_id]   # never written, nothing to undo
+        else:
+            op["expected"] = queued.get("expected")
+            pending[book_id] = op
+    elif op["op"] == "update" and queued["op"] == "update":
+        queued["fields"].update(op["fields"])
+    # An update of a queued add needs nothing: the add writes the book as it
+    # is at flush time
+
+
+class WriteBehind:
+    def __init__(self, storage, cache=shared_cache, max_batch=DEFAULT_MAX_BATCH, max_delay=DEFAULT_MAX_DELAY):
+        self.storage = storage
+        self.cache = cache
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.condition = threading.Condition()
+        self.pending = OrderedDict()  # book id -> op, in the order they were queued
+        self.books = None             # the list the pending changes were applied to
+        self.oldest = None            # time.monotonic() of the oldest pending change
+        self.closed = False
+        self.flushes = 0
+        self.written_ops = 0
+        self.worker = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self.worker.start()
+        atexit.register(self.close)
+
+    # -------------------- STORAGE API --------------------
+    def add(self, books, book):
+        self._queue(books, [{"op": "add", "book": book}])
+
+    def add_many(self, books, new_books):
+        self._queue(books, [{"op": "add", "book": book} for book in new_books])
+
+    # `expected_version` is the version the book had before this change
+    def remove(self, books, book_id, expected_version=None):
+        self._queue(books, [{"op": "remove", "id": book_id, "expected": expected_version}])
+
+    def update(self, books, book_id, fields, expected_version=None):
+        self._queue(books, [{"op": "update", "id": book_id, "fields": dict(fields), "expected": expected_version}])
+
+    def _queue(self, books, ops):
+        with self.condition:
+            if not self.closed:
+                for op in ops:
+                    coalesce(self.pending, op)
+                self.books = books
+                # Wake the worker to start the timer, or to write a full batch now
+                if self.oldest is None:
+                    self.oldest = time.monotonic()
+                    self.condition.notify()
+                elif len(self.pending) >= self.max_batch:
+                    self.condition.notify()
+                return
+        # Closed (at exit, or tenants.py closed the library under a session
+        # still using it): write now, after anything queued before
+        with write_locked(self.storage):
+            self.flush()
+            self.storage.commit(books, ops)
+
+    def pending_count(self):
+        with self.condition:
+            return len(self.pending)
+
+    # -------------------- FLUSHING --------------------
+    # Write everything queued so far and return the number of operations
+    # written. Safe to call from any thread, e.g. tests or before a backup.
+    def flush(self):
+        with write_locked(self.storage):
+            with self.condition:
+                pending, books = self.pending, self.books
+                self.pending, self.oldest = OrderedDict(), None
+            if not pending:
+                return 0
+            ops = list(pending.values())
+            try:
+                if self.cache.fingerprint(self.storage, books) == self.storage.fingerprint():
+                    self.storage.commit(books, ops)
+                    self.cache.refresh(self.storage, books)
+                else:
+                    # Another process wrote the files since they were loaded:
+                    # apply our changes on top of what is on disk. The cache
+                    # sees the new files and reloads on the next read.
+                    on_disk = self.storage.load()
+                    skipped = replay(on_disk, ops)
+                    if skipped:
+                        logger.warning("Dropped %d queued change(s) to books another process changed first", skipped)
+                    self.storage.save(on_disk)
+            except Exception:
+                # Keep the changes (and anything queued meanwhile) for the next try
+                with self.condition:
+                    for op in self.pending.values():
+                        coalesce(pending, op)
+                    self.pending = pending
+                    self.oldest = self.oldest or time.monotonic()
+                raise
+            self.flushes += 1
+            self.written_ops += len(ops)
+            return len(ops)
+
+    # Flush and stop the worker (registered with atexit). Changes made after
+    # this are written straight away.
+    def close(self):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify()
+        self.worker.join()
+        self.flush()
+        self.books = None
+        atexit.unregister(self.close)
+
+    def _due(self):
+        if not self.pending:
+            return False
+        return len(self.pending) >= self.max_batch or time.monotonic() - self.oldest >= self.max_delay
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self._due():
+                    if self.closed:
+                        return
+                    timeout = None if not self.pending else self.oldest + self.max_delay - time.monotonic()
+                    self.condition.wait(timeout)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Write-behind flush failed, retrying: %s", e)
+                time.sleep(min(self.max_delay, 1.0))
+
+    def stats(self):
+        with self.condition:
+            return {"pending": len(self.pending), "flushes": self.flushes, "written_ops": self.written_ops}
+
+
+# Queues already started in this process, one per data file
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+# The shared write-behind queue for `storage`, or None when writes should go
+# straight to the backend (max_delay 0, or a backend that answers queries itself)
+def get_write_behind(storage, max_delay=DEFAULT_MAX_DELAY, max_batch=DEFAULT_MAX_BATCH, cache=shared_cache):
+    if max_delay <= 0 or not hasattr(storage, "commit"):
+        return None
+    with _writers_lock:
+        if storage.path not in _writers:
+            _writers[storage.path] = WriteBehind(storage, cache, max_batch, max_delay)
+        return _writers[storage.path]